@@ -0,0 +1,102 @@
+"""Parsing of HTTP Range headers and framing of partial content responses.
+
+Byte positions follow the HTTP convention, so a range (first, last) includes
+both the first and the last byte.
+"""
+
+
+# Requests asking for more ranges than this are served the full content
+# instead, since many tiny ranges cost more to serve than the whole body.
+MAX_RANGES = 20
+
+MULTIPART_BOUNDARY = 'BYTE_RANGE_BOUNDARY'
+
+
+def parse_range_header(header, size):
+    """Finds the byte ranges requested in a Range header.
+
+    Overlapping and adjacent ranges are combined and the result is sorted.
+
+    Args:
+      header: str The value of the Range header, for example 'bytes=0-499'.
+      size: int The length of the full content in bytes.
+
+    Returns:
+      A list of (first, last) tuples, an empty list if none of the ranges can
+      be satisfied, or None if the header is malformed and should be ignored.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    specs = header[len('bytes='):].split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        spec = spec.strip()
+        if '-' not in spec:
+            return None
+        first, last = spec.split('-', 1)
+        first = first.strip()
+        last = last.strip()
+        if not (first.isdigit() or first == '') or not (
+                last.isdigit() or last == ''):
+            return None
+        if first == '':
+            # A suffix range such as -500 asks for the final 500 bytes.
+            if last == '':
+                return None
+            if int(last) == 0 or size == 0:
+                # Empty content has no final bytes to send.
+                continue
+            ranges.append((max(size - int(last), 0), size - 1))
+        else:
+            first = int(first)
+            if last == '':
+                last = size - 1
+            else:
+                last = int(last)
+                if last < first:
+                    return None
+            if first < size:
+                ranges.append((first, min(last, size - 1)))
+    return merge_ranges(ranges)
+
+
+def merge_ranges(ranges):
+    """Sorts ranges and combines any which overlap or touch."""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def content_range(first, last, size):
+    """Returns the Content-Range header value for a range of the content."""
+    return 'bytes %d-%d/%d' % (first, last, size)
+
+
+def multipart_content_type():
+    return 'multipart/byteranges; boundary=%s' % MULTIPART_BOUNDARY
+
+
+def iter_multipart(ranges, size, content_type, read_range):
+    """Yields the body of a multipart/byteranges response.
+
+    Args:
+      ranges: list of (first, last) tuples to include.
+      size: int The length of the full content in bytes.
+      content_type: str The type of the full content.
+      read_range: function which takes first and last byte positions and
+          returns an iterable of the bytes in that range.
+    """
+    for first, last in ranges:
+        yield '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: %s\r\n\r\n' % (
+                MULTIPART_BOUNDARY, content_type,
+                content_range(first, last, size))
+        for data in read_range(first, last):
+            yield data
+    yield '\r\n--%s--\r\n' % MULTIPART_BOUNDARY
@@ -0,0 +1,66 @@
+import unittest
+
+import byte_ranges
+
+
+class ParseRangeHeaderTest(unittest.TestCase):
+
+    def test_single_ranges(self):
+        self.assertEqual(byte_ranges.parse_range_header('bytes=0-499', 1000),
+                         [(0, 499)])
+        self.assertEqual(byte_ranges.parse_range_header('bytes=500-', 1000),
+                         [(500, 999)])
+        self.assertEqual(byte_ranges.parse_range_header('bytes=-200', 1000),
+                         [(800, 999)])
+
+    def test_ranges_are_clipped_to_the_content(self):
+        self.assertEqual(
+                byte_ranges.parse_range_header('bytes=900-2000', 1000),
+                [(900, 999)])
+        self.assertEqual(byte_ranges.parse_range_header('bytes=-5000', 1000),
+                         [(0, 999)])
+
+    def test_multiple_ranges_are_sorted_and_merged(self):
+        self.assertEqual(
+                byte_ranges.parse_range_header(
+                        'bytes=500-600, 0-99,100-199,550-700', 1000),
+                [(0, 199), (500, 700)])
+
+    def test_unsatisfiable_ranges(self):
+        self.assertEqual(byte_ranges.parse_range_header('bytes=1000-', 1000),
+                         [])
+        self.assertEqual(byte_ranges.parse_range_header('bytes=-0', 1000), [])
+        # Empty content satisfies no range, including suffix ranges.
+        for header in ('bytes=0-', 'bytes=0-5', 'bytes=-5'):
+            self.assertEqual(byte_ranges.parse_range_header(header, 0), [])
+
+    def test_malformed_headers_are_ignored(self):
+        for header in (None, '', 'items=0-5', 'bytes=5', 'bytes=a-b',
+                       'bytes=9-3', 'bytes=-'):
+            self.assertEqual(byte_ranges.parse_range_header(header, 1000),
+                             None)
+
+    def test_too_many_ranges_are_ignored(self):
+        header = 'bytes=' + ','.join(
+                ['%d-%d' % (i * 10, i * 10 + 1)
+                 for i in xrange(byte_ranges.MAX_RANGES + 1)])
+        self.assertEqual(byte_ranges.parse_range_header(header, 1000), None)
+
+
+class MultipartTest(unittest.TestCase):
+
+    def test_iter_multipart(self):
+        content = 'abcdefghij'
+        body = ''.join(byte_ranges.iter_multipart(
+                [(0, 1), (8, 9)], len(content), 'text/plain',
+                lambda first, last: [content[first:last + 1]]))
+        self.assertEqual(body, (
+                '\r\n--BYTE_RANGE_BOUNDARY\r\nContent-Type: text/plain\r\n'
+                'Content-Range: bytes 0-1/10\r\n\r\nab'
+                '\r\n--BYTE_RANGE_BOUNDARY\r\nContent-Type: text/plain\r\n'
+                'Content-Range: bytes 8-9/10\r\n\r\nij'
+                '\r\n--BYTE_RANGE_BOUNDARY--\r\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+"""Surrogate keys which caches in front of the CMS purge resources by.
+
+Resources are served with a Surrogate-Key header listing their path, the
+directories above it, their tags and the partials they include. This module
+has no dependencies, as http_server imports it when an instance starts;
+purge, which sends the keys of changed resources, is only imported by the
+admin pages.
+"""
+
+
+def surrogate_key(value):
+    # Keys are separated by spaces in the Surrogate-Key header.
+    return value.replace(' ', '%20')
+
+
+def path_keys(path):
+    """Returns the keys for a path and each directory above it.
+
+    For example /docs/api/index.html has the keys /, /docs/, /docs/api/ and
+    /docs/api/index.html, so purging /docs/ drops everything under /docs/.
+    """
+    keys = ['/']
+    end = path.find('/', 1)
+    while end != -1:
+        keys.append(surrogate_key(path[:end + 1]))
+        end = path.find('/', end + 1)
+    if not path.endswith('/'):
+        keys.append(surrogate_key(path))
+    return keys
+
+
+def tag_key(tag):
+    return surrogate_key('tag:' + tag)
@@ -0,0 +1,90 @@
+"""Storage for content apart from the metadata of the resource which owns it.
+
+Content is split into ContentChunk entities stored under the key of the
+resource which owns them, so that large content is not limited by the
+datastore entity size and metadata can be read without the content. Chunk
+ids include a version, the hash of the content, so a new version can be
+written beside the old one and a reader holding the old resource never
+combines chunks from different versions. The chunks of a replaced version
+are only deleted once cached copies of the old resource have expired, and
+chunks record when they were written so that a version which is saved again
+in the meantime is not deleted.
+"""
+
+from google.appengine.ext import ndb
+
+
+# Entities are limited to 1MB, so keep each chunk comfortably below that.
+CHUNK_SIZE = 512 * 1024
+
+# Number of chunks requested by each batched get while streaming content.
+# This bounds the memory used to serve a large resource.
+CHUNKS_PER_FETCH = 4
+
+
+class ContentChunk(ndb.Model):
+    """Part of the UTF-8 encoded or binary content of a resource."""
+    data = ndb.BlobProperty()
+    written = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+def chunk_keys(parent_key, version, chunk_count):
+    """Returns the keys of the chunks holding a version of some content."""
+    return [ndb.Key(ContentChunk, '%s-%d' % (version, i), parent=parent_key)
+            for i in xrange(chunk_count)]
+
+
+def split(parent_key, version, data):
+    """Splits data into ContentChunk entities ready to be stored.
+
+    Args:
+      parent_key: ndb.Key of the entity which owns the content.
+      version: str Identifies this version of the content, usually its hash.
+      data: str The bytes to store.
+
+    Returns:
+      A list of unsaved ContentChunk entities.
+    """
+    keys = chunk_keys(parent_key, version,
+                      (len(data) + CHUNK_SIZE - 1) // CHUNK_SIZE)
+    return [ContentChunk(key=key, data=data[i * CHUNK_SIZE:
+                                            (i + 1) * CHUNK_SIZE])
+            for i, key in enumerate(keys)]
+
+
+def iter_data(keys):
+    """Yields the data of each chunk in order using batched gets.
+
+    The next batch of chunks is requested before the current batch is
+    yielded so the datastore fetch overlaps with writing the response.
+    """
+    if not keys:
+        return
+    pending = ndb.get_multi_async(keys[:CHUNKS_PER_FETCH])
+    for i in xrange(0, len(keys), CHUNKS_PER_FETCH):
+        current = pending
+        next_keys = keys[i + CHUNKS_PER_FETCH:i + 2 * CHUNKS_PER_FETCH]
+        if next_keys:
+            pending = ndb.get_multi_async(next_keys)
+        for future in current:
+            yield future.get_result().data
+
+
+@ndb.tasklet
+def read_async(keys):
+    """Fetches all of the chunks at once and returns their data joined."""
+    chunks = yield ndb.get_multi_async(keys)
+    raise ndb.Return(''.join([chunk.data for chunk in chunks]))
+
+
+def iter_range(keys, first, last):
+    """Yields the bytes from first to last, inclusive, of the chunked data.
+
+    Only the chunks which overlap the range are fetched.
+    """
+    first_chunk = first // CHUNK_SIZE
+    last_chunk = last // CHUNK_SIZE
+    position = first_chunk * CHUNK_SIZE
+    for data in iter_data(keys[first_chunk:last_chunk + 1]):
+        yield data[max(first - position, 0):last + 1 - position]
+        position += len(data)
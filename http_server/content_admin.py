@@ -0,0 +1,1076 @@
+"""Admin pages of http_server, imported only when one is first requested.
+
+Keeping these, and the modules only they use, out of http_server makes new
+instances start faster.
+"""
+
+import base64
+import cgi
+import datetime
+import functools
+import hashlib
+import json
+import time
+import urllib
+
+from google.appengine.api import search
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+import webapp2
+
+import cache_keys
+import chunked_content
+import content_search
+import directory_index
+import header_block
+import path_stats
+import path_tree
+import purge
+import redirects
+import resource_cache
+import revisions
+import sitemap_xml
+import sitemaps
+import templates
+import text_delta
+import write_behind
+import wsgi_profiler
+
+from http_server import (Resource, WARMUP_BATCH_SIZE, WARMUP_PATHS, etag,
+                         find_resources_async, http_date, load_data_async,
+                         prefetch_async, resource_headers, resource_key)
+
+
+# Number of resources read and indexed by each reindexing task.
+REINDEX_BATCH_SIZE = 100
+
+# Number of resources described by each page of the export.
+EXPORT_PAGE_SIZE = 500
+
+# Number of resources removed by each deletion task.
+DELETE_BATCH_SIZE = 200
+# Handled by ContentDeleteTask.
+DELETE_TASK_URL = '/content_delete_task'
+
+# The chunks of replaced content are deleted once cached copies of the
+# resources which referred to them have expired.
+CHUNK_CLEANUP_DELAY_SECONDS = resource_cache.HARD_TTL_SECONDS
+# Handled by ContentChunkCleaner.
+CHUNK_CLEANUP_URL = '/content_chunk_cleanup'
+
+
+def resource_from_json(path, resource_data):
+    """Builds a new Resource from the JSON sent by the content manager.
+
+    Binary content is sent base64 encoded, with an encoding of base64.
+
+    Returns:
+      A tuple of the unsaved Resource and its content as a str of bytes.
+
+    Raises:
+      ValueError: if the path does not start with /.
+    """
+    if not path.startswith('/'):
+        raise ValueError('The path must start with /.')
+    resource = Resource(key=resource_key(path))
+    resource.path = path
+    if resource_data.get('encoding') == 'base64':
+        data = base64.b64decode(resource_data['content'])
+        resource.is_binary = True
+        resource.includes = []
+    else:
+        data = resource_data['content'].encode('utf-8')
+        resource.is_binary = False
+        resource.includes = templates.find_includes(resource_data['content'])
+    resource.content_hash = hashlib.sha1(data).hexdigest()
+    resource.content_type = resource_data['ctype']
+    resource.include_last_modified = 'incdate' in resource_data
+    resource.modified_time = datetime.datetime.now()
+    if 'expires' in resource_data:
+        resource.expires_seconds = int(resource_data['expires'])
+    else:
+        resource.expires_seconds = -1
+
+    resource.tags = [tag.strip() for tag in resource_data.get('tags', [])
+                     if tag.strip()]
+
+    # Headers are sent from the client JS in the form name:value.
+    resource.header_block = header_block.encode(
+            header_block.normalise(resource_data.get('headers', [])))
+    resource.headers = []
+    return resource, data
+
+
+def search_document(resource, data):
+    """Returns the content_search document for a resource's content."""
+    text = None
+    if not resource.is_binary:
+        text = data.decode('utf-8')
+    return content_search.build_document(
+            resource.path, resource.content_type, text)
+
+
+def content_json(data, is_binary):
+    """Returns the content fields of the content manager JSON for data."""
+    if is_binary:
+        return {'content': base64.b64encode(data), 'encoding': 'base64'}
+    return {'content': data.decode('utf-8')}
+
+
+def offload_content(resource, data):
+    """Splits the content of a resource into chunks stored apart from it.
+
+    Returns:
+      A list of the ContentChunk entities which must be stored before the
+      resource.
+    """
+    resource.size = len(data)
+    chunks = chunked_content.split(resource.key, resource.content_hash, data)
+    resource.content = None
+    resource.chunk_count = len(chunks)
+    return chunks
+
+
+def chunk_cleanup_task(resource):
+    """Returns a task which deletes the chunks of a replaced resource."""
+    return taskqueue.Task(url=CHUNK_CLEANUP_URL,
+                          params={'key': resource.key.urlsafe(),
+                                  'version': resource.content_hash,
+                                  'count': resource.chunk_count,
+                                  'replaced': time.time()},
+                          countdown=CHUNK_CLEANUP_DELAY_SECONDS)
+
+
+@ndb.tasklet
+def queue_tasks_async(tasks):
+    queue = taskqueue.Queue()
+    yield [queue.add_async(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+           for i in xrange(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD)]
+
+
+@ndb.tasklet
+def delete_replaced_chunks_async(parent_key, version, chunk_count, replaced):
+    """Deletes a version of some content unless it is in use again.
+
+    Run in a transaction on the resource's entity group, so a save of the
+    same content either finishes first and is seen, or fails and retries.
+
+    Args:
+      replaced: datetime when the content was replaced. Chunks written since
+          belong to a later save of the same content and are kept.
+    """
+    parent = yield parent_key.get_async()
+    if parent is not None and parent.content_hash == version:
+        return
+    chunks = yield ndb.get_multi_async(
+            chunked_content.chunk_keys(parent_key, version, chunk_count))
+    yield ndb.delete_multi_async(
+            [chunk.key for chunk in chunks
+             if chunk is not None and
+             (chunk.written is None or chunk.written < replaced)])
+
+
+
+@ndb.tasklet
+def store_in_transaction_async(resource, data, legacy, condition,
+                               generated):
+    """Writes a resource and its revision, numbered after the stored one.
+
+    Run in a transaction on the resource's entity group, which holds its
+    revisions, so concurrent saves of a path are numbered one after another.
+
+    Args:
+      legacy: The Resource stored for the path before resources were keyed
+          by path, or None.
+      condition: function which takes the stored Resource, or None, and
+          this one and returns whether to write it, or None to always write
+          it.
+      generated: bool Whether the resource is built by the CMS itself, and
+          keeps no revisions.
+
+    Returns:
+      A future for a tuple of whether the resource was written and the
+      Resource it replaces, or None.
+    """
+    old = (yield resource.key.get_async()) or legacy
+    if condition is not None and not condition(old, resource):
+        raise ndb.Return((False, old))
+
+    # Changed content gets a new revision. Revisions which may be stored as
+    # deltas need the content they replace.
+    entities = [resource]
+    if generated:
+        resource.revision = 0
+    elif old is not None and old.revision and (
+            old.content_hash == resource.content_hash):
+        resource.revision = old.revision
+    else:
+        resource.revision = old.revision + 1 if old is not None else 1
+        previous_data = None
+        if (resource.revision > 1 and old.key == resource.key and
+                revisions.needs_previous_data(resource.revision)):
+            previous_data = yield load_data_async(old)
+        entities.append(revisions.new_revision(resource, data,
+                                               previous_data))
+    yield ndb.put_multi_async(entities)
+    raise ndb.Return((True, old))
+
+
+@ndb.tasklet
+def store_resources_async(entries, condition=None, generated=False):
+    """Writes the resources and removes the entities they replace.
+
+    Chunks are written before the resources which refer to them, and the
+    chunks of the replaced versions are only removed by a task once cached
+    copies of the old resources have expired, so a reader always finds the
+    chunks for the version of the resource it has. Each resource is written
+    with its revision by store_in_transaction_async.
+
+    Args:
+      entries: list of (Resource, data) tuples as returned by
+          resource_from_json.
+      condition: optional function which is called in each transaction with
+          the stored Resource for the path, or None, and the new one, and
+          returns whether to write the new one.
+      generated: bool True for files built by the CMS itself, such as
+          sitemaps, which keep no revisions and are left out of search, the
+          directory index and the sitemaps.
+
+    Returns:
+      A future for a list of the Resources which were written.
+    """
+    # Resources saved before they were keyed by path are found while the
+    # chunks are written, as they cannot be read in the transactions.
+    existing_future = find_resources_async(
+            [resource.path for resource, data in entries])
+    chunks = []
+    for resource, data in entries:
+        chunks.extend(offload_content(resource, data))
+    chunk_futures = ndb.put_multi_async(chunks)
+    existing = yield existing_future
+    legacy = dict((path, resource) for path, resource in existing.iteritems()
+                  if resource.key != resource_key(path))
+    yield chunk_futures
+
+    results = yield [ndb.transaction_async(functools.partial(
+                             store_in_transaction_async, resource, data,
+                             legacy.get(resource.path), condition,
+                             generated))
+                     for resource, data in entries]
+
+    # Cached copies of the replaced resources may still be read, so their
+    # chunks are deleted later.
+    stored = []
+    replaced_resources = {}
+    replaced = []
+    cleanup_tasks = []
+    for (resource, data), (was_stored, old) in zip(entries, results):
+        if not was_stored:
+            # The chunks written for it are kept only if they are the
+            # stored content.
+            if resource.chunk_count:
+                cleanup_tasks.append(chunk_cleanup_task(resource))
+            continue
+        stored.append((resource, data))
+        if old is None:
+            continue
+        replaced_resources[resource.path] = old
+        if old.key != resource.key:
+            replaced.append(old.key)
+        if ((old.key != resource.key or
+                old.content_hash != resource.content_hash) and
+                old.chunk_count):
+            cleanup_tasks.append(chunk_cleanup_task(old))
+    resources = [resource for resource, data in stored]
+
+    futures = ndb.delete_multi_async(replaced) + [
+            queue_tasks_async(cleanup_tasks),
+            resource_cache.set_multi_async(resources)]
+    search_rpcs = []
+    if not generated:
+        # The search index is updated while the rest is.
+        search_rpcs = content_search.put_documents_async(
+                [search_document(resource, data) for resource, data in stored])
+        # Resources which stop being pages leave the sitemap.
+        pages = [resource for resource in resources
+                 if sitemap_xml.is_page(resource.content_type)]
+        not_pages = [resource.path for resource in resources
+                     if not sitemap_xml.is_page(resource.content_type)
+                     and resource.path in replaced_resources
+                     and sitemap_xml.is_page(
+                             replaced_resources[resource.path].content_type)]
+        futures.extend([
+                directory_index.update_async(
+                        added=[resource.path for resource in resources
+                               if resource.path not in replaced_resources]),
+                sitemaps.update_async(
+                        added=[(resource.path, resource.modified_time)
+                               for resource in pages],
+                        removed=not_pages)])
+    yield futures
+    purge.queue_purge([cache_keys.surrogate_key(resource.path)
+                       for resource in resources])
+    for rpc in search_rpcs:
+        rpc.get_result()
+    raise ndb.Return(resources)
+
+
+@ndb.tasklet
+def delete_resources_async(keys):
+    """Removes resources along with their content chunks and revisions.
+
+    The resources are also dropped from the cache, the directory and search
+    indexes and any caches in front of the site. Removing a resource which
+    has already been removed does nothing.
+
+    Args:
+      keys: list of the keys of the Resources to remove.
+
+    Returns:
+      A future for a list of the paths of the removed resources.
+    """
+    # Resources saved before they were keyed by path must be read to find
+    # their paths.
+    legacy = yield ndb.get_multi_async(
+            [key for key in keys if not isinstance(key.id(), basestring)])
+    paths = [key.id() for key in keys if isinstance(key.id(), basestring)]
+    paths.extend([resource.path for resource in legacy
+                  if resource is not None])
+
+    # Chunks and revisions are children of the resource, so a keys only
+    # ancestor query finds them along with the resource itself.
+    descendants = yield [ndb.Query(ancestor=key).fetch_async(keys_only=True)
+                         for key in keys]
+    yield write_behind.discard_async(paths)
+    yield ndb.delete_multi_async(
+            [key for group in descendants for key in group])
+
+    yield (resource_cache.delete_multi_async(paths),
+           directory_index.update_async(removed=paths),
+           sitemaps.update_async(removed=paths))
+    content_search.remove_documents(paths)
+    purge.queue_purge([cache_keys.surrogate_key(path) for path in paths])
+    raise ndb.Return(paths)
+
+
+def prefix_query(prefix):
+    """Returns a query for the resources whose paths start with prefix."""
+    return Resource.query(Resource.path >= prefix,
+                          Resource.path < prefix + u'\ufffd')
+
+
+class ContentJsonManager(webapp2.RequestHandler):
+    """Reads and saves single resources for the content manager.
+
+    Saves of whole content are coalesced by write_behind, and reads include
+    saves it holds.
+    """
+    def find_resource_async(self):
+        # Strip the leading /content_manger_json from the path to get the path
+        # of the resource being saved.
+        resource_path = self.request.path[21:]
+        return write_behind.find_async(resource_path, find_resources_async)
+
+    @ndb.toplevel
+    def get(self):
+        resource = yield self.find_resource_async()
+        if resource is not None:
+            resource_data = {
+                'ctype': resource.content_type,
+                'headers': [],
+            }
+            data = yield load_data_async(resource)
+            resource_data.update(content_json(data, resource.is_binary))
+            if resource.include_last_modified:
+                resource_data['incdate'] = 'true'
+            if resource.expires_seconds != -1:
+                resource_data['expires'] = resource.expires_seconds
+            for name, value in resource_headers(resource):
+                resource_data['headers'].append('%s:%s' % (name, value))
+            resource_data['tags'] = resource.tags
+            resource_data['hash'] = resource.content_hash
+            self.response.headers['ETag'] = etag(resource)
+        else:
+            resource_data = {}
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(resource_data))
+
+    def write_conflict(self, current):
+        self.response.status = '409 Conflict'
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(
+                {'hash': current and current.content_hash}))
+
+    @ndb.toplevel
+    def post(self):
+        """Saves a resource from the content manager JSON.
+
+        Instead of the content, the JSON may hold a patch of line edits, in
+        the form taken by text_delta.apply_patch, and the base hash of the
+        content they were made against. The base may also be sent as an
+        If-Match ETag. When the stored content has changed since, nothing is
+        saved and the response is a 409 Conflict with the current hash.
+        Patches are stored straight away rather than coalesced, so that the
+        base is checked again in the transaction which writes the resource.
+        """
+        resource_path = self.request.path[21:]
+        resource_data = json.loads(self.request.body)
+        base = None
+        if 'patch' in resource_data:
+            base = resource_data.get('base') or \
+                    self.request.headers.get('If-Match', '').strip('"')
+            # A save held for the path is stored first, so the patch is
+            # made against the latest content.
+            yield write_behind.flush_async([resource_path],
+                                           store_resources_async)
+            current = (yield find_resources_async([resource_path])).get(
+                    resource_path)
+            if current is None or current.content_hash != base:
+                self.write_conflict(current)
+                return
+            if current.is_binary:
+                self.abort(400, 'Binary content cannot be patched.')
+            text = (yield load_data_async(current)).decode('utf-8')
+            try:
+                resource_data['content'] = text_delta.apply_patch(
+                        text, resource_data['patch'])
+            except ValueError as e:
+                self.abort(400, str(e))
+
+        try:
+            resource, data = resource_from_json(resource_path, resource_data)
+        except ValueError as e:
+            self.abort(400, str(e))
+        if base is None:
+            yield write_behind.save_async(resource, data,
+                                          store_resources_async)
+        else:
+            stored = yield store_resources_async(
+                    [(resource, data)],
+                    condition=lambda old, resource: (
+                            old is not None and old.content_hash == base))
+            if not stored:
+                current = (yield find_resources_async([resource_path])).get(
+                        resource_path)
+                self.write_conflict(current)
+                return
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.headers['ETag'] = etag(resource)
+        self.response.write('saved resource %s' % (resource.path,))
+
+
+class ContentRevisions(webapp2.RequestHandler):
+    """Lists, reads and restores the earlier revisions of a resource.
+
+    GET returns {"revision": head, "revisions": [...]} describing the latest
+    revisions. With a rev parameter it returns that revision's content in the
+    same form as the content manager JSON. POST {"rollback": n} saves the
+    content of revision n again as a new revision.
+    """
+    def resource_path(self):
+        # Strip the leading /content_revisions_json from the path.
+        return self.request.path[23:]
+
+    @ndb.toplevel
+    def get(self):
+        path = self.resource_path()
+        if self.request.get('rev'):
+            loaded = yield revisions.load_revision_async(
+                    resource_key(path), int(self.request.get('rev')))
+            if loaded is None:
+                self.abort(404)
+            revision, data = loaded
+            response_data = content_json(data, revision.is_binary)
+            response_data.update({
+                'revision': revision.key.id(),
+                'ctype': revision.content_type,
+                'hash': revision.content_hash,
+            })
+        else:
+            resource = (yield find_resources_async([path])).get(path)
+            if resource is None:
+                self.abort(404)
+            listed = yield revisions.list_revisions_async(
+                    resource.key, resource.revision)
+            response_data = {
+                'revision': resource.revision,
+                'revisions': [{
+                    'revision': revision.key.id(),
+                    'modified': http_date(revision.modified_time),
+                    'ctype': revision.content_type,
+                    'size': revision.size,
+                    'hash': revision.content_hash,
+                } for revision in listed],
+            }
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(response_data))
+
+    @ndb.toplevel
+    def post(self):
+        path = self.resource_path()
+        number = int(json.loads(self.request.body)['rollback'])
+        current, loaded = yield (
+                find_resources_async([path]),
+                revisions.load_revision_async(resource_key(path), number))
+        current = current.get(path)
+        if current is None or loaded is None:
+            self.abort(404)
+        revision, data = loaded
+
+        # Keep the current headers and settings, and only restore the
+        # content and what is derived from it. A new entity is built so that
+        # the stored one is still compared against when saving.
+        resource = Resource(key=resource_key(path))
+        resource.populate(**current.to_dict(exclude=['headers']))
+        resource.headers = list(current.headers)
+        resource.content_type = revision.content_type
+        resource.is_binary = revision.is_binary
+        resource.content_hash = revision.content_hash
+        resource.includes = ([] if revision.is_binary else
+                             templates.find_includes(data.decode('utf-8')))
+        resource.modified_time = datetime.datetime.now()
+        yield write_behind.discard_async([path])
+        yield store_resources_async([(resource, data)])
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({'revision': resource.revision}))
+
+
+class ContentPublisher(webapp2.RequestHandler):
+    """Bulk writes a built site, such as static_site_builder output.
+
+    Publishing is done in two steps so that only changed files are sent. The
+    client first posts {"hashes": {path: sha1}} and receives
+    {"changed": [path, ...]} listing the paths whose stored content differs.
+    It then posts {"resources": {path: resource_data}} in batches, where
+    resource_data has the same form as the content manager JSON.
+    """
+    @ndb.toplevel
+    def post(self):
+        publish_data = json.loads(self.request.body)
+        if 'hashes' in publish_data:
+            hashes = publish_data['hashes']
+            existing = yield find_resources_async(hashes.keys())
+            changed = [path for path, content_hash in hashes.iteritems()
+                       if path not in existing
+                       or existing[path].content_hash != content_hash]
+            response_data = {'changed': sorted(changed)}
+        else:
+            resources = publish_data['resources']
+            entries = []
+            for path, resource_data in resources.iteritems():
+                try:
+                    entries.append(resource_from_json(path, resource_data))
+                except ValueError as e:
+                    self.abort(400, '%s: %s' % (path, e))
+            yield write_behind.discard_async(resources.keys())
+            yield store_resources_async(entries)
+            response_data = {'saved': len(resources)}
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(response_data))
+
+
+class ContentDeleter(webapp2.RequestHandler):
+    """Deletes resources along with their content and revisions.
+
+    POST {"path": path} or {"paths": [path, ...]} deletes those resources,
+    and {"prefix": "/dir/"} every resource whose path starts with the
+    prefix. Up to DELETE_BATCH_SIZE paths are deleted before responding with
+    {"deleted": [path, ...]}. Longer lists and prefixes are deleted by
+    background tasks, and the response is {"queued": true}.
+    """
+    @ndb.toplevel
+    def post(self):
+        delete_data = json.loads(self.request.body)
+        if 'prefix' in delete_data:
+            if not delete_data['prefix'].startswith('/'):
+                self.abort(400, 'The prefix must start with /.')
+            taskqueue.add(url=DELETE_TASK_URL,
+                          params={'prefix': delete_data['prefix']})
+            response_data = {'queued': True}
+        else:
+            paths = delete_data.get('paths')
+            if paths is None and 'path' in delete_data:
+                paths = [delete_data['path']]
+            if not paths:
+                self.abort(400, 'Give a path, paths or a prefix to delete.')
+            if len(paths) <= DELETE_BATCH_SIZE:
+                resources = yield find_resources_async(paths)
+                deleted = yield delete_resources_async(
+                        [resource.key for resource in resources.values()])
+                response_data = {'deleted': sorted(deleted)}
+            else:
+                tasks = [taskqueue.Task(url=DELETE_TASK_URL, params={
+                                 'path': paths[i:i + DELETE_BATCH_SIZE]})
+                         for i in xrange(0, len(paths), DELETE_BATCH_SIZE)]
+                yield queue_tasks_async(tasks)
+                response_data = {'queued': True}
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(response_data))
+
+
+class ContentDeleteTask(webapp2.RequestHandler):
+    """Deletes a batch of resources, run from the tasks ContentDeleter queues.
+
+    Tasks for a prefix find up to DELETE_BATCH_SIZE resources with a keys
+    only query, delete them and queue a task to continue from the query's
+    cursor, so any number of resources can be deleted. A task which fails is
+    retried from the same cursor, as deleting a resource twice is harmless.
+    """
+    @ndb.toplevel
+    def post(self):
+        prefix = self.request.get('prefix')
+        if prefix:
+            cursor = None
+            if self.request.get('cursor'):
+                cursor = ndb.Cursor(urlsafe=self.request.get('cursor'))
+            keys, next_cursor, more = yield prefix_query(
+                    prefix).fetch_page_async(DELETE_BATCH_SIZE,
+                                             start_cursor=cursor,
+                                             keys_only=True)
+            deleted = yield delete_resources_async(keys)
+            if more:
+                taskqueue.add(url=DELETE_TASK_URL,
+                              params={'prefix': prefix,
+                                      'cursor': next_cursor.urlsafe()})
+        else:
+            resources = yield find_resources_async(
+                    self.request.get_all('path'))
+            deleted = yield delete_resources_async(
+                    [resource.key for resource in resources.values()])
+
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('deleted %d resources' % len(deleted))
+
+
+class ContentExporter(webapp2.RequestHandler):
+    """Lists every resource with what is needed to serve it as a file.
+
+    GET returns {"resources": [...], "cursor": cursor} describing up to
+    EXPORT_PAGE_SIZE resources. Pass the cursor back as the cursor parameter
+    to get the next page, until it is null. Used by
+    static_site_builder/export_cms_site.py, which fetches the rendered
+    content of each resource from the site itself.
+    """
+    @ndb.toplevel
+    def get(self):
+        cursor = None
+        if self.request.get('cursor'):
+            cursor = ndb.Cursor(urlsafe=self.request.get('cursor'))
+        resources, next_cursor, more = yield Resource.query().fetch_page_async(
+                EXPORT_PAGE_SIZE, start_cursor=cursor)
+        response_data = {
+            'resources': [{
+                'path': resource.path,
+                'ctype': resource.content_type,
+                'expires': resource.expires_seconds,
+                'headers': resource_headers(resource),
+                'hash': resource.content_hash,
+            } for resource in resources],
+            'cursor': next_cursor.urlsafe() if more else None,
+        }
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(response_data))
+
+
+class ContentLister(webapp2.RequestHandler):
+    def get(self):
+        """Lists a few resources with pagination, or a directory's children.
+        """
+        if self.request.get('dir'):
+            self.list_directory(self.request.get('dir'))
+            return
+        resources = []
+        starting_path = self.request.get('start')
+        # Only the paths are needed, so use a projection query to avoid
+        # reading the rest of each resource.
+        if starting_path:
+            resources = Resource.query(Resource.path >= starting_path).order(
+                    Resource.path).fetch(11, projection=[Resource.path])
+        else:
+            resources = Resource.query().order(Resource.path).fetch(
+                    11, projection=[Resource.path])
+
+        self.response.headers['Content-Type'] = 'text/html'
+
+        self.response.write('<!doctype><html><head>' +
+                '<title>Content Lister</title></head><body>Resources:<br>')
+        for i in xrange(10):
+            if i < len(resources):
+                # TODO: constructing the path this way makes the resource
+                # path a possible vector for XSS.
+                self.response.write('%s ' % (resources[i].path,) +
+                        '<a href="/content_manager%s">' % (
+                                resources[i].path,) +
+                        'Edit</a> <a href="%s">View</a><br>' % (
+                                resources[i].path,))
+
+        if len(resources) > 10:
+            self.response.write(
+                    '<a href="/content_lister?start=%s">Next</a>' % (
+                            resources[10].path,))
+        self.response.write('<br><a href="/content_lister?dir=/">Browse</a>'
+                            ' <a href="/content_search">Search</a>')
+        
+        self.response.write('</body></html>')
+
+    def list_directory(self, directory):
+        """Lists the children of a directory from the directory_index."""
+        if not directory.endswith('/'):
+            directory += '/'
+        entries = directory_index.get_entries(directory) or {}
+
+        self.response.headers['Content-Type'] = 'text/html'
+        self.response.write('<!doctype html><html><head>' +
+                '<title>Content Lister</title></head><body>' +
+                '%s: %d resources<br>' % (
+                        cgi.escape(directory),
+                        path_tree.subtree_size(entries)))
+        parent = path_tree.parent_directory(directory)[0]
+        if parent is not None:
+            self.response.write(
+                    '<a href="/content_lister?dir=%s">Up</a><br>' % (
+                            urllib.quote(parent.encode('utf-8')),))
+        for name in sorted(entries):
+            path = directory + name
+            if name.endswith('/'):
+                self.response.write(
+                        '<a href="/content_lister?dir=%s">%s</a> %d<br>' % (
+                                urllib.quote(path.encode('utf-8')),
+                                cgi.escape(name), entries[name]))
+            else:
+                self.response.write(
+                        '%s <a href="/content_manager%s">Edit</a> '
+                        '<a href="%s">View</a><br>' % (
+                                cgi.escape(name or '(index)'),
+                                cgi.escape(path, True),
+                                cgi.escape(path, True)))
+        self.response.write('</body></html>')
+
+
+class ContentChunkCleaner(webapp2.RequestHandler):
+    """Task which deletes the chunks of content replaced by a save."""
+    @ndb.toplevel
+    def post(self):
+        yield ndb.transaction_async(functools.partial(
+                delete_replaced_chunks_async,
+                ndb.Key(urlsafe=self.request.get('key')),
+                self.request.get('version'),
+                int(self.request.get('count')),
+                datetime.datetime.utcfromtimestamp(
+                        float(self.request.get('replaced')))))
+
+
+class ContentRedirects(webapp2.RequestHandler):
+    """Lists, saves and removes redirects and aliases.
+
+    GET returns {"redirects": [...]}. POST {"source": path, "target": path
+    or URL, "status": code, "prefix": bool} saves a rule, where a status of
+    200 makes an alias which serves the target's content at the source path.
+    Prefix rules append the rest of the path to the target. POST
+    {"source": path, "prefix": bool, "delete": true} removes a rule.
+    """
+    def get(self):
+        response_data = {'redirects': [{
+            'source': redirect.source,
+            'target': redirect.target,
+            'status': redirect.status,
+            'prefix': redirect.is_prefix,
+        } for redirect in redirects.list_redirects()]}
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(response_data))
+
+    def post(self):
+        redirect_data = json.loads(self.request.body)
+        source = redirect_data['source']
+        is_prefix = bool(redirect_data.get('prefix'))
+        if redirect_data.get('delete'):
+            redirects.remove(source, is_prefix)
+        else:
+            try:
+                redirects.save(source, redirect_data['target'],
+                               int(redirect_data.get('status', 301)),
+                               is_prefix)
+            except ValueError as e:
+                self.abort(400, str(e))
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({'source': source}))
+
+
+class ContentSearch(webapp2.RequestHandler):
+    def get(self):
+        """Lists the resources best matching the q parameter."""
+        query_string = self.request.get('q')
+        self.response.headers['Content-Type'] = 'text/html'
+        self.response.write('<!doctype html><html><head>' +
+                '<title>Content Search</title></head><body>' +
+                '<form action="/content_search">' +
+                '<input name="q" size="50" value="%s">' % (
+                        cgi.escape(query_string, True),) +
+                '<input type="submit" value="Search"></form>')
+        if query_string:
+            try:
+                paths = content_search.find_paths(query_string)
+            except search.QueryError:
+                paths = []
+                self.response.write('Invalid query.<br>')
+            for path in paths:
+                self.response.write(
+                        '%s <a href="/content_manager%s">Edit</a> '
+                        '<a href="%s">View</a><br>' % (
+                                cgi.escape(path), cgi.escape(path, True),
+                                cgi.escape(path, True)))
+        self.response.write('</body></html>')
+
+
+class ContentSearchReindexer(webapp2.RequestHandler):
+    """Rebuilds the search documents of every resource.
+
+    Each request indexes REINDEX_BATCH_SIZE resources and queues a task to
+    continue from its cursor, so the whole site is reindexed in the
+    background.
+    """
+    @ndb.toplevel
+    def post(self):
+        cursor = None
+        if self.request.get('cursor'):
+            cursor = ndb.Cursor(urlsafe=self.request.get('cursor'))
+        resources, next_cursor, more = yield Resource.query().fetch_page_async(
+                REINDEX_BATCH_SIZE, start_cursor=cursor)
+        contents = yield [load_data_async(resource) for resource in resources]
+        content_search.put_documents(
+                [search_document(resource, data)
+                 for resource, data in zip(resources, contents)])
+        if more:
+            taskqueue.add(url='/content_search_reindex',
+                          params={'cursor': next_cursor.urlsafe()})
+
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('indexed %d resources' % len(resources))
+
+
+class ContentIndexRebuilder(webapp2.RequestHandler):
+    """Rebuilds the directory_index from the paths of every resource.
+
+    The index is maintained as resources are saved, so this is only needed
+    to index resources saved before it existed, or to repair it.
+    """
+    def post(self):
+        paths = [resource.path for resource in Resource.query().iter(
+                projection=[Resource.path], batch_size=1000)]
+        directories = directory_index.rebuild(paths)
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('indexed %d resources in %d directories' % (
+                len(paths), directories))
+
+class ContentSitemapBuilder(webapp2.RequestHandler):
+    """Stores a shard's sitemap and the index, run from sitemaps tasks."""
+    @ndb.toplevel
+    def post(self):
+        files = sitemaps.build_files(int(self.request.get('shard')))
+        yield store_resources_async([
+                resource_from_json(path, {
+                    'ctype': 'application/xml',
+                    'content': content,
+                    'expires': sitemaps.EXPIRES_SECONDS,
+                }) for path, content in files.iteritems()], generated=True)
+
+
+class ContentSitemapRebuilder(webapp2.RequestHandler):
+    """Adds every page to the sitemaps.
+
+    Pages are added to the sitemaps as they are saved, so this is only
+    needed for pages saved before sitemaps were kept. Each request adds
+    REINDEX_BATCH_SIZE resources and queues a task to continue from its
+    cursor.
+    """
+    @ndb.toplevel
+    def post(self):
+        cursor = None
+        if self.request.get('cursor'):
+            cursor = ndb.Cursor(urlsafe=self.request.get('cursor'))
+        resources, next_cursor, more = yield Resource.query().fetch_page_async(
+                REINDEX_BATCH_SIZE, start_cursor=cursor)
+        yield sitemaps.update_async(
+                added=[(resource.path, resource.modified_time)
+                       for resource in resources
+                       if sitemap_xml.is_page(resource.content_type)])
+        if more:
+            taskqueue.add(url='/content_sitemap_rebuild',
+                          params={'cursor': next_cursor.urlsafe()})
+
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('added %d resources' % len(resources))
+
+
+class ContentKeyMigrator(webapp2.RequestHandler):
+    """Keys the resources saved before resources were keyed by path.
+
+    Until none remain, looking up a path with no resource also queries for
+    it by path, which costs publishing a new site a query per file. Their
+    automatically assigned ids sort before every path, so each request
+    rewrites up to REINDEX_BATCH_SIZE from the start of the key order and
+    queues a task to continue from its cursor.
+    """
+    @ndb.toplevel
+    def post(self):
+        cursor = None
+        if self.request.get('cursor'):
+            cursor = ndb.Cursor(urlsafe=self.request.get('cursor'))
+        resources, next_cursor, more = yield Resource.query().order(
+                Resource.key).fetch_page_async(REINDEX_BATCH_SIZE,
+                                               start_cursor=cursor)
+        legacy = [resource for resource in resources
+                  if not isinstance(resource.key.id(), basestring)]
+        contents = yield [load_data_async(old) for old in legacy]
+        entries = []
+        for old, data in zip(legacy, contents):
+            resource = Resource(key=resource_key(old.path))
+            resource.populate(**dict((name, getattr(old, name))
+                                     for name in old._properties))
+            resource.content_hash = hashlib.sha1(data).hexdigest()
+            resource.header_block = header_block.encode(
+                    resource_headers(old))
+            resource.headers = []
+            entries.append((resource, data))
+        # A path saved since has its own resource, which is kept.
+        stored = yield store_resources_async(
+                entries, condition=lambda stored, resource: (
+                        stored is not None and stored.key != resource.key))
+        stored_paths = set(resource.path for resource in stored)
+        yield ndb.delete_multi_async([old.key for old in legacy
+                                      if old.path not in stored_paths])
+        if more and len(legacy) == len(resources):
+            taskqueue.add(url='/content_key_migrate',
+                          params={'cursor': next_cursor.urlsafe()})
+
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('keyed %d resources' % len(stored))
+
+
+class ContentWarmer(webapp2.RequestHandler):
+    """Preloads resources into the cache, for example after a deploy.
+
+    The paths to load are given as repeated path parameters, or as a top
+    parameter to load that many of the most requested paths recorded by
+    path_stats, and default to WARMUP_PATHS. Run this from a task or cron job
+    before shifting traffic to a new version.
+    """
+    @ndb.toplevel
+    def get(self):
+        paths = self.request.get_all('path')
+        if not paths and self.request.get('top'):
+            paths = path_stats.hottest_paths(int(self.request.get('top')))
+        paths = paths or WARMUP_PATHS
+        # The batches are loaded concurrently so their RPCs overlap.
+        batches = yield [prefetch_async(paths[i:i + WARMUP_BATCH_SIZE])
+                         for i in xrange(0, len(paths), WARMUP_BATCH_SIZE)]
+        loaded = sum([len(resources) for resources in batches])
+
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('warmed %d of %d resources' % (
+                loaded, len(paths)))
+
+    def post(self):
+        self.get()
+
+
+class ContentProfile(webapp2.RequestHandler):
+    """Returns the profiles recorded by this instance as collapsed stacks.
+
+    The output can be given to flamegraph.pl or speedscope. A route
+    parameter limits it to one route, such as /.* for public pages, and a
+    POST with reset=1 clears the profiles.
+    """
+    def get(self):
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write(wsgi_profiler.profiles.collapsed(
+                self.request.get('route') or None))
+
+    def post(self):
+        if self.request.get('reset'):
+            wsgi_profiler.profiles.reset()
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('reset profiles')
+
+
+class ContentRefresher(webapp2.RequestHandler):
+    """Reloads stale cache entries from tasks queued by resource_cache."""
+    @ndb.toplevel
+    def post(self):
+        yield resource_cache.refresh_async(
+                self.request.get_all('path'), find_resources_async)
+
+
+class ContentWriteFlusher(webapp2.RequestHandler):
+    """Stores saves held by write_behind, run from the tasks it queues."""
+    @ndb.toplevel
+    def post(self):
+        yield write_behind.store_held_async(self.request.body,
+                                            store_resources_async)
+
+
+class ContentPurger(webapp2.RequestHandler):
+    """Queues a purge of the surrogate keys given as key parameters.
+
+    Path keys such as /docs/ purge every resource below that directory and
+    keys such as tag:header purge every resource with that tag.
+    """
+    def post(self):
+        keys = [cache_keys.surrogate_key(key)
+                for key in self.request.get_all('key')]
+        purge.queue_purge(keys)
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('queued purge of %d keys' % len(keys))
+
+
+class ContentPurgeFlusher(webapp2.RequestHandler):
+    """Sends the queued purges, run from the tasks queued by purge."""
+    def post(self):
+        purged = purge.flush()
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('purged %d keys' % purged)
+
+
+class ContentStats(webapp2.RequestHandler):
+    def get(self):
+        """Shows the request counters recorded for the busiest paths."""
+        path_stats.flush()
+        totals = path_stats.load_totals()
+        sort_column = {
+            'misses': path_stats.CACHE_MISSES,
+            'datastore': path_stats.DATASTORE_MS,
+            'bytes': path_stats.BYTES_SERVED,
+        }.get(self.request.get('sort'), path_stats.HITS)
+        paths = sorted(totals, key=lambda path: totals[path][sort_column],
+                       reverse=True)
+
+        self.response.headers['Content-Type'] = 'text/html'
+        self.response.write('<!doctype html><html><head>' +
+                '<title>Content Stats</title></head><body><table><tr>' +
+                '<th>Path</th><th><a href="?sort=hits">Hits</a></th>' +
+                '<th><a href="?sort=misses">Cache misses</a></th>' +
+                '<th><a href="?sort=datastore">Datastore ms</a></th>' +
+                '<th>Average datastore ms</th>' +
+                '<th><a href="?sort=bytes">Bytes served</a></th></tr>')
+        for path in paths[:200]:
+            counters = totals[path]
+            average_ms = 0
+            if counters[path_stats.CACHE_MISSES]:
+                average_ms = (counters[path_stats.DATASTORE_MS] /
+                              counters[path_stats.CACHE_MISSES])
+            self.response.write(
+                    '<tr><td>%s</td><td>%d</td><td>%d</td><td>%.1f</td>'
+                    '<td>%.1f</td><td>%d</td></tr>' % (
+                            cgi.escape(path),
+                            counters[path_stats.HITS],
+                            counters[path_stats.CACHE_MISSES],
+                            counters[path_stats.DATASTORE_MS],
+                            average_ms,
+                            counters[path_stats.BYTES_SERVED]))
+        self.response.write('</table></body></html>')
@@ -23,6 +23,14 @@ function httpRequest(httpVerb, data, url, headers, handler) {
   }
 }
 
+// Set to 'base64' while the content box holds base64 encoded binary content.
+var contentEncoding = null;
+
+// The text and hash of the stored content the editor's changes are made
+// against. Saves send only the changed lines when the hash is known.
+var baseContent = null;
+var baseHash = null;
+
 // Displays a message at the bottom of the content_manager page.
 function setState(message) {
   var stateDiv = document.getElementById('state');
@@ -45,6 +53,8 @@ function loadResource() {
       if (resourceJson.hasOwnProperty('content')) {
         document.getElementById('content').value = resourceJson['content'];
       }
+      setEncoding(resourceJson.encoding || null);
+      setBase(resourceJson.content, resourceJson.hash);
 
       if (resourceJson.hasOwnProperty('ctype')) {
         document.getElementById('content-type').value = resourceJson.ctype;
@@ -62,6 +72,9 @@ function loadResource() {
         document.getElementById('expires').value = '';
       }
 
+      document.getElementById('tags').value =
+          (resourceJson.tags || []).join(', ');
+
       if (resourceJson.hasOwnProperty('incdate')) {
         document.getElementById('date').checked = true;
       } else {
@@ -87,6 +100,81 @@ function loadResource() {
   }
 }
 
+// Binary content is shown base64 encoded and can only be replaced by
+// uploading a file.
+function setEncoding(encoding) {
+  contentEncoding = encoding;
+  document.getElementById('content').readOnly = encoding == 'base64';
+}
+
+// Records the stored content which patches are made against. Text with
+// carriage returns is always saved in full, as the content box changes its
+// line endings.
+function setBase(content, hash) {
+  if (contentEncoding || !hash || content.indexOf('\r') != -1) {
+    baseContent = null;
+    baseHash = null;
+  } else {
+    baseContent = content;
+    baseHash = hash;
+  }
+}
+
+// Splits text after each newline, keeping the newlines, in the same way as
+// text_delta.split_lines on the server.
+function splitLines(text) {
+  var lines = text.split('\n');
+  for (var i = 0; i < lines.length - 1; i++) {
+    lines[i] += '\n';
+  }
+  if (!lines[lines.length - 1]) {
+    lines.pop();
+  }
+  return lines;
+}
+
+// Returns the line edits which turn oldText into newText, as a single edit
+// replacing the lines between their common first and last lines.
+function makePatch(oldText, newText) {
+  var oldLines = splitLines(oldText);
+  var newLines = splitLines(newText);
+  var start = 0;
+  while (start < oldLines.length && start < newLines.length &&
+         oldLines[start] == newLines[start]) {
+    start++;
+  }
+  var oldEnd = oldLines.length;
+  var newEnd = newLines.length;
+  while (oldEnd > start && newEnd > start &&
+         oldLines[oldEnd - 1] == newLines[newEnd - 1]) {
+    oldEnd--;
+    newEnd--;
+  }
+  if (start == oldEnd && start == newEnd) {
+    return [];
+  }
+  return [[start, oldEnd, newLines.slice(start, newEnd).join('')]];
+}
+
+function readUpload() {
+  var file = document.getElementById('upload').files[0];
+  if (!file) {
+    return;
+  }
+  var reader = new FileReader();
+  reader.onload = function() {
+    // The result is a data URL of the form data:<type>;base64,<content>.
+    var dataUrl = reader.result;
+    document.getElementById('content').value =
+        dataUrl.substr(dataUrl.indexOf(',') + 1);
+    if (file.type) {
+      document.getElementById('content-type').value = file.type;
+    }
+    setEncoding('base64');
+  };
+  reader.readAsDataURL(file);
+}
+
 function toggleExpires() {
   if (document.getElementById('expires-check').checked) {
     document.getElementById('expires-box').style.display = '';
@@ -114,10 +202,22 @@ function saveResource() {
     setState('');
   }
 
+  var content = document.getElementById('content').value;
   var payload = {
-    content: document.getElementById('content').value,
     ctype: document.getElementById('content-type').value
   };
+  if (baseHash && !contentEncoding) {
+    payload['base'] = baseHash;
+    payload['patch'] = makePatch(baseContent, content);
+  } else {
+    payload['content'] = content;
+  }
+
+  if (contentEncoding) {
+    payload['encoding'] = contentEncoding;
+  }
+
+  payload['tags'] = document.getElementById('tags').value.split(',');
 
   if (document.getElementById('date').checked) {
     payload['incdate'] = true;
@@ -139,7 +239,19 @@ function saveResource() {
   }
 
   httpRequest('POST', JSON.stringify(payload), '/content_manager_json' + path,
-              {}, function() {
+              {}, function(http) {
+    if (http.status == 409) {
+      setState('Not saved: the resource was changed by someone else after ' +
+               'it was loaded. Copy your changes and reload it.');
+      return;
+    }
+    if (http.status != 200) {
+      setState('Save failed: ' + http.status + ' ' + http.responseText);
+      return;
+    }
+    // The ETag is the quoted hash of the saved content.
+    var hash = (http.getResponseHeader('ETag') || '').replace(/"/g, '');
+    setBase(content, hash);
     setState('Saved resource ' + JSON.stringify(payload));
   });
 }
@@ -0,0 +1,113 @@
+"""Full text search over the paths and content of resources.
+
+Each resource has a document in a Search API index, replaced whenever the
+resource is saved. The index holds an inverted index of the terms in every
+document, so a query takes about the same time however many resources there
+are. How content is tokenised depends on its type: markup is removed from
+HTML and XML, other text is indexed as it is, and binary content is left
+out so only the path can be searched.
+"""
+
+import hashlib
+import re
+
+from google.appengine.api import search
+
+
+INDEX_NAME = 'resources'
+
+# The Search API accepts at most this many documents in each call.
+MAX_DOCUMENTS_PER_PUT = 200
+
+# Documents are limited to 1MB, so only the start of larger content is
+# indexed.
+MAX_INDEXED_CHARS = 256 * 1024
+
+MAX_RESULTS = 50
+
+MARKUP_TYPES = ('text/html', 'application/xhtml+xml', 'text/xml',
+                'application/xml', 'image/svg+xml')
+TEXT_TYPES = ('text/', 'application/javascript', 'application/json',
+              'application/x-javascript')
+
+# Splits paths into words, so /docs/api-guide.html matches api and guide.
+PATH_SEPARATORS = re.compile(r'[/._\-]+')
+
+
+def get_index():
+    return search.Index(name=INDEX_NAME)
+
+
+def document_id(path):
+    # Document ids must be short printable ASCII, which paths need not be.
+    return hashlib.sha1(path.encode('utf-8')).hexdigest()
+
+
+def build_document(path, content_type, text):
+    """Builds the search document for a resource.
+
+    Args:
+      path: unicode The path of the resource.
+      content_type: str The resource's content type.
+      text: unicode The content, or None for binary content.
+    """
+    fields = [search.AtomField(name='path', value=path),
+              search.TextField(name='path_words',
+                               value=PATH_SEPARATORS.sub(' ', path).strip())]
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if text is not None:
+        text = text[:MAX_INDEXED_CHARS]
+        if content_type in MARKUP_TYPES:
+            fields.append(search.HtmlField(name='content', value=text))
+        elif content_type.startswith(TEXT_TYPES):
+            fields.append(search.TextField(name='content', value=text))
+    return search.Document(doc_id=document_id(path), fields=fields)
+
+
+def put_documents(documents):
+    """Adds or replaces documents in the index, in as few calls as allowed.
+    """
+    index = get_index()
+    for i in xrange(0, len(documents), MAX_DOCUMENTS_PER_PUT):
+        index.put(documents[i:i + MAX_DOCUMENTS_PER_PUT])
+
+
+def put_documents_async(documents):
+    """Starts adding documents to the index.
+
+    Returns:
+      A list of RPCs whose get_result must be called once the caller has
+      started its own RPCs.
+    """
+    index = get_index()
+    return [index.put_async(documents[i:i + MAX_DOCUMENTS_PER_PUT])
+            for i in xrange(0, len(documents), MAX_DOCUMENTS_PER_PUT)]
+
+
+def remove_documents(paths):
+    """Removes the documents for paths which no longer have resources."""
+    index = get_index()
+    ids = [document_id(path) for path in paths]
+    for i in xrange(0, len(ids), MAX_DOCUMENTS_PER_PUT):
+        index.delete(ids[i:i + MAX_DOCUMENTS_PER_PUT])
+
+
+def find_paths(query_string, limit=MAX_RESULTS):
+    """Returns the paths of the resources best matching a query, best first.
+
+    The query uses the Search API query syntax, so path:/docs/index.html or
+    content:"exact phrase" restrict the match to one field.
+    """
+    query = search.Query(
+            query_string=query_string,
+            options=search.QueryOptions(
+                    limit=limit,
+                    returned_fields=['path'],
+                    sort_options=search.SortOptions(
+                            match_scorer=search.MatchScorer(),
+                            expressions=[search.SortExpression(
+                                    expression='_score',
+                                    direction=search.SortExpression.DESCENDING,
+                                    default_value=0)])))
+    results = get_index().search(query)
+    return [result.field('path').value for result in results]
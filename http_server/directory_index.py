@@ -0,0 +1,95 @@
+"""A directory index of the resource paths, maintained as resources change.
+
+The entries of each directory, in the form described in path_tree, are kept
+in a DirectoryIndex entity keyed by the directory, so listing a directory's
+children and the size of each subdirectory takes a single get.
+"""
+
+import functools
+
+from google.appengine.ext import ndb
+
+import path_tree
+
+
+class DirectoryIndex(ndb.Model):
+    """The entries of one directory, keyed by its path ending in /."""
+    entries = ndb.JsonProperty(compressed=True)
+
+
+def index_key(directory):
+    return ndb.Key(DirectoryIndex, directory)
+
+
+def get_entries(directory):
+    """Returns the entries of a directory, or None if it is not indexed."""
+    index = index_key(directory).get()
+    return index and index.entries
+
+
+@ndb.tasklet
+def _update_directory_async(directory, update):
+    """Applies update to a directory's entries, storing them if it changed.
+
+    Returns:
+      A future for the result of update, which is passed the entries.
+    """
+    key = index_key(directory)
+    index = (yield key.get_async()) or DirectoryIndex(key=key, entries={})
+    before = dict(index.entries)
+    result = update(index.entries)
+    if index.entries != before:
+        if index.entries:
+            yield index.put_async()
+        else:
+            yield key.delete_async()
+    raise ndb.Return(result)
+
+
+def _update_in_transaction_async(directory, update, *args):
+    """Runs _update_directory_async in a transaction of its own."""
+    return ndb.transaction_async(functools.partial(
+            _update_directory_async, directory,
+            lambda entries: update(entries, *args)))
+
+
+def _add_and_remove(entries, added, removed):
+    return (path_tree.add_names(entries, added) -
+            path_tree.remove_names(entries, removed))
+
+
+@ndb.tasklet
+def update_async(added=(), removed=()):
+    """Adds and removes paths from the index.
+
+    The directories holding the paths are updated first, each in its own
+    transaction. Only paths which were not already in, or were still in,
+    their directory change the subdirectory counts of its ancestors, so
+    updating with paths which are already indexed is cheap and harmless.
+    """
+    names = {}
+    for paths, position in ((added, 0), (removed, 1)):
+        for path in paths:
+            directory, name = path_tree.split_path(path)
+            names.setdefault(directory, ([], []))[position].append(name)
+    directories = names.keys()
+    counts = yield [
+            _update_in_transaction_async(
+                    directory, _add_and_remove, *names[directory])
+            for directory in directories]
+
+    changes = path_tree.ancestor_changes(dict(zip(directories, counts)))
+    yield [_update_in_transaction_async(
+                   directory, path_tree.apply_changes, directory_changes)
+           for directory, directory_changes in changes.iteritems()]
+
+
+def rebuild(paths):
+    """Replaces the whole index with one built from every stored path."""
+    directories = path_tree.build(paths)
+    ndb.put_multi([DirectoryIndex(key=index_key(directory), entries=entries)
+                   for directory, entries in directories.iteritems()])
+    stale = [key for key in DirectoryIndex.query().iter(keys_only=True)
+             if key.id() not in directories]
+    ndb.delete_multi(stale)
+    return len(directories)
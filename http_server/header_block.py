@@ -0,0 +1,67 @@
+"""Compact storage for the custom headers of a resource.
+
+Headers are validated and normalised once, when a resource is saved, and
+stored as a single block of "Name: value" lines which can be sent without
+further checks.
+"""
+
+import re
+
+
+# Characters allowed in header names by RFC 7230.
+TOKEN = re.compile(r"^[!#$%&'*+\-.^_`|~0-9A-Za-z]+$")
+
+# Headers the server sets itself, which a resource may not override.
+RESERVED_HEADERS = frozenset(['content-length', 'transfer-encoding',
+                              'connection', 'content-range'])
+
+LINE_SEPARATOR = '\r\n'
+
+
+def normalise(name_values):
+    """Validates headers sent by the content manager.
+
+    Args:
+      name_values: list of unicode headers in the form name:value.
+
+    Returns:
+      A list of (name, value) tuples of ASCII str, with names in their usual
+      capitalisation and surrounding whitespace removed.
+
+    Raises:
+      ValueError: A header is malformed or may not be set.
+    """
+    headers = []
+    for name_value in name_values:
+        name, separator, value = name_value.partition(':')
+        name = name.strip()
+        value = value.strip()
+        if not separator or not TOKEN.match(name):
+            raise ValueError('Invalid header %r' % name_value)
+        if name.lower() in RESERVED_HEADERS:
+            raise ValueError('The %s header cannot be set' % name)
+        if '\r' in value or '\n' in value:
+            raise ValueError('Invalid value for the %s header' % name)
+        try:
+            value = value.encode('ascii')
+        except UnicodeError:
+            raise ValueError('The %s header must be ASCII' % name)
+        name = '-'.join([part.capitalize() for part in name.split('-')])
+        headers.append((name.encode('ascii'), value))
+    return headers
+
+
+def encode(headers):
+    """Returns the block holding a list of (name, value) tuples."""
+    return LINE_SEPARATOR.join(['%s: %s' % header for header in headers])
+
+
+def decode(block):
+    """Returns the list of (name, value) tuples stored in a block."""
+    if not block:
+        return []
+    headers = []
+    for line in block.split(LINE_SEPARATOR):
+        name, separator, value = line.partition(': ')
+        headers.append((name, value))
+    return headers
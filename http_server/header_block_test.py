@@ -0,0 +1,37 @@
+import unittest
+
+import header_block
+
+
+class HeaderBlockTest(unittest.TestCase):
+
+    def test_normalise(self):
+        self.assertEqual(header_block.normalise(
+                [u'x-frame-options: DENY', u' Link :<a.css>; rel=preload',
+                 u'X-Empty:', u'x-ratio:1:2']),
+                [('X-Frame-Options', 'DENY'),
+                 ('Link', '<a.css>; rel=preload'),
+                 ('X-Empty', ''),
+                 ('X-Ratio', '1:2')])
+        self.assertEqual(header_block.normalise([]), [])
+
+    def test_invalid_headers(self):
+        for name_value in [u'no separator', u'bad name: x', u':empty',
+                           u'X-Split: a\r\nInjected: b',
+                           u'X-Unicode: caf\xe9', u'Content-Length: 1']:
+            self.assertRaises(ValueError, header_block.normalise,
+                              [name_value])
+
+    def test_round_trip(self):
+        headers = [('X-Frame-Options', 'DENY'), ('X-Empty', ''),
+                   ('X-Ratio', '1: 2')]
+        block = header_block.encode(headers)
+        self.assertEqual(block,
+                         'X-Frame-Options: DENY\r\nX-Empty: \r\nX-Ratio: 1: 2')
+        self.assertEqual(header_block.decode(block), headers)
+        self.assertEqual(header_block.decode(header_block.encode([])), [])
+        self.assertEqual(header_block.decode(None), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,157 +1,608 @@
+"""Serves the resources stored by the content manager.
+
+Only the code which serves public pages is imported when an instance starts.
+The admin pages are in content_admin, which webapp2 imports the first time
+one of them is requested, and /_ah/warmup loads the caches used by public
+pages before an instance receives traffic.
+"""
+
 import datetime
-import json
+import email.utils
+import functools
+import hashlib
+import urllib
 
 from google.appengine.ext import ndb
 import webapp2
 
+import byte_ranges
+import cache_keys
+import chunked_content
+import header_block
+import path_stats
+import redirects
+import resource_cache
+import routing
+import templates
+import wsgi_profiler
+
 
 class Header(ndb.Model):
-    """Contains a single HTTP header for a resource."""
+    """Contains a single HTTP header for a resource saved before headers
+    were stored in a header_block."""
     name = ndb.StringProperty()
     value = ndb.StringProperty()
 
 
 class Resource(ndb.Model):
-    """Contents of a single URL."""
+    """Metadata for a single URL.
+
+    The content is stored apart from this entity in chunk_count ContentChunk
+    entities, so listing resources, answering HEAD and conditional requests
+    and comparing hashes never read the content.
+    """
+    # Resources are cached by path in resource_cache, so skip ndb's own
+    # memcache copy of each entity.
+    _use_memcache = False
+
     path = ndb.StringProperty()
+    # Content stored inline before it was moved into chunks. It is only read
+    # for resources which have not been saved since, and is cleared on save.
     content = ndb.TextProperty()
     content_type = ndb.StringProperty()
     include_last_modified = ndb.BooleanProperty()
     modified_time = ndb.DateTimeProperty()
     expires_seconds = ndb.IntegerProperty()
+    # Only read for resources which have not been saved since header_block
+    # was added, and is cleared on save.
     headers = ndb.StructuredProperty(Header, repeated=True)
+    # The custom headers, validated when saved, in the form written by
+    # header_block.encode.
+    header_block = ndb.BlobProperty()
+    content_hash = ndb.StringProperty()
+    # Size of the encoded content in bytes.
+    size = ndb.IntegerProperty()
+    chunk_count = ndb.IntegerProperty(default=0)
+    is_binary = ndb.BooleanProperty(default=False)
+    # Sent as surrogate keys so downstream caches can purge tagged resources
+    # together.
+    tags = ndb.StringProperty(repeated=True)
+    # Number of the latest Revision of the content, 0 for resources saved
+    # before revisions were kept.
+    revision = ndb.IntegerProperty(default=0)
+    # Paths of the resources included by the content, see templates.
+    includes = ndb.StringProperty(repeated=True, indexed=False)
+
+
+# The datastore rejects IN filters with more values than this.
+MAX_IN_QUERY_VALUES = 30
+
+# Paths loaded into the cache by the warmup job when none are requested.
+WARMUP_PATHS = ['/']
+
+# Number of resources loaded by each batched cache and datastore call when
+# warming the cache.
+WARMUP_BATCH_SIZE = 100
+
+# Number of the most requested paths loaded by each new instance.
+INSTANCE_WARMUP_PATHS = 20
+
+# Characters left unquoted in redirect locations, which may be URLs.
+REDIRECT_SAFE_CHARACTERS = "/:?#[]@!$&'()*+,;=%~"
+
+# Lets downstream caches keep serving an expired resource for this long while
+# they revalidate it, or for longer when the server returns an error.
+STALE_WHILE_REVALIDATE_SECONDS = 60
+STALE_IF_ERROR_SECONDS = 24 * 60 * 60
+
+# Instance memory caches of compiled templates, by content hash, and of
+# rendered pages, by the hashes of the page and everything it includes. As
+# the keys change whenever a page or partial does, entries never need to be
+# invalidated.
+_compiled_templates = templates.LruCache(
+        4 * 1024 * 1024, size=lambda template: sum(map(len, template.parts)))
+_rendered_pages = templates.LruCache(
+        16 * 1024 * 1024, size=lambda rendered: rendered[1])
 
+# Cleared once no resources saved before they were keyed by path remain.
+# Every save now keys the resource by path, so none can appear again.
+_legacy_resources_remain = True
 
-class ContentJsonManager(webapp2.RequestHandler):
-    def find_resource(self):
-        # Strip the leading /content_manger_json from the path to get the path
-        # of the resource being saved.
-        resource_path = self.request.path[21:]
-        results = Resource.query(Resource.path == resource_path).fetch(1)
-        # TODO: could return a tuple of result, path to avoid recalculating
-        # the path when creating a new resource.
-        if len(results) > 0:
-            return results[0]
+
+def resource_key(path):
+    """Returns the key of the resource served at path."""
+    return ndb.Key(Resource, path)
+
+
+def http_date(time):
+    # Format the time as Mon, 06 Jul 2015 08:47:21 GMT
+    return time.strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+
+def parse_http_date(value):
+    """Returns the datetime for an HTTP date, or None if it is malformed."""
+    parsed = email.utils.parsedate(value)
+    if parsed is None:
         return None
+    return datetime.datetime(*parsed[:6])
 
-    def get(self):
-        resource = self.find_resource()
+
+@ndb.tasklet
+def legacy_resources_remain_async():
+    """Returns a future for whether any resources have no path key.
+
+    Resources saved before they were keyed by path have automatically
+    assigned ids, which sort before key names, so only the first key is
+    read. Once none remain the instance stops checking.
+    """
+    global _legacy_resources_remain
+    if _legacy_resources_remain:
+        first = yield Resource.query().order(Resource.key).get_async(
+                keys_only=True)
+        _legacy_resources_remain = (first is not None and
+                                    not isinstance(first.id(), basestring))
+    raise ndb.Return(_legacy_resources_remain)
+
+
+@ndb.tasklet
+def find_resources_async(paths):
+    """Looks up the resources for several paths with batched RPCs.
+
+    Returns:
+      A future for a dict mapping each path which has a stored resource to
+      the Resource for that path.
+    """
+    resources = {}
+    keyed, legacy_remain = yield (
+            ndb.get_multi_async([resource_key(path) for path in paths]),
+            legacy_resources_remain_async())
+    for resource in keyed:
         if resource is not None:
-            resource_data = {
-                'content': resource.content,
-                'ctype': resource.content_type,
-                'headers': [],
-            }
-            if resource.include_last_modified:
-                resource_data['incdate'] = 'true'
-            if resource.expires_seconds != -1:
-                resource_data['expires'] = resource.expires_seconds
-            for header in resource.headers:
-                resource_data['headers'].append('%s:%s' % (
-                        header.name, header.value))
-        else:
-            resource_data = {}
+            resources[resource.path] = resource
 
-        self.response.headers['Content-Type'] = 'application/json'
-        self.response.write(json.dumps(resource_data))
+    # Resources saved before they were keyed by path can only be found by
+    # querying on the path, until content_admin.ContentKeyMigrator has keyed
+    # them all. The queries for each group of paths run in parallel.
+    missing = [path for path in paths if path not in resources]
+    if missing and legacy_remain:
+        results = yield [
+                Resource.query(Resource.path.IN(
+                        missing[i:i + MAX_IN_QUERY_VALUES])).fetch_async()
+                for i in xrange(0, len(missing), MAX_IN_QUERY_VALUES)]
+        for query_results in results:
+            for resource in query_results:
+                resources[resource.path] = resource
+    raise ndb.Return(resources)
 
-    def post(self):
-        resource = self.find_resource()
-        if resource is None:
-            resource = Resource()
-
-        resource.path = self.request.path[21:]
-        resource_data = json.loads(self.request.body)
-        resource.content = resource_data['content']
-        resource.content_type = resource_data['ctype']
-        resource.include_last_modified = 'incdate' in resource_data
-        resource.modified_time = datetime.datetime.now()
-        if 'expires' in resource_data:
-            resource.expires_seconds = int(resource_data['expires'])
-        else:
-            resource.expires_seconds = -1
 
-        resource.headers = []
-        for header_name_value in resource_data['headers']:
-            # Headers are sent from the client JS in the form name:value.
-            resource.headers.append(Header(
-                    name=header_name_value[:header_name_value.index(':')],
-                    value=header_name_value[header_name_value.index(':') + 1:]))
+def find_resources(paths):
+    return find_resources_async(paths).get_result()
 
-        resource.put()
 
-        self.response.headers['Content-Type'] = 'application/json'
-        self.response.write('saved resource %s' % (resource.path,))
+def resource_headers(resource):
+    """Returns the custom headers of a resource as (name, value) tuples."""
+    if resource.header_block is None:
+        return [(header.name.encode('ascii', 'ignore'),
+                 header.value.encode('ascii', 'ignore'))
+                for header in resource.headers]
+    return header_block.decode(resource.header_block)
 
 
-class ContentLister(webapp2.RequestHandler):
-    def get(self):
-        """Lists a few resources with pagination."""
-        resources = []
-        starting_path = self.request.get('start')
-        if starting_path:
-            resources = Resource.query(Resource.path >= starting_path).order(
-                    Resource.path).fetch(11)
+def etag(resource):
+    """Returns the strong entity tag for the current content of a resource."""
+    return '"%s"' % resource.content_hash
+
+
+def surrogate_keys(resource):
+    """Returns the Surrogate-Key header value for a resource.
+
+    Pages include the keys of the resources they include, so saving a
+    partial purges every page which shows it.
+    """
+    keys = cache_keys.path_keys(resource.path)
+    keys.extend([cache_keys.tag_key(tag) for tag in resource.tags])
+    keys.extend([cache_keys.surrogate_key(path)
+                 for path in resource.includes])
+    return ' '.join(keys).encode('ascii', 'ignore')
+
+
+def path_surrogate_keys(path):
+    """Returns the Surrogate-Key header value for a redirected path."""
+    return ' '.join(cache_keys.path_keys(path)).encode('ascii', 'ignore')
+
+
+def content_chunk_keys(resource):
+    """Returns the keys of the ContentChunks holding a resource's content."""
+    return chunked_content.chunk_keys(
+            resource.key, resource.content_hash, resource.chunk_count or 0)
+
+
+def content_size(resource):
+    """Returns the length of a resource's content in bytes."""
+    if resource.size is None:
+        # Resources saved before sizes were recorded hold only text.
+        return len((resource.content or u'').encode('utf-8'))
+    return resource.size
+
+
+def iter_content_data(resource):
+    """Yields the bytes of a resource's content in pieces."""
+    if resource.chunk_count:
+        return chunked_content.iter_data(content_chunk_keys(resource))
+    return iter([(resource.content or u'').encode('utf-8')])
+
+
+def iter_content_range(resource, first, last):
+    """Yields the bytes from first to last, inclusive, of the content."""
+    if resource.chunk_count:
+        return chunked_content.iter_range(
+                content_chunk_keys(resource), first, last)
+    return iter([(resource.content or u'').encode('utf-8')[first:last + 1]])
+
+
+def load_data(resource):
+    """Returns the full content of a resource as a str of bytes."""
+    return ''.join(iter_content_data(resource))
+
+
+@ndb.tasklet
+def load_data_async(resource):
+    """Fetches all of the chunks of a resource's content in parallel."""
+    if not resource.chunk_count:
+        raise ndb.Return((resource.content or u'').encode('utf-8'))
+    data = yield chunked_content.read_async(content_chunk_keys(resource))
+    raise ndb.Return(data)
+
+
+@ndb.tasklet
+def prefetch_async(paths):
+    """Loads resources, and the content of small ones, into the caches.
+
+    Returns:
+      A future for a dict mapping each path which has a resource to its
+      Resource.
+    """
+    resources = yield resource_cache.get_multi_async(
+            paths, find_resources_async)
+    # Reading the content of small resources loads their chunks into ndb's
+    # memcache.
+    chunk_keys = []
+    for resource in resources.itervalues():
+        if resource.chunk_count == 1:
+            chunk_keys.extend(content_chunk_keys(resource))
+    if chunk_keys:
+        yield ndb.get_multi_async(chunk_keys)
+    raise ndb.Return(resources)
+
+
+class RenderedPage(object):
+    """A resource with its includes filled in, served in place of it.
+
+    Other attributes are read from the resource. The content hash and
+    modified time cover the included resources too, so the ETag and
+    Last-Modified headers change when any of them does.
+    """
+    def __init__(self, resource, text, size, content_hash, modified_time,
+                 includes):
+        self.resource = resource
+        self.content = text
+        self.size = size
+        self.chunk_count = 0
+        self.content_hash = content_hash
+        self.modified_time = modified_time
+        self.includes = includes
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+
+@ndb.tasklet
+def compile_templates_async(resources):
+    """Returns a future for a dict of path to Template for text resources.
+
+    Templates are compiled from the content once per instance. Only the
+    content of resources missing from the cache is read, in parallel.
+    """
+    compiled = {}
+    missing = []
+    for resource in resources:
+        if resource.is_binary:
+            continue
+        template = _compiled_templates.get(resource.content_hash)
+        if template is None:
+            missing.append(resource)
         else:
-            resources = Resource.query().order(Resource.path).fetch(11)
-
-        self.response.headers['Content-Type'] = 'text/html'
-
-        self.response.write('<!doctype><html><head>' +
-                '<title>Content Lister</title></head><body>Resources:<br>')
-        for i in xrange(10):
-            if i < len(resources):
-                # TODO: constructing the path this way makes the resource
-                # path a possible vector for XSS.
-                self.response.write('%s ' % (resources[i].path,) +
-                        '<a href="/content_manager%s">' % (
-                                resources[i].path,) +
-                        'Edit</a> <a href="%s">View</a><br>' % (
-                                resources[i].path,))
-
-        if len(resources) > 10:
-            self.response.write(
-                    '<a href="/content_lister?start=%s">Next</a>' % (
-                            resources[10].path,))
-        
-        self.response.write('</body></html>')
+            compiled[resource.path] = template
+    loaded = yield [load_data_async(resource) for resource in missing]
+    for resource, data in zip(missing, loaded):
+        template = templates.Template(data.decode('utf-8'))
+        if resource.content_hash:
+            _compiled_templates.set(resource.content_hash, template)
+        compiled[resource.path] = template
+    raise ndb.Return(compiled)
+
+
+@ndb.tasklet
+def render_async(resource):
+    """Fills in the includes of a resource.
+
+    The included resources are looked up with one batched resource_cache
+    call for each level of nesting, and the rendered page is cached, so a
+    page only reads the content of its partials when one of them changes.
+
+    Returns:
+      A future for a RenderedPage.
+    """
+    resources = {resource.path: resource}
+    included = set()
+    pending = resource.includes
+    for depth in xrange(templates.MAX_INCLUDE_DEPTH):
+        pending = [path for path in pending if path not in included]
+        if not pending:
+            break
+        included.update(pending)
+        found = yield resource_cache.get_multi_async(
+                pending, find_resources_async)
+        pending = []
+        for path in found:
+            pending.extend(found[path].includes)
+        resources.update(found)
+
+    # Missing partials are listed too, so creating one changes the pages
+    # which include it.
+    included.discard(resource.path)
+    included = sorted(included)
+    render_key = hashlib.sha1(' '.join(
+            ['%s=%s' % (path, resources[path].content_hash)
+             for path in sorted(resources)] + included).encode(
+                    'utf-8')).hexdigest()
+    rendered = _rendered_pages.get(render_key)
+    if rendered is None:
+        compiled = yield compile_templates_async(resources.values())
+        text = templates.render(resource.path, compiled)
+        rendered = (text, len(text.encode('utf-8')))
+        _rendered_pages.set(render_key, rendered)
+    text, size = rendered
+    modified_time = max([included_resource.modified_time
+                         for included_resource in resources.itervalues()])
+    raise ndb.Return(RenderedPage(resource, text, size, render_key,
+                                  modified_time, included))
 
 class ResourceRenderer(webapp2.RequestHandler):
-    def get(self):
-        results = Resource.query(Resource.path == self.request.path).fetch(1)
-        if len(results) < 1:
+    def load_resource(self):
+        """Returns the resource for the request.
+
+        Redirects and aliases are looked up in memory before the resource.
+        Returns None after writing a redirect or a 404 response.
+        """
+        path = self.request.path
+        rule = redirects.lookup(path)
+        if rule is not None:
+            location, status = rule
+            if status != redirects.ALIAS:
+                self.response.set_status(status)
+                self.response.headers['Location'] = urllib.quote(
+                        location.encode('utf-8'),
+                        safe=REDIRECT_SAFE_CHARACTERS)
+                self.response.headers['Surrogate-Key'] = \
+                        path_surrogate_keys(path)
+                path_stats.record(self.request.path, hits=1)
+                return None
+            path = location
+        resource = resource_cache.get(
+                path, path_stats.timed(find_resources_async))
+        if resource is None:
             # There was no resource with this path so return a 404.
             self.response.write(
                     '<html><head><title>Not Found</title></head>' +
                     '<body>Not Found</body></html>')
             self.response.headers['Content-Type'] = 'text/html'
             self.response.status = '404 Not Found'
+            path_stats.record(self.request.path, hits=1)
+        elif resource.includes:
+            resource = render_async(resource).get_result()
+        return resource
+
+    def head(self):
+        """Answers from the resource metadata without reading the content."""
+        resource = self.load_resource()
+        if resource is None:
+            return
+        self.write_headers(resource)
+        if self.not_modified(resource):
+            self.response.status = '304 Not Modified'
         else:
-            resource = results[0]
-            self.response.write(resource.content)
-            self.response.headers['Content-Type'] = \
-                    resource.content_type.encode('ascii', 'ignore')
             self.response.status = '200 OK'
-            if resource.include_last_modified:
-                # Format the modified time as Mon, 06 Jul 2015 08:47:21 GMT
-                self.response.headers['Last-Modified'] = \
-                        resource.modified_time.strftime(
-                                '%a, %d %b %Y %H:%M:%S GMT')
+            self.response.content_length = content_size(resource)
+        path_stats.record(self.request.path, hits=1)
+
+    def get(self):
+        resource = self.load_resource()
+        if resource is None:
+            return
+
+        self.write_headers(resource)
+        if self.not_modified(resource):
+            self.response.status = '304 Not Modified'
+            path_stats.record(self.request.path, hits=1)
+            return
+
+        size = content_size(resource)
+        ranges = None
+        if self.if_range_matches(resource):
+            ranges = byte_ranges.parse_range_header(
+                    self.request.headers.get('Range'), size)
+
+        if ranges is None:
+            self.response.status = '200 OK'
+            if resource.chunk_count:
+                # Stream the content a few chunks at a time rather than
+                # loading all of a large resource into memory.
+                self.response.app_iter = iter_content_data(resource)
+                self.response.content_length = size
+            else:
+                self.response.write(load_data(resource))
+            bytes_served = size
+        elif not ranges:
+            self.response.status = '416 Requested Range Not Satisfiable'
+            self.response.headers['Content-Range'] = 'bytes */%d' % size
+            bytes_served = 0
+        elif len(ranges) == 1:
+            first, last = ranges[0]
+            self.response.status = '206 Partial Content'
+            self.response.headers['Content-Range'] = \
+                    byte_ranges.content_range(first, last, size)
+            self.response.app_iter = iter_content_range(resource, first, last)
+            self.response.content_length = last - first + 1
+            bytes_served = last - first + 1
+        else:
+            self.response.status = '206 Partial Content'
+            self.response.app_iter = byte_ranges.iter_multipart(
+                    ranges, size, self.response.headers['Content-Type'],
+                    functools.partial(iter_content_range, resource))
+            self.response.headers['Content-Type'] = \
+                    byte_ranges.multipart_content_type()
+            bytes_served = sum([last - first + 1 for first, last in ranges])
+        path_stats.record(self.request.path, hits=1,
+                          bytes_served=bytes_served)
+
+    def not_modified(self, resource):
+        """Checks the conditional request headers against the resource.
+
+        Returns True if the client's copy is current, so only the headers
+        need to be sent.
+        """
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return (resource.content_hash is not None and
+                    ('*' in tags or etag(resource) in tags))
+
+        if_modified_since = self.request.headers.get('If-Modified-Since')
+        if if_modified_since and resource.include_last_modified:
+            since = parse_http_date(if_modified_since)
+            return (since is not None and
+                    resource.modified_time.replace(microsecond=0) <= since)
+        return False
+
+    def if_range_matches(self, resource):
+        """Checks that a partial request is for the current content.
+
+        Returns False if the request has an If-Range header naming an older
+        version, in which case the full content must be sent.
+        """
+        if_range = self.request.headers.get('If-Range')
+        if not if_range:
+            return True
+        if if_range.startswith('"'):
+            return if_range == etag(resource)
+        return (resource.include_last_modified and
+                if_range == http_date(resource.modified_time))
+
+    def write_headers(self, resource):
+        self.response.headers['Content-Type'] = \
+                resource.content_type.encode('ascii', 'ignore')
+        self.response.headers['Accept-Ranges'] = 'bytes'
+        if resource.content_hash:
+            self.response.headers['ETag'] = etag(resource)
+        if resource.include_last_modified:
+            self.response.headers['Last-Modified'] = \
+                    http_date(resource.modified_time)
+
+        if resource.expires_seconds != -1:
+            self.response.headers['Expires'] = http_date(
+                    datetime.datetime.now() +
+                    datetime.timedelta(seconds=resource.expires_seconds))
+            self.response.headers['Cache-Control'] = (
+                    'max-age=%d, stale-while-revalidate=%d, '
+                    'stale-if-error=%d' % (resource.expires_seconds,
+                                           STALE_WHILE_REVALIDATE_SECONDS,
+                                           STALE_IF_ERROR_SECONDS))
+
+        keys = surrogate_keys(resource)
+        if self.request.path != resource.path:
+            # Served through an alias, which is purged by its own path.
+            keys += ' ' + path_surrogate_keys(self.request.path)
+        self.response.headers['Surrogate-Key'] = keys
+
+        for name, value in resource_headers(resource):
+            self.response.headers[name] = value
 
-            if resource.expires_seconds != -1:
-                self.response.headers['Expires'] = (datetime.datetime.now() +
-                        datetime.timedelta(
-                                seconds=resource.expires_seconds)).strftime(
-                                        '%a, %d %b %Y %H:%M:%S GMT')
 
-            for header in resource.headers:
-                self.response.headers[
-                        header.name.encode('ascii', 'ignore')] = \
-                                header.value.encode('ascii', 'ignore')
+class InstanceWarmer(webapp2.RequestHandler):
+    """Loads the caches used by public pages before an instance gets traffic.
+
+    App Engine sends /_ah/warmup to new instances first. Loading the redirect
+    table, the most requested resources and their rendered pages, and making
+    the first datastore and memcache calls, keeps that work off the first
+    user requests.
+    """
+    @ndb.toplevel
+    def get(self):
+        redirects.lookup('/')
+        paths = WARMUP_PATHS + path_stats.hottest_paths(
+                INSTANCE_WARMUP_PATHS)
+        resources = yield prefetch_async(paths)
+        yield [render_async(resource)
+               for resource in resources.itervalues() if resource.includes]
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('warmed %d resources' % len(resources))
 
 
 app = webapp2.WSGIApplication([
-    ('/content_manager_json.*', ContentJsonManager),
-    ('/content_lister.*', ContentLister),
+    ('/content_manager_json.*', 'content_admin.ContentJsonManager'),
+    ('/content_publish_json', 'content_admin.ContentPublisher'),
+    ('/content_revisions_json.*', 'content_admin.ContentRevisions'),
+    ('/content_redirects_json', 'content_admin.ContentRedirects'),
+    ('/content_delete_json', 'content_admin.ContentDeleter'),
+    ('/content_delete_task', 'content_admin.ContentDeleteTask'),
+    ('/content_chunk_cleanup', 'content_admin.ContentChunkCleaner'),
+    ('/content_key_migrate', 'content_admin.ContentKeyMigrator'),
+    ('/content_export_json', 'content_admin.ContentExporter'),
+    ('/content_lister.*', 'content_admin.ContentLister'),
+    ('/content_index_rebuild', 'content_admin.ContentIndexRebuilder'),
+    ('/content_search', 'content_admin.ContentSearch'),
+    ('/content_search_reindex', 'content_admin.ContentSearchReindexer'),
+    ('/content_sitemap_task', 'content_admin.ContentSitemapBuilder'),
+    ('/content_sitemap_rebuild', 'content_admin.ContentSitemapRebuilder'),
+    ('/content_warmup', 'content_admin.ContentWarmer'),
+    ('/content_profile', 'content_admin.ContentProfile'),
+    ('/content_stats', 'content_admin.ContentStats'),
+    ('/content_refresh', 'content_admin.ContentRefresher'),
+    ('/content_write_flush', 'content_admin.ContentWriteFlusher'),
+    ('/content_purge', 'content_admin.ContentPurger'),
+    ('/content_purge_task', 'content_admin.ContentPurgeFlusher'),
+    ('/_ah/warmup', InstanceWarmer),
     ('/.*', ResourceRenderer),
 ], debug=True)
+
+# Compiled once per instance from the routes above, which are all literal
+# paths or prefixes.
+_route_trie = routing.RouteTrie(
+        [(route.template, route) for route in app.router.match_routes])
+
+
+def match_route(router, request):
+    """Replaces webapp2's matcher, which tries each route's regex in turn.
+
+    Public pages, which are nearly all requests, only look at the first
+    characters of their path before going to the ResourceRenderer.
+    """
+    route = _route_trie.match(urllib.unquote(request.path))
+    if route is None:
+        raise webapp2.exc.HTTPNotFound()
+    return route, (), {}
+
+
+app.router.set_matcher(match_route)
+
+
+def route_name(environ):
+    """Names requests in profiles by the template of their route."""
+    route = _route_trie.match(urllib.unquote(environ.get('PATH_INFO', '')))
+    if route is None:
+        return 'unmatched'
+    return route.template
+
+
+app = wsgi_profiler.ProfilerMiddleware(app, route_name)
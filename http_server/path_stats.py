@@ -0,0 +1,116 @@
+"""Low overhead per path request counters for the ResourceRenderer.
+
+Each instance accumulates counters in memory and periodically merges them
+into one of several StatsShard entities chosen at random, so that instances
+rarely contend on the same entity. The stats page and warmup job merge the
+shards to find the hottest and slowest paths.
+"""
+
+import random
+import time
+
+from google.appengine.ext import ndb
+
+
+NUM_SHARDS = 20
+FLUSH_INTERVAL_SECONDS = 60
+
+# Bounds the memory used by the in-memory buffer and the size of each shard.
+# Paths outside the busiest MAX_TRACKED_PATHS are dropped from a shard.
+MAX_TRACKED_PATHS = 5000
+
+# Positions of the counters kept for each path.
+HITS = 0
+CACHE_MISSES = 1
+DATASTORE_MS = 2
+BYTES_SERVED = 3
+NUM_COUNTERS = 4
+
+_counters = {}
+_last_flush = time.time()
+
+
+class StatsShard(ndb.Model):
+    """Counters for many paths, stored as {path: [hits, misses, ms, bytes]}."""
+    counters = ndb.JsonProperty(compressed=True)
+
+
+def record(path, hits=0, cache_misses=0, datastore_ms=0, bytes_served=0):
+    """Adds to the in-memory counters for a path, flushing them if due."""
+    counters = _counters.get(path)
+    if counters is None:
+        if len(_counters) >= MAX_TRACKED_PATHS:
+            return
+        counters = _counters[path] = [0] * NUM_COUNTERS
+    counters[HITS] += hits
+    counters[CACHE_MISSES] += cache_misses
+    counters[DATASTORE_MS] += datastore_ms
+    counters[BYTES_SERVED] += bytes_served
+
+    if time.time() - _last_flush > FLUSH_INTERVAL_SECONDS:
+        flush()
+
+
+def timed(load_multi_async):
+    """Wraps a resource loading tasklet to record misses and datastore time.
+
+    The wrapped tasklet can be passed to resource_cache, which only calls it
+    for the paths which were not in the cache.
+    """
+    @ndb.tasklet
+    def load_and_record(paths):
+        start = time.time()
+        resources = yield load_multi_async(paths)
+        elapsed_ms = (time.time() - start) * 1000.0 / len(paths)
+        for path in paths:
+            record(path, cache_misses=1, datastore_ms=elapsed_ms)
+        raise ndb.Return(resources)
+    return load_and_record
+
+
+def merge_counters(target, source):
+    for path, counters in source.iteritems():
+        totals = target.setdefault(path, [0] * NUM_COUNTERS)
+        for i in xrange(NUM_COUNTERS):
+            totals[i] += counters[i]
+
+
+def flush():
+    """Merges this instance's counters into a randomly chosen shard."""
+    global _counters, _last_flush
+    pending = _counters
+    _counters = {}
+    _last_flush = time.time()
+    if not pending:
+        return
+
+    shard_key = ndb.Key(StatsShard, random.randint(0, NUM_SHARDS - 1))
+
+    @ndb.transactional
+    def merge_into_shard():
+        shard = shard_key.get() or StatsShard(key=shard_key, counters={})
+        merge_counters(shard.counters, pending)
+        if len(shard.counters) > MAX_TRACKED_PATHS:
+            busiest = sorted(shard.counters.iteritems(),
+                             key=lambda item: item[1][HITS], reverse=True)
+            shard.counters = dict(busiest[:MAX_TRACKED_PATHS])
+        shard.put()
+
+    merge_into_shard()
+
+
+def load_totals():
+    """Returns a dict of path to the counters summed over all shards."""
+    totals = {}
+    shard_keys = [ndb.Key(StatsShard, i) for i in xrange(NUM_SHARDS)]
+    for shard in ndb.get_multi(shard_keys):
+        if shard is not None:
+            merge_counters(totals, shard.counters)
+    return totals
+
+
+def hottest_paths(count):
+    """Returns up to count paths, most requested first."""
+    totals = load_totals()
+    return sorted(totals, key=lambda path: totals[path][HITS],
+                  reverse=True)[:count]
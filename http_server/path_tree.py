@@ -0,0 +1,105 @@
+"""Bookkeeping for an index of resource paths organised by directory.
+
+Each directory, a path prefix ending in /, has a dict of entries. Resources
+directly in the directory are entries mapping their name to 1, and the
+directory's own resource has the name ''. Subdirectories are entries
+mapping their name, ending in /, to the number of resources anywhere below
+them. So /docs/api/index.html is the entry index.html of /docs/api/, and is
+counted in the entry api/ of /docs/ and the entry docs/ of /.
+"""
+
+
+def split_path(path):
+    """Returns the directory holding a path and the path's name within it."""
+    end = path.rfind('/') + 1
+    return path[:end], path[end:]
+
+
+def parent_directory(directory):
+    """Returns the parent of a directory and the directory's name within it.
+
+    The root directory / has no parent, so (None, None) is returned for it,
+    as it is for anything not starting with /, which is not a directory.
+    """
+    if directory == '/' or not directory.startswith('/'):
+        return None, None
+    end = directory.rfind('/', 0, len(directory) - 1) + 1
+    return directory[:end], directory[end:]
+
+
+def add_names(entries, names):
+    """Adds resources to a directory's entries.
+
+    Returns:
+      The number of names which were not already present.
+    """
+    added = 0
+    for name in names:
+        if name not in entries:
+            entries[name] = 1
+            added += 1
+    return added
+
+
+def remove_names(entries, names):
+    """Removes resources from a directory's entries.
+
+    Returns:
+      The number of names which were present.
+    """
+    removed = 0
+    for name in names:
+        if entries.pop(name, None) is not None:
+            removed += 1
+    return removed
+
+
+def ancestor_changes(counts):
+    """Works out how the subdirectory counts change for resources added.
+
+    Args:
+      counts: dict mapping a directory to the change in the number of
+          resources directly in it.
+
+    Returns:
+      A dict mapping each ancestor of those directories to a dict of the
+      change in the count of each of its subdirectories.
+    """
+    changes = {}
+    for directory, count in counts.iteritems():
+        if not count:
+            continue
+        parent, name = parent_directory(directory)
+        while parent is not None:
+            parent_changes = changes.setdefault(parent, {})
+            parent_changes[name] = parent_changes.get(name, 0) + count
+            parent, name = parent_directory(parent)
+    return changes
+
+
+def apply_changes(entries, changes):
+    """Adds changes from ancestor_changes to a directory's entries."""
+    for name, count in changes.iteritems():
+        count += entries.get(name, 0)
+        if count > 0:
+            entries[name] = count
+        else:
+            entries.pop(name, None)
+
+
+def build(paths):
+    """Returns a dict mapping each directory to its entries for paths."""
+    directories = {}
+    counts = {}
+    for path in paths:
+        directory, name = split_path(path)
+        counts[directory] = counts.get(directory, 0) + add_names(
+                directories.setdefault(directory, {}), [name])
+    for directory, changes in ancestor_changes(counts).iteritems():
+        apply_changes(directories.setdefault(directory, {}), changes)
+    return directories
+
+
+def subtree_size(entries):
+    """Returns the number of resources in or below a directory."""
+    return sum(entries.itervalues())
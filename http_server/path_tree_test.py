@@ -0,0 +1,57 @@
+import unittest
+
+import path_tree
+
+
+class PathTreeTest(unittest.TestCase):
+
+    def test_split_path(self):
+        self.assertEqual(path_tree.split_path('/docs/api/index.html'),
+                         ('/docs/api/', 'index.html'))
+        self.assertEqual(path_tree.split_path('/docs/'), ('/docs/', ''))
+        self.assertEqual(path_tree.split_path('/'), ('/', ''))
+
+    def test_parent_directory(self):
+        self.assertEqual(path_tree.parent_directory('/docs/api/'),
+                         ('/docs/', 'api/'))
+        self.assertEqual(path_tree.parent_directory('/docs/'), ('/', 'docs/'))
+        self.assertEqual(path_tree.parent_directory('/'), (None, None))
+        self.assertEqual(path_tree.parent_directory(''), (None, None))
+        self.assertEqual(path_tree.parent_directory('docs/'), (None, None))
+
+    def test_build(self):
+        directories = path_tree.build(
+                ['/', '/about', '/docs/', '/docs/api/a', '/docs/api/b',
+                 '/docs/api/b'])
+        self.assertEqual(directories, {
+            '/': {'': 1, 'about': 1, 'docs/': 3},
+            '/docs/': {'': 1, 'api/': 2},
+            '/docs/api/': {'a': 1, 'b': 1},
+        })
+        self.assertEqual(path_tree.subtree_size(directories['/']), 5)
+
+    def test_paths_without_a_leading_slash(self):
+        self.assertEqual(path_tree.ancestor_changes({'': 1, 'a/b/': 1}), {})
+        self.assertEqual(path_tree.build(['nolead']), {'': {'nolead': 1}})
+
+    def test_incremental_updates(self):
+        directories = path_tree.build(['/docs/api/a', '/docs/api/b'])
+        api = directories['/docs/api/']
+        counts = {
+            '/docs/api/': path_tree.add_names(api, ['b', 'c']) -
+                          path_tree.remove_names(api, ['a', 'missing']),
+        }
+        self.assertEqual(counts['/docs/api/'], 0)
+        self.assertEqual(path_tree.ancestor_changes(counts), {})
+
+        counts = {'/docs/api/': -path_tree.remove_names(api, ['b', 'c'])}
+        changes = path_tree.ancestor_changes(counts)
+        self.assertEqual(changes, {'/': {'docs/': -2}, '/docs/': {'api/': -2}})
+        for directory, directory_changes in changes.iteritems():
+            path_tree.apply_changes(directories[directory], directory_changes)
+        self.assertEqual(directories['/'], {})
+        self.assertEqual(directories['/docs/'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
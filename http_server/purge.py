@@ -0,0 +1,130 @@
+"""Batched, coalesced purge notifications for caches in front of the CMS.
+
+Resources are served with a Surrogate-Key header listing the keys made by
+cache_keys, such as their path, the directories above it and their tags.
+When resources change, queue_purge records the affected keys in a pull
+queue. A single push task per PURGE_WINDOW_SECONDS window then leases
+everything queued so far, removes duplicate keys and sends them to the
+configured Purger in a few batches.
+
+Set PURGE_ENDPOINT to the URL of the CDN's purge API, or of purge_sink.py
+when testing locally. Without an endpoint purges are only logged. Use
+set_purger to plug in a purger for a CDN with a different API.
+"""
+
+import datetime
+import json
+import logging
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.api import urlfetch
+
+
+PURGE_ENDPOINT = None
+PURGE_ENDPOINT_HEADERS = {}
+
+PURGE_WINDOW_SECONDS = 10
+MAX_KEYS_PER_PURGE = 256
+
+# Configured in queue.yaml.
+PULL_QUEUE_NAME = 'purge-pull'
+# Handled by ContentPurgeFlusher, which calls flush.
+PURGE_TASK_URL = '/content_purge_task'
+
+# Number of queued notifications leased by each call during a flush.
+LEASE_BATCH_SIZE = 1000
+LEASE_SECONDS = 60
+
+
+class Purger(object):
+    """Sends purge requests for surrogate keys to a downstream cache."""
+
+    def purge(self, keys):
+        raise NotImplementedError()
+
+
+class LoggingPurger(Purger):
+    """Only logs the keys, for deployments without a CDN."""
+
+    def purge(self, keys):
+        logging.info('Purge surrogate keys: %s', ' '.join(keys))
+
+
+class HttpPurger(Purger):
+    """Posts {"surrogate_keys": [...]} as JSON to a purge endpoint."""
+
+    def __init__(self, endpoint, headers=None):
+        self.endpoint = endpoint
+        self.headers = dict(headers or {})
+        self.headers['Content-Type'] = 'application/json'
+
+    def purge(self, keys):
+        response = urlfetch.fetch(
+                self.endpoint, method=urlfetch.POST,
+                payload=json.dumps({'surrogate_keys': keys}),
+                headers=self.headers)
+        if response.status_code >= 300:
+            raise PurgeError('Purge request failed with status %d' % (
+                    response.status_code,))
+
+
+class PurgeError(Exception):
+    pass
+
+
+_purger = None
+
+
+def set_purger(purger):
+    global _purger
+    _purger = purger
+
+
+def get_purger():
+    if _purger is None:
+        if PURGE_ENDPOINT:
+            set_purger(HttpPurger(PURGE_ENDPOINT, PURGE_ENDPOINT_HEADERS))
+        else:
+            set_purger(LoggingPurger())
+    return _purger
+
+
+def queue_purge(keys):
+    """Records keys to purge in the next batched purge notification."""
+    if not keys:
+        return
+    taskqueue.Queue(PULL_QUEUE_NAME).add(
+            taskqueue.Task(payload=json.dumps(list(keys)), method='PULL'))
+
+    # Name the push task after the window so each window flushes once. It
+    # runs when the window ends, after every notification queued during it.
+    window = int(time.time()) // PURGE_WINDOW_SECONDS
+    try:
+        taskqueue.add(url=PURGE_TASK_URL, name='purge-%d' % window,
+                      eta=datetime.datetime.utcfromtimestamp(
+                              (window + 1) * PURGE_WINDOW_SECONDS))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def flush():
+    """Sends every queued key to the purger, removing duplicates.
+
+    Returns:
+      The number of distinct keys purged.
+    """
+    queue = taskqueue.Queue(PULL_QUEUE_NAME)
+    purged = 0
+    while True:
+        tasks = queue.lease_tasks(LEASE_SECONDS, LEASE_BATCH_SIZE)
+        if not tasks:
+            return purged
+        keys = set()
+        for task in tasks:
+            keys.update(json.loads(task.payload))
+        keys = sorted(keys)
+        for i in xrange(0, len(keys), MAX_KEYS_PER_PURGE):
+            get_purger().purge(keys[i:i + MAX_KEYS_PER_PURGE])
+        queue.delete_tasks(tasks)
+        purged += len(keys)
@@ -0,0 +1,38 @@
+"""A local stand-in for a CDN purge API, for testing purge notifications.
+
+Run this script with a port number, then set purge.PURGE_ENDPOINT to
+http://localhost:<port>/purge in the app running on the development server.
+Every purge request received is printed with the keys it names.
+
+Example:
+python purge_sink.py 8081
+"""
+
+import BaseHTTPServer
+import json
+import sys
+
+
+class PurgeSinkHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('Content-Length')))
+        keys = json.loads(body)['surrogate_keys']
+        print('Purge %s: %s' % (self.path, ' '.join(keys)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({'purged': len(keys)}))
+
+
+def main():
+    port = 8081
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    server = BaseHTTPServer.HTTPServer(('localhost', port), PurgeSinkHandler)
+    print('Listening for purge requests on port %d' % port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
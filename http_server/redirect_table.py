@@ -0,0 +1,81 @@
+"""In-memory table of the redirects and aliases which apply to paths.
+
+A rule either applies to one exact path or rewrites every path below a
+prefix. Exact rules are kept in a dict, and prefix rules in a trie so the
+longest matching prefix is found in one pass over the path. Exact rules take
+precedence over prefix rules.
+"""
+
+# Status of rules which serve the target's content at the source path
+# instead of redirecting to it.
+ALIAS = 200
+
+
+class RedirectTable(object):
+
+    def __init__(self):
+        self.exact = {}
+        # Each node is [children by character, (target, status) or None].
+        self.prefixes = [{}, None]
+
+    def set(self, source, target, status, is_prefix=False):
+        """Adds or replaces the rule for a path or prefix.
+
+        Args:
+          source: str The path, or prefix of paths, the rule applies to.
+          target: str The path or URL to redirect to. For prefix rules the
+              rest of the path after the prefix is appended to it.
+          status: int The redirect status code, or ALIAS.
+          is_prefix: bool Whether the rule applies to every path starting
+              with source.
+        """
+        if is_prefix:
+            node = self.prefixes
+            for character in source:
+                node = node[0].setdefault(character, [{}, None])
+            node[1] = (target, status)
+        else:
+            self.exact[source] = (target, status)
+
+    def remove(self, source, is_prefix=False):
+        """Removes the rule for a path or prefix if there is one."""
+        if not is_prefix:
+            self.exact.pop(source, None)
+            return
+        node = self.prefixes
+        for character in source:
+            node = node[0].get(character)
+            if node is None:
+                return
+        # The empty nodes are left in place; they cost only memory.
+        node[1] = None
+
+    def lookup(self, path):
+        """Finds the rule which applies to a path.
+
+        Returns:
+          A tuple of the location to send the request to and the status, or
+          None if no rule applies.
+        """
+        rule = self.exact.get(path)
+        if rule is not None:
+            return rule
+
+        match = None
+        matched_length = 0
+        node = self.prefixes
+        for length, character in enumerate(path):
+            if node[1] is not None:
+                match = node[1]
+                matched_length = length
+            node = node[0].get(character)
+            if node is None:
+                break
+        else:
+            if node[1] is not None:
+                match = node[1]
+                matched_length = len(path)
+        if match is None:
+            return None
+        target, status = match
+        return target + path[matched_length:], status
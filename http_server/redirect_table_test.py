@@ -0,0 +1,52 @@
+import unittest
+
+import redirect_table
+
+
+class RedirectTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = redirect_table.RedirectTable()
+        self.table.set('/old.html', '/new.html', 301)
+        self.table.set('/docs/', '/manual/', 301, is_prefix=True)
+        self.table.set('/docs/api/', 'https://api.example.com/', 302,
+                       is_prefix=True)
+        self.table.set('/docs/api/index.html', '/api.html',
+                       redirect_table.ALIAS)
+
+    def test_exact(self):
+        self.assertEqual(self.table.lookup('/old.html'), ('/new.html', 301))
+        self.assertEqual(self.table.lookup('/old.htm'), None)
+        self.assertEqual(self.table.lookup('/'), None)
+        self.assertEqual(self.table.lookup(''), None)
+
+    def test_longest_prefix(self):
+        self.assertEqual(self.table.lookup('/docs/'), ('/manual/', 301))
+        self.assertEqual(self.table.lookup('/docs/guide/a.html'),
+                         ('/manual/guide/a.html', 301))
+        self.assertEqual(self.table.lookup('/docs/api/v1/x'),
+                         ('https://api.example.com/v1/x', 302))
+        self.assertEqual(self.table.lookup('/docs'), None)
+
+    def test_exact_before_prefix(self):
+        self.assertEqual(self.table.lookup('/docs/api/index.html'),
+                         ('/api.html', redirect_table.ALIAS))
+
+    def test_remove(self):
+        self.table.remove('/docs/api/', is_prefix=True)
+        self.table.remove('/old.html')
+        self.table.remove('/never/added/', is_prefix=True)
+        self.assertEqual(self.table.lookup('/docs/api/v1/x'),
+                         ('/manual/api/v1/x', 301))
+        self.assertEqual(self.table.lookup('/old.html'), None)
+
+    def test_root_prefix(self):
+        self.table.set('/', 'https://example.com/', 301, is_prefix=True)
+        self.assertEqual(self.table.lookup('/anything'),
+                         ('https://example.com/anything', 301))
+        self.assertEqual(self.table.lookup('/'),
+                         ('https://example.com/', 301))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Stored redirects and aliases, held in memory by every instance.
+
+Each instance keeps a redirect_table.RedirectTable, so looking up the rule
+for a request never reads storage. Saving or removing a rule sets a new
+random version in memcache. At most every CHECK_INTERVAL_SECONDS an
+instance compares that version with the one it loaded, and when it differs
+queries only the rules modified since its last load. Removed rules are kept
+as tombstones so that instances see the removal. Changing a rule also purges
+the responses for its source from caches in front of the site.
+"""
+
+import datetime
+import time
+import uuid
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import cache_keys
+import redirect_table
+
+
+ALIAS = redirect_table.ALIAS
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+CHECK_INTERVAL_SECONDS = 5
+VERSION_KEY = 'redirects:version'
+
+# Rules modified this long before the last load are queried again, so rules
+# whose write was still being applied, or whose timestamp came from a
+# slightly slow clock, are not missed.
+RELOAD_OVERLAP_SECONDS = 60
+
+
+class Redirect(ndb.Model):
+    """A redirect or alias, keyed by its kind and source path."""
+    source = ndb.StringProperty(indexed=False)
+    is_prefix = ndb.BooleanProperty(indexed=False)
+    target = ndb.StringProperty(indexed=False)
+    # One of REDIRECT_STATUSES, or ALIAS.
+    status = ndb.IntegerProperty(indexed=False)
+    # True once the rule has been removed.
+    deleted = ndb.BooleanProperty(default=False, indexed=False)
+    modified_time = ndb.DateTimeProperty(auto_now=True)
+
+
+def redirect_key(source, is_prefix):
+    kind = 'prefix' if is_prefix else 'exact'
+    return ndb.Key(Redirect, '%s:%s' % (kind, source))
+
+
+_table = redirect_table.RedirectTable()
+_loaded_version = None
+_loaded_until = datetime.datetime.utcfromtimestamp(0)
+_last_check = 0
+
+
+def _apply(redirects):
+    for redirect in redirects:
+        if redirect.deleted:
+            _table.remove(redirect.source, redirect.is_prefix)
+        else:
+            _table.set(redirect.source, redirect.target, redirect.status,
+                       redirect.is_prefix)
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def _reload_if_changed():
+    global _loaded_version, _loaded_until, _last_check
+    _last_check = time.time()
+    version = memcache.get(VERSION_KEY)
+    if version is not None and version == _loaded_version:
+        return
+    if version is None:
+        # The version was evicted, or never set. Every instance reloads once,
+        # and adding it back means they then only reload after a change. A
+        # new random version can never match one an instance already has.
+        memcache.add(VERSION_KEY, _new_version())
+        version = memcache.get(VERSION_KEY)
+    started = datetime.datetime.utcnow()
+    since = _loaded_until - datetime.timedelta(seconds=RELOAD_OVERLAP_SECONDS)
+    _apply(Redirect.query(Redirect.modified_time > since).order(
+            Redirect.modified_time).iter(batch_size=1000))
+    _loaded_version = version
+    _loaded_until = started
+
+
+def lookup(path):
+    """Returns the (location, status) of the rule for path, or None.
+
+    Only reads storage when the rules may have changed and the last check
+    was more than CHECK_INTERVAL_SECONDS ago.
+    """
+    if time.time() - _last_check > CHECK_INTERVAL_SECONDS:
+        _reload_if_changed()
+    return _table.lookup(path)
+
+
+def _changed(source, is_prefix):
+    memcache.set(VERSION_KEY, _new_version())
+    # Imported here as only the admin pages change rules, and public
+    # instances do not load purge when they start.
+    import purge
+    if is_prefix:
+        # Every path under the prefix has the key of the directory it is in.
+        source = source[:source.rfind('/') + 1]
+    purge.queue_purge([cache_keys.surrogate_key(source)])
+
+
+def save(source, target, status, is_prefix=False):
+    """Adds or replaces a redirect, or an alias when status is ALIAS."""
+    if status != ALIAS and status not in REDIRECT_STATUSES:
+        raise ValueError('Unsupported redirect status %r' % status)
+    Redirect(key=redirect_key(source, is_prefix), source=source,
+             is_prefix=is_prefix, target=target, status=status).put()
+    _changed(source, is_prefix)
+
+
+def remove(source, is_prefix=False):
+    """Replaces a redirect with a tombstone, if it exists."""
+    redirect = redirect_key(source, is_prefix).get()
+    if redirect is not None and not redirect.deleted:
+        redirect.deleted = True
+        redirect.put()
+        _changed(source, is_prefix)
+
+
+def list_redirects():
+    """Returns every redirect which has not been removed."""
+    return [redirect for redirect in Redirect.query().iter(batch_size=1000)
+            if not redirect.deleted]
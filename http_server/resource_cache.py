@@ -0,0 +1,128 @@
+"""Memcache backed cache of the resources served by http_server.
+
+Resources are cached by path so that rendering a page, or warming many pages
+after a deploy, takes a single batched memcache call in the common case. The
+cache is read and written through the ndb context, so lookups made by
+concurrent tasklets are combined into one memcache RPC.
+
+Each entry has a soft and a hard time to live. An entry older than
+SOFT_TTL_SECONDS is still served, but the first request to find it stale
+queues a task to reload it from the datastore, so datastore latency does not
+land on the requests themselves. Memcache drops entries after
+HARD_TTL_SECONDS.
+"""
+
+import time
+
+from google.appengine.ext import ndb
+
+
+KEY_PREFIX = 'resource:'
+REFRESH_LOCK_PREFIX = 'refresh:'
+
+SOFT_TTL_SECONDS = 300
+HARD_TTL_SECONDS = 24 * 60 * 60
+
+# Only one refresh task is queued for a stale path within this period.
+REFRESH_LOCK_SECONDS = 60
+
+# Handled by ContentRefresher, which calls refresh_async.
+REFRESH_URL = '/content_refresh'
+
+
+@ndb.tasklet
+def get_multi_async(paths, load_multi_async):
+    """Looks up resources in the cache, loading and caching any misses.
+
+    Args:
+      paths: list of str The paths of the resources to look up.
+      load_multi_async: tasklet which takes a list of paths and returns a
+          dict of path to Resource for the paths which have a stored
+          resource.
+
+    Returns:
+      A future for a dict mapping each path which has a resource to its
+      Resource.
+    """
+    context = ndb.get_context()
+    cached = yield [context.memcache_get(KEY_PREFIX + path) for path in paths]
+    resources = {}
+    missing = []
+    stale = []
+    now = time.time()
+    for path, entry in zip(paths, cached):
+        # Entries are (soft expiry time, Resource). Anything else was cached
+        # by an earlier version and is treated as a miss.
+        if not isinstance(entry, tuple):
+            missing.append(path)
+            continue
+        soft_expiry, resources[path] = entry
+        if soft_expiry < now:
+            stale.append(path)
+
+    if stale:
+        yield schedule_refresh_async(stale)
+    if missing:
+        loaded = yield load_multi_async(missing)
+        yield set_multi_async(loaded.values())
+        resources.update(loaded)
+    raise ndb.Return(resources)
+
+
+def get_multi(paths, load_multi_async):
+    return get_multi_async(paths, load_multi_async).get_result()
+
+
+def get(path, load_multi_async):
+    """Returns the Resource for path, or None if there is no such resource."""
+    return get_multi([path], load_multi_async).get(path)
+
+
+@ndb.tasklet
+def set_multi_async(resources):
+    """Replaces the cached copies of the resources after they are saved."""
+    context = ndb.get_context()
+    soft_expiry = time.time() + SOFT_TTL_SECONDS
+    yield [context.memcache_set(KEY_PREFIX + resource.path,
+                                (soft_expiry, resource),
+                                time=HARD_TTL_SECONDS)
+           for resource in resources]
+
+
+@ndb.tasklet
+def delete_multi_async(paths):
+    """Drops the cached copies of resources after they are deleted."""
+    context = ndb.get_context()
+    yield [context.memcache_delete(KEY_PREFIX + path) for path in paths]
+
+
+@ndb.tasklet
+def schedule_refresh_async(paths):
+    """Queues one background reload of the stale entries for paths.
+
+    Adding the lock only succeeds for the first request to find a path
+    stale, so concurrent requests do not queue duplicate refreshes.
+    """
+    context = ndb.get_context()
+    added = yield [context.memcache_add(REFRESH_LOCK_PREFIX + path, 1,
+                                        time=REFRESH_LOCK_SECONDS)
+                   for path in paths]
+    locked = [path for path, was_added in zip(paths, added) if was_added]
+    if locked:
+        # Imported here as public pages only need it once an entry is
+        # stale, not when an instance starts.
+        from google.appengine.api import taskqueue
+        yield taskqueue.Queue().add_async(
+                taskqueue.Task(url=REFRESH_URL, params={'path': locked}))
+
+
+@ndb.tasklet
+def refresh_async(paths, load_multi_async):
+    """Reloads the cached copies of resources from the datastore."""
+    loaded = yield load_multi_async(paths)
+    context = ndb.get_context()
+    removed = [path for path in paths if path not in loaded]
+    yield ([set_multi_async(loaded.values())] +
+           [context.memcache_delete(KEY_PREFIX + path) for path in removed] +
+           [context.memcache_delete(REFRESH_LOCK_PREFIX + path)
+            for path in paths])
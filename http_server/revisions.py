@@ -0,0 +1,132 @@
+"""Revision history of the content of each resource.
+
+Each save which changes a resource's content adds a Revision entity under the
+resource's key, numbered from 1. Most revisions hold only a text_delta delta
+against the revision before them. Every SNAPSHOT_INTERVAL revisions, and
+whenever a delta would be no smaller, the full compressed content is stored
+instead, so reconstructing any revision applies at most SNAPSHOT_INTERVAL - 1
+deltas to content fetched with a single batched get.
+
+Datastore entities are limited in size, so history is not kept for content
+which is still larger than MAX_REVISION_BYTES once compressed. Such
+revisions are listed but cannot be reconstructed, and neither can the deltas
+which follow them up to the next snapshot.
+"""
+
+import zlib
+
+from google.appengine.ext import ndb
+
+import text_delta
+
+
+SNAPSHOT_INTERVAL = 10
+
+# Leaves room for the other properties below the datastore's entity limit.
+MAX_REVISION_BYTES = 900 * 1024
+
+# Number of the most recent revisions returned by list_revisions_async.
+MAX_LISTED_REVISIONS = 20
+
+
+class Revision(ndb.Model):
+    """One saved version of a resource's content.
+
+    Revisions are children of the resource and their ids are the revision
+    numbers. Content is only stored for snapshots; other revisions store a
+    delta from the previous revision.
+    """
+    is_snapshot = ndb.BooleanProperty(indexed=False)
+    # zlib compressed content for snapshots, otherwise a text_delta delta.
+    # None when the content was too large to keep.
+    data = ndb.BlobProperty()
+    content_hash = ndb.StringProperty(indexed=False)
+    content_type = ndb.StringProperty(indexed=False)
+    is_binary = ndb.BooleanProperty(indexed=False)
+    size = ndb.IntegerProperty(indexed=False)
+    modified_time = ndb.DateTimeProperty(indexed=False)
+
+
+def revision_key(resource_key, number):
+    return ndb.Key(Revision, number, parent=resource_key)
+
+
+def snapshot_number(number):
+    """Returns the number of the last scheduled snapshot at or before number.
+    """
+    return number - (number - 1) % SNAPSHOT_INTERVAL
+
+
+def needs_previous_data(number):
+    """Returns whether revision number may be stored as a delta."""
+    return number != snapshot_number(number)
+
+
+def new_revision(resource, data, previous_data=None):
+    """Builds the Revision for a resource's revision number and content.
+
+    Args:
+      resource: Resource The resource being saved, with its revision set.
+      data: str The new content.
+      previous_data: str The content of the previous revision, or None to
+          store a snapshot.
+    """
+    revision = Revision(key=revision_key(resource.key, resource.revision),
+                        content_hash=resource.content_hash,
+                        content_type=resource.content_type,
+                        is_binary=resource.is_binary,
+                        size=len(data),
+                        modified_time=resource.modified_time)
+    snapshot = zlib.compress(data)
+    if previous_data is not None and needs_previous_data(resource.revision):
+        delta = text_delta.make_delta(previous_data, data)
+        if len(delta) < min(len(snapshot), MAX_REVISION_BYTES):
+            revision.is_snapshot = False
+            revision.data = delta
+            return revision
+    revision.is_snapshot = True
+    if len(snapshot) <= MAX_REVISION_BYTES:
+        revision.data = snapshot
+    return revision
+
+
+@ndb.tasklet
+def load_revision_async(resource_key, number):
+    """Reconstructs the content of one revision of a resource.
+
+    Returns:
+      A future for a tuple of the Revision and its content, or for None if
+      the revision does not exist or its content was not kept.
+    """
+    if number < 1:
+        raise ndb.Return(None)
+    first = snapshot_number(number)
+    revisions = yield ndb.get_multi_async(
+            [revision_key(resource_key, i) for i in xrange(first, number + 1)])
+    if revisions[-1] is None:
+        raise ndb.Return(None)
+
+    # Start from the latest snapshot, which is later than the scheduled one
+    # when a delta was no smaller than the content.
+    start = len(revisions) - 1
+    while not revisions[start].is_snapshot:
+        start -= 1
+        if start < 0 or revisions[start] is None:
+            raise ndb.Return(None)
+    if revisions[start].data is None:
+        raise ndb.Return(None)
+    data = zlib.decompress(revisions[start].data)
+    for revision in revisions[start + 1:]:
+        data = text_delta.apply_delta(data, revision.data)
+    raise ndb.Return((revisions[-1], data))
+
+
+@ndb.tasklet
+def list_revisions_async(resource_key, head):
+    """Returns a future for the latest revisions up to head, newest first."""
+    first = max(1, head - MAX_LISTED_REVISIONS + 1)
+    keys = [revision_key(resource_key, i)
+            for i in xrange(head, first - 1, -1)]
+    revisions = yield ndb.get_multi_async(keys)
+    raise ndb.Return([revision for revision in revisions
+                      if revision is not None])
@@ -0,0 +1,69 @@
+"""Matches request paths against a route table compiled into a trie.
+
+Every route in the apps is either an exact path, such as /content_stats, or
+a prefix, such as /content_lister.* or the catch all /.*. Instead of trying
+each route's regular expression in turn, RouteTrie walks the characters of
+the path once. Paths which are not admin pages leave the trie after a
+character or two and go to the catch all route.
+"""
+
+# Characters which would make a route more than a literal path or prefix.
+_REGEX_CHARACTERS = frozenset('.^$*+?{}[]()|\\')
+
+# Positions in each trie node.
+_CHILDREN = 0
+_EXACT = 1
+_PREFIX = 2
+
+
+class RouteTrie(object):
+    """Finds the first of an ordered list of routes matching a path.
+
+    Gives the same result as trying the routes' regular expressions in
+    order, with each anchored at both ends as webapp2 does.
+    """
+
+    def __init__(self, routes):
+        """Compiles the route table.
+
+        Args:
+          routes: list of (template, value) tuples, where template is a
+              literal path optionally ending in .* to match any path with
+              that prefix.
+
+        Raises:
+          ValueError: A template is not a literal path or prefix.
+        """
+        self.root = [{}, None, None]
+        for order, (template, value) in enumerate(routes):
+            position = _EXACT
+            if template.endswith('.*'):
+                template = template[:-2]
+                position = _PREFIX
+            if _REGEX_CHARACTERS.intersection(template):
+                raise ValueError('Route %r is not a literal path' % template)
+            node = self.root
+            for character in template:
+                node = node[_CHILDREN].setdefault(character, [{}, None, None])
+            # Earlier routes take precedence over later identical ones.
+            if node[position] is None:
+                node[position] = (order, value)
+
+    def match(self, path):
+        """Returns the value of the first route matching path, or None."""
+        best = None
+        node = self.root
+        for character in path:
+            prefix = node[_PREFIX]
+            if prefix is not None and (best is None or prefix < best):
+                best = prefix
+            node = node[_CHILDREN].get(character)
+            if node is None:
+                break
+        else:
+            for route in (node[_PREFIX], node[_EXACT]):
+                if route is not None and (best is None or route < best):
+                    best = route
+        if best is None:
+            return None
+        return best[1]
@@ -0,0 +1,60 @@
+import re
+import unittest
+
+import routing
+
+
+ROUTES = [
+    '/content_manager_json.*',
+    '/content_publish_json',
+    '/content_lister.*',
+    '/content_purge',
+    '/content_purge_task',
+    '/.*',
+]
+
+
+def regex_match(routes, path):
+    for template in routes:
+        if re.match('^' + template + '$', path):
+            return template
+    return None
+
+
+class RouteTrieTest(unittest.TestCase):
+
+    def assert_matches_regexes(self, routes, paths):
+        trie = routing.RouteTrie([(template, template) for template in routes])
+        for path in paths:
+            self.assertEqual(trie.match(path), regex_match(routes, path),
+                             'Different routes for %r' % path)
+
+    def test_same_as_regexes(self):
+        self.assert_matches_regexes(ROUTES, [
+            '/', '', '/index.html', '/content_manager_json',
+            '/content_manager_json/docs/', '/content_publish_json',
+            '/content_publish_jsonx', '/content_lister', '/content_lister?',
+            '/content_purge', '/content_purge_task', '/content_purge_t',
+            '/content_', 'content_lister', u'/caf\xe9'])
+
+    def test_order_is_kept(self):
+        routes = ['/a.*', '/abc', '/ab.*', '/abc.*']
+        self.assert_matches_regexes(
+                routes, ['/a', '/ab', '/abc', '/abcd', '/b', '/'])
+        self.assert_matches_regexes(
+                list(reversed(routes)),
+                ['/a', '/ab', '/abc', '/abcd', '/b', '/'])
+
+    def test_no_catch_all(self):
+        trie = routing.RouteTrie([('/content_stats', 'stats')])
+        self.assertEqual(trie.match('/content_stats'), 'stats')
+        self.assertEqual(trie.match('/content_stat'), None)
+        self.assertEqual(trie.match('/content_statsx'), None)
+
+    def test_rejects_regexes(self):
+        self.assertRaises(ValueError, routing.RouteTrie, [('/a/(\\d+)', 1)])
+        self.assertRaises(ValueError, routing.RouteTrie, [('/a.html', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""Builds sitemap.xml files, as described at https://www.sitemaps.org/.
+
+Pages are spread over a fixed number of shards by a hash of their path, so
+saving a page changes the sitemap file of one shard. The sitemap index lists
+the file of each shard which has pages.
+"""
+
+import urllib
+import zlib
+from xml.sax.saxutils import escape
+
+
+# Paths are already URL encoded, so % is left alone.
+LOC_SAFE_CHARACTERS = "/:@!$&'()*+,;=%~-._"
+
+# Content types of the pages listed in sitemaps.
+PAGE_TYPES = ('text/html', 'application/xhtml+xml')
+
+URLSET_START = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                '\n')
+URLSET_END = '</urlset>\n'
+INDEX_START = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<sitemapindex '
+               'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+INDEX_END = '</sitemapindex>\n'
+
+
+def shard_for(path, shard_count):
+    """Returns the number of the shard which lists path."""
+    return (zlib.crc32(path.encode('utf-8')) & 0xffffffff) % shard_count
+
+
+def shard_path(shard):
+    return '/sitemap-%d.xml' % shard
+
+
+def is_page(content_type):
+    """Whether resources of a content type are listed in sitemaps."""
+    return (content_type or '').split(';')[0].strip().lower() in PAGE_TYPES
+
+
+def location(base_url, path):
+    return escape(base_url + urllib.quote(path.encode('utf-8'),
+                                          safe=LOC_SAFE_CHARACTERS))
+
+
+def build_urlset(base_url, entries):
+    """Returns the sitemap listing pages.
+
+    Args:
+      base_url: str The scheme and host of the site, such as
+          https://example.com.
+      entries: dict mapping the path of each page to the W3C datetime it
+          was last modified.
+    """
+    lines = [URLSET_START]
+    for path in sorted(entries):
+        lines.append('<url><loc>%s</loc><lastmod>%s</lastmod></url>\n' % (
+                location(base_url, path), entries[path]))
+    lines.append(URLSET_END)
+    return ''.join(lines)
+
+
+def build_index(base_url, shards):
+    """Returns the sitemap index listing the sitemap of each shard.
+
+    Args:
+      shards: dict mapping the number of each shard which has pages to the
+          latest W3C datetime at which one of them was modified.
+    """
+    lines = [INDEX_START]
+    for shard in sorted(shards):
+        lines.append('<sitemap><loc>%s</loc><lastmod>%s</lastmod></sitemap>\n'
+                     % (location(base_url, shard_path(shard)), shards[shard]))
+    lines.append(INDEX_END)
+    return ''.join(lines)
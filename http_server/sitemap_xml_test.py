@@ -0,0 +1,47 @@
+import unittest
+
+import sitemap_xml
+
+
+class SitemapXmlTest(unittest.TestCase):
+
+    def test_shard_for(self):
+        shards = set([sitemap_xml.shard_for(u'/page-%d.html' % i, 8)
+                      for i in xrange(100)])
+        self.assertEqual(shards, set(range(8)))
+        self.assertEqual(sitemap_xml.shard_for(u'/a.html', 8),
+                         sitemap_xml.shard_for(u'/a.html', 8))
+
+    def test_is_page(self):
+        self.assertTrue(sitemap_xml.is_page('text/html'))
+        self.assertTrue(sitemap_xml.is_page('Text/HTML; charset=utf-8'))
+        self.assertFalse(sitemap_xml.is_page('text/css'))
+        self.assertFalse(sitemap_xml.is_page(None))
+
+    def test_build_urlset(self):
+        self.assertEqual(
+                sitemap_xml.build_urlset('https://example.com', {
+                    u'/b.html': '2026-01-02T03:04:05Z',
+                    u'/a b&c.html': '2026-01-01T00:00:00Z',
+                }),
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                '\n'
+                '<url><loc>https://example.com/a%20b&amp;c.html</loc>'
+                '<lastmod>2026-01-01T00:00:00Z</lastmod></url>\n'
+                '<url><loc>https://example.com/b.html</loc>'
+                '<lastmod>2026-01-02T03:04:05Z</lastmod></url>\n'
+                '</urlset>\n')
+
+    def test_build_index(self):
+        index = sitemap_xml.build_index('https://example.com',
+                                        {3: '2026-01-02T03:04:05Z'})
+        self.assertTrue(index.startswith(sitemap_xml.INDEX_START))
+        self.assertIn('<sitemap><loc>https://example.com/sitemap-3.xml</loc>'
+                      '<lastmod>2026-01-02T03:04:05Z</lastmod></sitemap>\n',
+                      index)
+        self.assertTrue(index.endswith(sitemap_xml.INDEX_END))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""Sitemaps of the pages in the CMS, maintained as resources change.
+
+The pages in each sitemap_xml shard are kept, with the time each was last
+modified, in a SitemapShard entity. Saving and deleting resources updates
+the shards of their paths, each in its own transaction, and queues one task
+per changed shard and WINDOW_SECONDS window. The task builds that shard's
+sitemap and the sitemap index, which are stored as resources at
+/sitemap-N.xml and /sitemap.xml, so crawlers are served them from the cache
+like any other resource and never cause a scan of the resources. They are
+stored as generated files, without revisions or search and directory index
+entries, since they change with every batch of saves.
+"""
+
+import datetime
+import functools
+import re
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import sitemap_xml
+
+
+# A sitemap may list at most 50,000 pages, and each shard's entries must
+# fit in one entity, so this suits sites of up to about half a million
+# pages.
+SHARD_COUNT = 32
+
+# The scheme and host used in the sitemaps, such as https://example.com.
+# Defaults to the appspot.com host of the app.
+BASE_URL = None
+
+INDEX_PATH = '/sitemap.xml'
+SHARD_PATH = re.compile(r'^/sitemap-\d+\.xml$')
+EXPIRES_SECONDS = 3600
+
+WINDOW_SECONDS = 60
+# Handled by ContentSitemapBuilder, which stores the result of build_files.
+TASK_URL = '/content_sitemap_task'
+
+LASTMOD_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+class SitemapShard(ndb.Model):
+    """The pages listed by one shard's sitemap, keyed by the shard number."""
+    # Maps each path to the W3C datetime it was last modified.
+    entries = ndb.JsonProperty(compressed=True)
+
+
+class SitemapIndex(ndb.Model):
+    """The latest modification time of the pages in each non-empty shard."""
+    shards = ndb.JsonProperty()
+
+
+def shard_key(shard):
+    return ndb.Key(SitemapShard, str(shard))
+
+
+def index_key():
+    return ndb.Key(SitemapIndex, 'index')
+
+
+def base_url():
+    return BASE_URL or 'https://' + app_identity.get_default_version_hostname()
+
+
+def is_sitemap_path(path):
+    return path == INDEX_PATH or SHARD_PATH.match(path) is not None
+
+
+@ndb.tasklet
+def _update_shard_async(shard, added, removed):
+    """Applies changes to a shard's entries, storing them if they changed.
+
+    Returns:
+      A future for whether the entries changed.
+    """
+    key = shard_key(shard)
+    sitemap_shard = (yield key.get_async()) or SitemapShard(key=key,
+                                                           entries={})
+    before = dict(sitemap_shard.entries)
+    sitemap_shard.entries.update(added)
+    for path in removed:
+        sitemap_shard.entries.pop(path, None)
+    if sitemap_shard.entries == before:
+        raise ndb.Return(False)
+    yield sitemap_shard.put_async()
+    raise ndb.Return(True)
+
+
+def schedule_build(shard):
+    """Queues one build of a shard's sitemap at the end of this window."""
+    window = int(time.time()) // WINDOW_SECONDS
+    try:
+        taskqueue.add(url=TASK_URL, params={'shard': shard},
+                      name='sitemap-%d-%d' % (shard, window),
+                      eta=datetime.datetime.utcfromtimestamp(
+                              (window + 1) * WINDOW_SECONDS))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+@ndb.tasklet
+def update_async(added=(), removed=()):
+    """Adds pages to, and removes paths from, the sitemaps.
+
+    Args:
+      added: list of (path, modified datetime) tuples for saved pages.
+      removed: list of paths which are no longer pages.
+    """
+    changes = {}
+    for path, modified_time in added:
+        if not is_sitemap_path(path):
+            shard = sitemap_xml.shard_for(path, SHARD_COUNT)
+            changes.setdefault(shard, ({}, []))[0][path] = (
+                    modified_time or datetime.datetime.utcnow()).strftime(
+                            LASTMOD_FORMAT)
+    for path in removed:
+        shard = sitemap_xml.shard_for(path, SHARD_COUNT)
+        changes.setdefault(shard, ({}, []))[1].append(path)
+    shards = changes.keys()
+    changed = yield [ndb.transaction_async(functools.partial(
+                             _update_shard_async, shard, *changes[shard]))
+                     for shard in shards]
+    for shard, was_changed in zip(shards, changed):
+        if was_changed:
+            schedule_build(shard)
+
+
+@ndb.transactional
+def _update_index(shard, lastmod):
+    index = index_key().get() or SitemapIndex(key=index_key(), shards={})
+    if lastmod is None:
+        index.shards.pop(str(shard), None)
+    else:
+        index.shards[str(shard)] = lastmod
+    index.put()
+    return dict((int(number), shard_lastmod)
+                for number, shard_lastmod in index.shards.iteritems())
+
+
+def build_files(shard):
+    """Builds the sitemap of a shard, and the index with its latest time.
+
+    Returns:
+      A dict mapping the paths of the sitemap files to their content.
+    """
+    sitemap_shard = shard_key(shard).get()
+    entries = sitemap_shard.entries if sitemap_shard else {}
+    shards = _update_index(shard, max(entries.values()) if entries else None)
+    return {
+        sitemap_xml.shard_path(shard): sitemap_xml.build_urlset(base_url(),
+                                                                entries),
+        INDEX_PATH: sitemap_xml.build_index(base_url(), shards),
+    }
@@ -0,0 +1,64 @@
+"""Measures how long a new instance takes to import the app.
+
+Each module is imported in a fresh interpreter several times and the median
+time is reported, so the cost of a cold start can be compared before and
+after a change. The App Engine APIs each module loads are listed too, as
+they are the slowest imports. Run with the App Engine SDK directory:
+
+  python startup_benchmark.py /path/to/google_appengine
+"""
+
+import os
+import subprocess
+import sys
+
+
+# The public app, and the admin module it imports lazily. Importing
+# content_admin also imports http_server.
+MODULES = ['http_server', 'content_admin']
+
+RUNS = 9
+
+# Run in the child interpreter, which prints the App Engine APIs imported
+# and then the import time in ms.
+IMPORT_SCRIPT = '''
+import sys, time
+sys.path[0:0] = [%(sdk)r, %(app)r]
+import dev_appserver
+dev_appserver.fix_sys_path()
+before = set(sys.modules)
+start = time.time()
+import %(module)s
+elapsed = (time.time() - start) * 1000
+print ' '.join(sorted([name[len('google.appengine.api.'):]
+                       for name in set(sys.modules) - before
+                       if name.count('.') == 3 and sys.modules[name] and
+                       name.startswith('google.appengine.api.')]))
+print elapsed
+'''
+
+
+def time_import(sdk, module):
+    """Returns the ms taken to import module, and the APIs it imported."""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.check_output([
+            sys.executable, '-c',
+            IMPORT_SCRIPT % {'sdk': sdk, 'app': app_dir, 'module': module}])
+    apis, elapsed = output.rstrip('\n').rsplit('\n', 1)
+    return float(elapsed), apis.split()
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    sdk = sys.argv[1]
+    for module in MODULES:
+        results = [time_import(sdk, module) for i in xrange(RUNS)]
+        times = sorted([elapsed for elapsed, apis in results])
+        print '%-14s median %.1f ms, min %.1f ms, max %.1f ms' % (
+                module, times[len(times) // 2], times[0], times[-1])
+        print '%-14s APIs: %s' % ('', ' '.join(results[0][1]) or 'none')
+
+
+if __name__ == '__main__':
+    main()
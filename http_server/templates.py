@@ -0,0 +1,88 @@
+"""Server side includes, which let resources share headers and footers.
+
+A text resource can include another resource's content with a directive of
+the form <!--#include virtual="/path" -->, as in Apache's mod_include. The
+included resource may itself include others, up to MAX_INCLUDE_DEPTH levels.
+"""
+
+import collections
+import re
+
+
+INCLUDE_PATTERN = re.compile(r'<!--#include\s+virtual="([^"]*)"\s*-->')
+
+MAX_INCLUDE_DEPTH = 4
+
+
+def find_includes(text):
+    """Returns the sorted paths of the resources included by text."""
+    if '<!--#include' not in text:
+        return []
+    return sorted(set(INCLUDE_PATTERN.findall(text)))
+
+
+class Template(object):
+    """Text which has been split at its include directives."""
+
+    def __init__(self, text):
+        # Literal text alternating with the included paths.
+        self.parts = INCLUDE_PATTERN.split(text)
+        self.includes = sorted(set(self.parts[1::2]))
+
+    def render(self, fragments):
+        """Returns the text with each include replaced by its fragment.
+
+        Args:
+          fragments: dict of included path to its text. Includes of other
+              paths are left out.
+        """
+        parts = list(self.parts)
+        for i in xrange(1, len(parts), 2):
+            parts[i] = fragments.get(parts[i], u'')
+        return u''.join(parts)
+
+
+def render(path, templates):
+    """Renders a template and, recursively, the templates it includes.
+
+    Args:
+      path: str The path of the template to render.
+      templates: dict of path to Template for path and the paths it
+          includes, directly or not. Paths which are missing, included too
+          deeply, or included by themselves render as empty text.
+    """
+    def render_path(path, active):
+        template = templates.get(path)
+        if template is None or path in active or \
+                len(active) > MAX_INCLUDE_DEPTH:
+            return u''
+        active = active + (path,)
+        return template.render(dict(
+                [(include, render_path(include, active))
+                 for include in template.includes]))
+    return render_path(path, ())
+
+
+class LruCache(object):
+    """Keeps the most recently used values up to a total size."""
+
+    def __init__(self, max_size, size=len):
+        self.max_size = max_size
+        self.size = size
+        self.total_size = 0
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.entries[key] = value
+        return value
+
+    def set(self, key, value):
+        if key in self.entries:
+            self.total_size -= self.size(self.entries.pop(key))
+        self.entries[key] = value
+        self.total_size += self.size(value)
+        while self.total_size > self.max_size and self.entries:
+            key, removed = self.entries.popitem(last=False)
+            self.total_size -= self.size(removed)
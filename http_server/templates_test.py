@@ -0,0 +1,59 @@
+import unittest
+
+import templates
+
+
+class IncludeTest(unittest.TestCase):
+
+    def test_find_includes(self):
+        self.assertEqual(templates.find_includes(u'<p>plain</p>'), [])
+        self.assertEqual(templates.find_includes(
+                u'<!--#include virtual="/b" -->x'
+                u'<!--#include   virtual="/a"-->'
+                u'<!--#include virtual="/b" -->'), [u'/a', u'/b'])
+
+    def test_render(self):
+        pages = {
+            '/page': templates.Template(
+                    u'<!--#include virtual="/header" --><p>body</p>'
+                    u'<!--#include virtual="/missing" -->'),
+            '/header': templates.Template(
+                    u'<h1><!--#include virtual="/title" --></h1>'),
+            '/title': templates.Template(u'Title'),
+        }
+        self.assertEqual(pages['/page'].includes, ['/header', '/missing'])
+        self.assertEqual(templates.render('/page', pages),
+                         u'<h1>Title</h1><p>body</p>')
+
+    def test_render_cycle(self):
+        pages = {
+            '/a': templates.Template(u'a<!--#include virtual="/b" -->'),
+            '/b': templates.Template(u'b<!--#include virtual="/a" -->'),
+        }
+        self.assertEqual(templates.render('/a', pages), u'ab')
+
+    def test_render_depth(self):
+        pages = {}
+        for i in xrange(10):
+            pages['/%d' % i] = templates.Template(
+                    u'%d<!--#include virtual="/%d" -->' % (i, i + 1))
+        self.assertEqual(templates.render('/0', pages), u'01234')
+
+
+class LruCacheTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = templates.LruCache(10)
+        cache.set('a', 'aaaa')
+        cache.set('b', 'bbbb')
+        self.assertEqual(cache.get('a'), 'aaaa')
+        cache.set('c', 'cccc')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 'aaaa')
+        self.assertEqual(cache.get('c'), 'cccc')
+        cache.set('c', 'cc')
+        self.assertEqual(cache.total_size, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
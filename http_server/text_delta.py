@@ -0,0 +1,105 @@
+"""Compact deltas between two versions of some content.
+
+A delta is a zlib compressed list of operations which either copy a run of
+lines from the old version or insert new bytes. Deltas work on lines split at
+newlines, so they also work, less compactly, on binary content.
+
+apply_patch applies the line edits which the content manager sends instead
+of the full text of a resource when saving a change to it.
+"""
+
+import difflib
+import struct
+import zlib
+
+
+_COPY = 'C'
+_INSERT = 'I'
+_COPY_FORMAT = '>II'
+_INSERT_FORMAT = '>I'
+
+
+def make_delta(old, new):
+    """Returns a compressed delta which turns old into new.
+
+    Args:
+      old: str The bytes of the earlier version.
+      new: str The bytes of the later version.
+    """
+    old_lines = old.splitlines(True)
+    new_lines = new.splitlines(True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines,
+                                      autojunk=False)
+    ops = []
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(_COPY + struct.pack(_COPY_FORMAT, old_start, old_end))
+        elif new_end > new_start:
+            data = ''.join(new_lines[new_start:new_end])
+            ops.append(_INSERT + struct.pack(_INSERT_FORMAT, len(data)) + data)
+    return zlib.compress(''.join(ops))
+
+
+def apply_delta(old, delta):
+    """Returns the content produced by applying a make_delta delta to old."""
+    old_lines = old.splitlines(True)
+    ops = zlib.decompress(delta)
+    parts = []
+    position = 0
+    copy_size = struct.calcsize(_COPY_FORMAT)
+    insert_size = struct.calcsize(_INSERT_FORMAT)
+    while position < len(ops):
+        op = ops[position]
+        position += 1
+        if op == _COPY:
+            start, end = struct.unpack(
+                    _COPY_FORMAT, ops[position:position + copy_size])
+            position += copy_size
+            parts.extend(old_lines[start:end])
+        elif op == _INSERT:
+            length, = struct.unpack(
+                    _INSERT_FORMAT, ops[position:position + insert_size])
+            position += insert_size
+            parts.append(ops[position:position + length])
+            position += length
+        else:
+            raise ValueError('Unknown delta operation %r' % op)
+    return ''.join(parts)
+
+
+def split_lines(text):
+    """Splits text after each newline, keeping the newlines.
+
+    Unlike splitlines, only newline characters end a line, so line numbers
+    agree with those computed by the content manager's JavaScript.
+    """
+    lines = [line + '\n' for line in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def apply_patch(text, edits):
+    """Applies line based edits, such as those sent by the content manager.
+
+    Args:
+      text: The text to patch, either str or unicode.
+      edits: list of [start, end, replacement] which each replace the lines
+          from start up to but not including end of the original text with
+          replacement. Edits are in order and do not overlap.
+
+    Raises:
+      ValueError: An edit overlaps the one before it or is past the end.
+    """
+    lines = split_lines(text)
+    parts = []
+    position = 0
+    for start, end, replacement in edits:
+        if start < position or end < start or end > len(lines):
+            raise ValueError('Invalid edit of lines %d to %d' % (start, end))
+        parts.extend(lines[position:start])
+        parts.append(replacement)
+        position = end
+    parts.extend(lines[position:])
+    return type(text)().join(parts)
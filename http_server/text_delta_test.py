@@ -0,0 +1,71 @@
+import unittest
+import zlib
+
+import text_delta
+
+
+class DeltaTest(unittest.TestCase):
+
+    def assert_round_trip(self, old, new):
+        delta = text_delta.make_delta(old, new)
+        self.assertEqual(text_delta.apply_delta(old, delta), new)
+        return delta
+
+    def test_edits(self):
+        old = ''.join(['line %d\n' % i for i in xrange(1000)])
+        self.assert_round_trip(old, old)
+        self.assert_round_trip(old, old.replace('line 500\n', 'changed\n'))
+        self.assert_round_trip(old, 'first\n' + old + 'last')
+        self.assert_round_trip(old, old[:4000])
+        self.assert_round_trip('', old)
+        self.assert_round_trip(old, '')
+
+    def test_small_edit_has_small_delta(self):
+        old = ''.join(['line %d of a long page\n' % i for i in xrange(20000)])
+        delta = self.assert_round_trip(
+                old, old.replace('line 7 of', 'line seven of'))
+        self.assertTrue(len(delta) < 100)
+
+    def test_binary_content(self):
+        old = ''.join([chr(i % 256) for i in xrange(5000)])
+        self.assert_round_trip(old, old[:100] + '\x00\xff' + old[100:])
+
+    def test_unknown_operation(self):
+        self.assertRaises(ValueError, text_delta.apply_delta, 'old',
+                          zlib.compress('X'))
+
+
+class PatchTest(unittest.TestCase):
+
+    def test_split_lines(self):
+        self.assertEqual(text_delta.split_lines(''), [])
+        self.assertEqual(text_delta.split_lines('a\nb'), ['a\n', 'b'])
+        self.assertEqual(text_delta.split_lines('a\n\nb\n'),
+                         ['a\n', '\n', 'b\n'])
+        self.assertEqual(text_delta.split_lines(u'a\rb\n'), [u'a\rb\n'])
+
+    def test_apply_patch(self):
+        text = u'one\ntwo\nthree\nfour\n'
+        self.assertEqual(text_delta.apply_patch(text, []), text)
+        self.assertEqual(
+                text_delta.apply_patch(text, [[1, 2, u'2\n']]),
+                u'one\n2\nthree\nfour\n')
+        self.assertEqual(
+                text_delta.apply_patch(text, [[0, 0, u'zero\n'],
+                                              [2, 4, u'']]),
+                u'zero\none\ntwo\n')
+        self.assertEqual(text_delta.apply_patch(text, [[4, 4, u'five']]),
+                         text + u'five')
+
+    def test_invalid_patch(self):
+        text = 'one\ntwo\n'
+        self.assertRaises(ValueError, text_delta.apply_patch, text,
+                          [[0, 3, '']])
+        self.assertRaises(ValueError, text_delta.apply_patch, text,
+                          [[1, 2, ''], [0, 1, '']])
+        self.assertRaises(ValueError, text_delta.apply_patch, text,
+                          [[2, 1, '']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+"""Coalesces rapid repeated saves of the same resource into one write.
+
+A save of a path which has not been written in the last WINDOW_SECONDS is
+stored straight away. Later saves within the window are held, so an editor
+or script saving many times a second costs about one query and write per
+window instead of one per save. The window is kept in memcache, so it is
+shared by every instance.
+
+Each held save is carried by its own task, which stores it at the end of the
+window unless a later save of the path has been held since. The task checks
+this against the latest held save, which is kept in memcache along with the
+resource_cache entry, so pages and the content manager read it from any
+instance. Held saves are only stored over an older stored resource, so they
+never replace a later save, and a path deleted while a save was held stays
+deleted. No instance keeps held saves in memory, and losing the memcache
+copy only costs a write which would have been skipped.
+"""
+
+import pickle
+import zlib
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import resource_cache
+
+
+WINDOW_SECONDS = 2
+
+# Larger content is always written straight away, as held resources must fit
+# in a memcache value and, compressed, in a push task.
+MAX_HELD_BYTES = 900 * 1024
+MAX_PAYLOAD_BYTES = taskqueue.MAX_PUSH_TASK_SIZE_BYTES - 4 * 1024
+
+WINDOW_PREFIX = 'write-window:'
+HELD_PREFIX = 'held-write:'
+HELD_TTL_SECONDS = 60 * 60
+
+# Handled by ContentWriteFlusher, which calls store_held_async.
+FLUSH_URL = '/content_write_flush'
+FLUSH_QUEUE = 'write-behind'
+
+
+def replaces(stored, resource):
+    """Whether a held resource replaces the stored one, which must exist.
+
+    Used as the condition passed to store_multi_async.
+    """
+    return (stored is not None and
+            (stored.modified_time is None or
+             stored.modified_time < resource.modified_time))
+
+
+def _entry(resource):
+    return resource, resource.content.encode('utf-8')
+
+
+@ndb.tasklet
+def _store_now_async(resource, data, store_multi_async):
+    context = ndb.get_context()
+    try:
+        yield store_multi_async([(resource, data)])
+    except Exception:
+        # The next save writes straight away rather than being held against
+        # a resource which was never stored.
+        context.memcache_delete(WINDOW_PREFIX + resource.path)
+        raise
+    yield context.memcache_delete(HELD_PREFIX + resource.path)
+
+
+@ndb.tasklet
+def save_async(resource, data, store_multi_async):
+    """Stores a resource now, or holds it until its path's window ends.
+
+    Args:
+      resource: The unsaved Resource, as returned by resource_from_json.
+      data: str The content of the resource.
+      store_multi_async: tasklet which takes a list of (Resource, data)
+          tuples and a condition, as content_admin.store_resources_async
+          does, and stores them.
+    """
+    context = ndb.get_context()
+    if resource.is_binary or len(data) > MAX_HELD_BYTES:
+        yield _store_now_async(resource, data, store_multi_async)
+        return
+    in_window = not (yield context.memcache_add(WINDOW_PREFIX + resource.path,
+                                                1, time=WINDOW_SECONDS))
+    payload = None
+    if in_window:
+        # Held resources keep their content inline, where it is read from
+        # for resources with no chunks.
+        resource.content = data.decode('utf-8')
+        resource.size = len(data)
+        resource.chunk_count = 0
+        payload = zlib.compress(pickle.dumps(resource, 2))
+    if payload is None or len(payload) > MAX_PAYLOAD_BYTES:
+        yield _store_now_async(resource, data, store_multi_async)
+        return
+    yield (context.memcache_set(HELD_PREFIX + resource.path, resource,
+                                time=HELD_TTL_SECONDS),
+           resource_cache.set_multi_async([resource]),
+           taskqueue.Queue(FLUSH_QUEUE).add_async(taskqueue.Task(
+                   url=FLUSH_URL, payload=payload,
+                   countdown=WINDOW_SECONDS)))
+
+
+@ndb.tasklet
+def store_held_async(payload, store_multi_async):
+    """Stores the held save in a task payload unless it was superseded."""
+    resource = pickle.loads(zlib.decompress(payload))
+    latest = yield ndb.get_context().memcache_get(HELD_PREFIX + resource.path)
+    if latest is not None and latest.modified_time > resource.modified_time:
+        # The task of the later save stores that instead.
+        return
+    yield store_multi_async([_entry(resource)], condition=replaces)
+
+
+@ndb.tasklet
+def find_async(path, find_multi_async):
+    """Returns the latest saved Resource for path, held or stored, or None.
+
+    Args:
+      find_multi_async: tasklet which takes a list of paths and returns a
+          dict of path to stored Resource, such as find_resources_async.
+    """
+    held, stored = yield (ndb.get_context().memcache_get(HELD_PREFIX + path),
+                          find_multi_async([path]))
+    stored = stored.get(path)
+    if held is not None and replaces(stored, held):
+        raise ndb.Return(held)
+    raise ndb.Return(stored)
+
+
+@ndb.tasklet
+def discard_async(paths):
+    """Forgets held saves of paths which are being stored or deleted.
+
+    Their tasks still run, but only store them over older resources.
+    """
+    context = ndb.get_context()
+    yield ([context.memcache_delete(HELD_PREFIX + path) for path in paths] +
+           [context.memcache_delete(WINDOW_PREFIX + path) for path in paths])
+
+
+@ndb.tasklet
+def flush_async(paths, store_multi_async):
+    """Stores the latest held saves of paths now, if they are still newer."""
+    context = ndb.get_context()
+    held = yield [context.memcache_get(HELD_PREFIX + path) for path in paths]
+    entries = [_entry(resource) for resource in held if resource is not None]
+    if entries:
+        yield store_multi_async(entries, condition=replaces)
@@ -0,0 +1,146 @@
+"""Profiles a sample of the requests to a WSGI application.
+
+ProfilerMiddleware profiles one request in every SAMPLE_EVERY, and every
+request from an admin which has the TRIGGER_HEADER header. Requests which
+are not profiled only cost a counter and a header lookup.
+
+Profiled requests record, with sys.setprofile, the time spent in each
+function with the calls leading to it. The times are added up in memory by
+route as collapsed stacks, the lines of the form
+
+  route;module.caller:line;module.function:line microseconds
+
+taken by flamegraph.pl and speedscope. Each instance keeps its own profiles,
+so write them out from each instance which served the slow requests.
+"""
+
+import sys
+import threading
+import time
+
+
+# Profile one request in every this many, or none when 0.
+SAMPLE_EVERY = 1000
+
+# Requests from admins with this header set are always profiled.
+TRIGGER_HEADER = 'X-Profile'
+TRIGGER_ENVIRON_KEY = 'HTTP_' + TRIGGER_HEADER.upper().replace('-', '_')
+
+# The number of distinct stacks kept for each route. Time in new stacks
+# beyond this is recorded against the route alone.
+MAX_STACKS_PER_ROUTE = 5000
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return '%s.%s:%d' % (frame.f_globals.get('__name__', '?'), code.co_name,
+                         code.co_firstlineno)
+
+
+def builtin_name(function):
+    module = getattr(function, '__module__', None) or 'builtin'
+    return '%s.%s' % (module, getattr(function, '__name__', '?'))
+
+
+class StackRecorder(object):
+    """The profile function for one request, adding up time by stack."""
+
+    def __init__(self, route, clock=time.time):
+        self.clock = clock
+        self.stack = [route]
+        self.times = {}
+        self.last = clock()
+
+    def __call__(self, frame, event, arg):
+        now = self.clock()
+        stack = tuple(self.stack)
+        self.times[stack] = self.times.get(stack, 0) + now - self.last
+        if event == 'call':
+            self.stack.append(frame_name(frame))
+        elif event == 'c_call':
+            self.stack.append(builtin_name(arg))
+        # Calls made before profiling started return without being
+        # recorded, so the route is never removed.
+        elif len(self.stack) > 1:
+            self.stack.pop()
+        # Time spent in here is left out of the profile.
+        self.last = self.clock()
+
+
+class Profiles(object):
+    """Collapsed stacks, in seconds, for the profiled requests."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stacks = {}
+        self.stack_counts = {}
+
+    def add(self, route, times):
+        """Adds the times by stack recorded for one request to a route."""
+        with self.lock:
+            for stack, seconds in times.iteritems():
+                if stack not in self.stacks:
+                    if (self.stack_counts.get(route, 0) >=
+                            MAX_STACKS_PER_ROUTE):
+                        stack = (route,)
+                    if stack not in self.stacks:
+                        self.stack_counts[route] = (
+                                self.stack_counts.get(route, 0) + 1)
+                self.stacks[stack] = self.stacks.get(stack, 0) + seconds
+
+    def collapsed(self, route=None):
+        """Returns the collapsed stacks, optionally for one route only."""
+        with self.lock:
+            lines = ['%s %d' % (';'.join(stack), round(seconds * 1e6))
+                     for stack, seconds in self.stacks.iteritems()
+                     if route is None or stack[0] == route]
+        lines.sort()
+        return ''.join([line + '\n' for line in lines])
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.stack_counts.clear()
+
+
+profiles = Profiles()
+
+
+class ProfilerMiddleware(object):
+    """Profiles a sample of the requests to a WSGI application.
+
+    Args:
+      application: The WSGI application to profile.
+      route_name: function which takes the WSGI environ and returns the name
+          of the route the request is for, such as its URL pattern.
+    """
+
+    def __init__(self, application, route_name, sample_every=None):
+        self.application = application
+        self.route_name = route_name
+        self.sample_every = sample_every
+        if sample_every is None:
+            self.sample_every = SAMPLE_EVERY
+        self.count = 0
+
+    def should_profile(self, environ):
+        # Concurrent requests may miss an increment, which only shifts the
+        # sample slightly.
+        self.count += 1
+        if self.sample_every and self.count % self.sample_every == 0:
+            return True
+        # App Engine sets USER_IS_ADMIN for signed in admins.
+        return (TRIGGER_ENVIRON_KEY in environ and
+                environ.get('USER_IS_ADMIN') == '1')
+
+    def __call__(self, environ, start_response):
+        if not self.should_profile(environ):
+            return self.application(environ, start_response)
+        route = self.route_name(environ)
+        recorder = StackRecorder(route)
+        sys.setprofile(recorder)
+        try:
+            return self.application(environ, start_response)
+        finally:
+            sys.setprofile(None)
+            profiles.add(route, recorder.times)
@@ -0,0 +1,65 @@
+import time
+import unittest
+
+import wsgi_profiler
+
+
+def render_page():
+    time.sleep(0.002)
+    return ['page']
+
+
+def application(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return render_page()
+
+
+class WsgiProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        wsgi_profiler.profiles.reset()
+
+    def call(self, middleware, environ):
+        environ.setdefault('PATH_INFO', '/index.html')
+        return middleware(environ, lambda status, headers: None)
+
+    def test_sampled_requests_are_profiled(self):
+        middleware = wsgi_profiler.ProfilerMiddleware(
+                application, lambda environ: '/.*', sample_every=2)
+        self.assertEqual(self.call(middleware, {}), ['page'])
+        self.assertEqual(wsgi_profiler.profiles.collapsed(), '')
+        self.assertEqual(self.call(middleware, {}), ['page'])
+
+        lines = wsgi_profiler.profiles.collapsed().splitlines()
+        stacks = dict(line.rsplit(' ', 1) for line in lines)
+        sleeping = [stack for stack in stacks
+                    if stack.endswith(';time.sleep')]
+        self.assertEqual(len(sleeping), 1)
+        frames = sleeping[0].split(';')
+        self.assertEqual(frames[0], '/.*')
+        self.assertTrue(frames[-2].startswith(__name__ + '.render_page:'))
+        self.assertTrue(int(stacks[sleeping[0]]) >= 1000)
+        self.assertEqual(wsgi_profiler.profiles.collapsed('/other'), '')
+
+    def test_trigger_header_needs_admin(self):
+        middleware = wsgi_profiler.ProfilerMiddleware(
+                application, lambda environ: '/.*', sample_every=0)
+        self.call(middleware, {'HTTP_X_PROFILE': '1'})
+        self.assertEqual(wsgi_profiler.profiles.collapsed(), '')
+        self.call(middleware, {'HTTP_X_PROFILE': '1', 'USER_IS_ADMIN': '1'})
+        self.assertNotEqual(wsgi_profiler.profiles.collapsed(), '')
+
+    def test_stack_limit(self):
+        times = dict(((('/a', 'f%d' % i), 0.001)
+                      for i in xrange(wsgi_profiler.MAX_STACKS_PER_ROUTE)))
+        wsgi_profiler.profiles.add('/a', times)
+        wsgi_profiler.profiles.add('/a', {('/a', 'new'): 0.5,
+                                          ('/a', 'f0'): 0.001})
+        collapsed = wsgi_profiler.profiles.collapsed('/a')
+        self.assertTrue('/a;f0 2000\n' in collapsed)
+        self.assertTrue('/a 500000\n' in collapsed)
+        self.assertFalse('new' in collapsed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,12 +13,20 @@
 # limitations under the License.
 
 
+import cgi
+import hashlib
 import os
+import pickle
+import random
+import re
+import sys
+import time
 import urllib
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp.util import run_wsgi_app
 from google.appengine.ext import db
 from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 
 
 __author__ = 'Jeff Scudder (me@jeffscudder.com)'
@@ -29,6 +37,499 @@ class Page(db.Model):
   mime_type = db.TextProperty()
   last_updated = db.TextProperty()
   cache_settings = db.TextProperty()
+  # Content larger than STORAGE_CHUNK_SIZE is stored in this many PageChunk
+  # entities instead of the content property.
+  chunk_count = db.IntegerProperty(default=0)
+  # Names the chunks written by each save, so that a reader which loaded the
+  # page before a save never combines chunks from different versions.
+  chunk_version = db.StringProperty(indexed=False)
+
+
+class PageChunk(db.Model):
+  """Part of the UTF-8 encoded content of a Page, stored as its child.
+
+  The key name is the chunk_version of the page followed by the position of
+  the chunk, as made by chunk_key_name.
+  """
+  data = db.BlobProperty()
+
+
+# Entities are limited to 1MB, so content above this size is split across
+# several PageChunk entities.
+STORAGE_CHUNK_SIZE = 512 * 1024
+
+# The chunks of replaced versions of a page are deleted by a task this long
+# after the save, once requests which read the page before it have finished.
+CHUNK_CLEANUP_DELAY_SECONDS = 60
+
+# Memcache rejects values larger than 1MB, so the content of bigger pages is
+# split across several cache entries of at most this many bytes.
+CACHE_CHUNK_SIZE = 900 * 1024
+
+# Cached pages older than CACHE_SOFT_TTL_SECONDS are still served, but the
+# first request to find one stale queues a task to reload it from the
+# datastore. Memcache drops entries after CACHE_HARD_TTL_SECONDS.
+CACHE_SOFT_TTL_SECONDS = 300
+CACHE_HARD_TTL_SECONDS = 24 * 60 * 60
+REFRESH_LOCK_SECONDS = 60
+
+# Lets downstream caches keep serving an expired page for this long while
+# they revalidate it, or for longer when the server returns an error.
+STALE_WHILE_REVALIDATE_SECONDS = 60
+STALE_IF_ERROR_SECONDS = 24 * 60 * 60
+
+# Pages loaded into the cache by the warmup job when none are requested.
+WARMUP_PATHS = ['/']
+
+# Number of pages loaded by each call to prefetch when warming the cache.
+WARMUP_BATCH_SIZE = 100
+
+# Number of the most requested pages loaded by each new instance.
+INSTANCE_WARMUP_PATHS = 20
+
+# Request counters are buffered in memory on each instance and merged every
+# STATS_FLUSH_SECONDS into one of STATS_SHARDS entities chosen at random, so
+# instances rarely contend on the same entity. Only the busiest
+# MAX_TRACKED_PATHS paths are kept.
+STATS_SHARDS = 20
+STATS_FLUSH_SECONDS = 60
+MAX_TRACKED_PATHS = 5000
+
+# Positions of the counters kept for each path.
+HITS, CACHE_MISSES, DATASTORE_MS, BYTES_SERVED = range(4)
+
+_stats = {}
+_stats_flushed = time.time()
+
+
+class StatsShard(db.Model):
+  """Pickled dict of path to [hits, cache_misses, datastore_ms, bytes]."""
+  counters = db.BlobProperty()
+
+
+def record_stats(path, hits=0, cache_misses=0, datastore_ms=0,
+                 bytes_served=0):
+  """Adds to the in-memory request counters for a path.
+
+  The counters are merged into the datastore once STATS_FLUSH_SECONDS have
+  passed since the last flush on this instance.
+  """
+  counters = _stats.get(path)
+  if counters is None:
+    if len(_stats) >= MAX_TRACKED_PATHS:
+      return
+    counters = _stats[path] = [0, 0, 0, 0]
+  counters[HITS] += hits
+  counters[CACHE_MISSES] += cache_misses
+  counters[DATASTORE_MS] += datastore_ms
+  counters[BYTES_SERVED] += bytes_served
+  if time.time() - _stats_flushed > STATS_FLUSH_SECONDS:
+    flush_stats()
+
+
+def merge_stats(target, source):
+  for path, counters in source.iteritems():
+    totals = target.setdefault(path, [0, 0, 0, 0])
+    for i in xrange(len(counters)):
+      totals[i] += counters[i]
+
+
+def flush_stats():
+  """Merges this instance's counters into a randomly chosen shard."""
+  global _stats, _stats_flushed
+  pending = _stats
+  _stats = {}
+  _stats_flushed = time.time()
+  if not pending:
+    return
+
+  def merge_into_shard(key_name):
+    shard = StatsShard.get_by_key_name(key_name)
+    counters = {}
+    if shard:
+      counters = pickle.loads(shard.counters)
+    merge_stats(counters, pending)
+    if len(counters) > MAX_TRACKED_PATHS:
+      busiest = sorted(counters.iteritems(), key=lambda item: item[1][HITS],
+                       reverse=True)
+      counters = dict(busiest[:MAX_TRACKED_PATHS])
+    StatsShard(key_name=key_name, counters=pickle.dumps(counters, 2)).put()
+
+  db.run_in_transaction(merge_into_shard,
+                        'shard%d' % random.randint(0, STATS_SHARDS - 1))
+
+
+def load_stats():
+  """Returns a dict of path to the request counters summed over all shards."""
+  totals = {}
+  shards = StatsShard.get_by_key_name(
+      ['shard%d' % i for i in xrange(STATS_SHARDS)])
+  for shard in shards:
+    if shard:
+      merge_stats(totals, pickle.loads(shard.counters))
+  return totals
+
+
+def hottest_paths(count):
+  """Returns up to count paths, most requested first."""
+  totals = load_stats()
+  return sorted(totals, key=lambda path: totals[path][HITS],
+                reverse=True)[:count]
+
+
+class DirectoryIndex(db.Model):
+  """Pickled entries of the directory whose path is the key name.
+
+  Pages directly in the directory map their name to 1, with '' for the
+  directory's own page. Subdirectories map their name, ending in /, to the
+  number of pages anywhere below them.
+  """
+  entries = db.BlobProperty()
+
+
+def split_path(path):
+  """Returns the directory holding a path and the path's name within it."""
+  end = path.rfind('/') + 1
+  return path[:end], path[end:]
+
+
+def parent_directory(directory):
+  """Returns the parent of a directory and its name, or None for /.
+
+  Anything not starting with / is not a directory, and has no parent either.
+  """
+  if directory == '/' or not directory.startswith('/'):
+    return None, None
+  end = directory.rfind('/', 0, len(directory) - 1) + 1
+  return directory[:end], directory[end:]
+
+
+def load_directory(directory):
+  """Returns the entries of a directory, or an empty dict."""
+  index = DirectoryIndex.get_by_key_name(directory)
+  if index:
+    return pickle.loads(index.entries)
+  return {}
+
+
+def update_directory(directory, update):
+  """Changes a directory's entries in a transaction.
+
+  Args:
+    directory: str The path of the directory, ending in /.
+    update: function which changes the entries dict passed to it and
+        returns the change in the number of pages in the directory.
+  """
+  def update_in_transaction():
+    entries = load_directory(directory)
+    before = dict(entries)
+    count = update(entries)
+    if entries != before:
+      if entries:
+        DirectoryIndex(key_name=directory,
+                       entries=pickle.dumps(entries, 2)).put()
+      else:
+        db.delete(db.Key.from_path('DirectoryIndex', directory))
+    return count
+  return db.run_in_transaction(update_in_transaction)
+
+
+def update_index(added=(), removed=()):
+  """Adds and removes paths from the directory index.
+
+  Only paths which were not already in, or were still in, their directory
+  change the counts of its ancestors, so saving a page which is already
+  indexed costs one transactional get.
+  """
+  names = {}
+  for path in added:
+    directory, name = split_path(path)
+    names.setdefault(directory, ([], []))[0].append(name)
+  for path in removed:
+    directory, name = split_path(path)
+    names.setdefault(directory, ([], []))[1].append(name)
+
+  changes = {}
+  for directory, (added_names, removed_names) in names.iteritems():
+    def add_and_remove(entries):
+      count = 0
+      for name in added_names:
+        if name not in entries:
+          entries[name] = 1
+          count += 1
+      for name in removed_names:
+        if entries.pop(name, None) is not None:
+          count -= 1
+      return count
+    count = update_directory(directory, add_and_remove)
+    if count:
+      parent, name = parent_directory(directory)
+      while parent is not None:
+        parent_changes = changes.setdefault(parent, {})
+        parent_changes[name] = parent_changes.get(name, 0) + count
+        parent, name = parent_directory(parent)
+
+  for directory, directory_changes in changes.iteritems():
+    def apply_changes(entries):
+      for name, count in directory_changes.iteritems():
+        count += entries.get(name, 0)
+        if count > 0:
+          entries[name] = count
+        else:
+          entries.pop(name, None)
+    update_directory(directory, apply_changes)
+
+
+def rebuild_index():
+  """Replaces the directory index with one built from every page's path.
+
+  Returns:
+    The number of pages indexed.
+  """
+  index_keys = DirectoryIndex.all(keys_only=True).fetch(1000)
+  while index_keys:
+    db.delete(index_keys)
+    index_keys = DirectoryIndex.all(keys_only=True).fetch(1000)
+  count = 0
+  query = Page.all(keys_only=True)
+  page_keys = query.fetch(1000)
+  while page_keys:
+    update_index(added=[key.name() for key in page_keys])
+    count += len(page_keys)
+    query.with_cursor(query.cursor())
+    page_keys = query.fetch(1000)
+  return count
+
+
+# Pages are found by the words in their paths and content. Each page has a
+# PageWords entity listing its distinct words, written with the page. The
+# datastore indexes every value of the list, so a query with an equality
+# filter for each word searched for finds the pages containing all of them,
+# without custom indexes or the Search API, which the python runtime lacks.
+# Each value has two index entries and an entity may have 20000, so only
+# the first MAX_INDEXED_WORDS distinct words of a page are indexed.
+MAX_INDEXED_WORDS = 5000
+MAX_WORD_LENGTH = 100
+MAX_QUERY_WORDS = 10
+SEARCH_RESULTS = 50
+MARKUP_TYPES = ('text/html', 'application/xhtml+xml', 'text/xml',
+                'application/xml', 'image/svg+xml')
+MARKUP = re.compile(r'<[^>]*>')
+# Letters and digits, so paths are split at / . _ and - as well as spaces.
+WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+class PageWords(db.Model):
+  """The distinct lower case words of the page whose path is the key name."""
+  words = db.StringListProperty()
+
+
+def find_words(text):
+  """Returns the distinct lower case words of text, in order of appearance."""
+  words = []
+  seen = set()
+  for word in WORD.findall(text.lower()):
+    if word not in seen and len(word) <= MAX_WORD_LENGTH:
+      seen.add(word)
+      words.append(word)
+  return words
+
+
+def page_words(resource_path, page_parts):
+  """Builds the PageWords entity for a page.
+
+  Markup is removed from HTML and XML pages before they are split into
+  words, and the words of the path are indexed along with the content.
+  """
+  content = page_parts[0] or u''
+  mime_type = (page_parts[1] or 'text/html').split(';')[0].strip().lower()
+  if mime_type in MARKUP_TYPES:
+    content = MARKUP.sub(' ', content)
+  words = find_words(resource_path + u' ' + content)
+  return PageWords(key_name=resource_path, words=words[:MAX_INDEXED_WORDS])
+
+
+def search_pages(query_string):
+  """Returns the paths of up to SEARCH_RESULTS pages with every word."""
+  words = find_words(query_string)[:MAX_QUERY_WORDS]
+  if not words:
+    return []
+  query = PageWords.all(keys_only=True)
+  for word in words:
+    query.filter('words =', word)
+  return [key.name() for key in query.fetch(SEARCH_RESULTS)]
+
+
+def cache_entries(resource_path, page_parts):
+  """Builds the memcache entries which hold a page.
+
+  The value stored under the page's path is a tuple of the time after which
+  the entry is stale and the page entry. Pages which fit in a single memcache
+  value have the page tuple as their entry. For larger pages, the entry has
+  None in place of the content followed by a list of the keys of the chunks
+  which hold the UTF-8 encoded content. The chunk keys are derived from a
+  hash of the content so a reader can never combine chunks from different
+  versions of a page.
+
+  Args:
+    resource_path: str The URL under this domain where the content lives.
+    page_parts: tuple of strings which contains
+        (content, mime_type, last_updated, cache_settings)
+
+  Returns:
+    A dict of memcache keys and values suitable for memcache.set_multi.
+  """
+  soft_expiry = time.time() + CACHE_SOFT_TTL_SECONDS
+  content = (page_parts[0] or u'').encode('utf-8')
+  if len(content) <= CACHE_CHUNK_SIZE:
+    return {resource_path: (soft_expiry, page_parts)}
+  version = hashlib.sha1(content).hexdigest()
+  entries = {}
+  chunk_keys = []
+  for i in xrange(0, len(content), CACHE_CHUNK_SIZE):
+    chunk_key = 'chunk:%s:%d' % (version, i)
+    entries[chunk_key] = content[i:i + CACHE_CHUNK_SIZE]
+    chunk_keys.append(chunk_key)
+  entries[resource_path] = (soft_expiry,
+                            (None,) + tuple(page_parts[1:4]) + (chunk_keys,))
+  return entries
+
+
+def schedule_refresh(paths):
+  """Queues one background reload of the stale cache entries for paths.
+
+  Adding the lock only succeeds for the first request to find a path stale,
+  so concurrent requests do not queue duplicate refreshes.
+  """
+  not_locked = memcache.add_multi(dict([(path, 1) for path in paths]),
+                                  time=REFRESH_LOCK_SECONDS,
+                                  key_prefix='refresh:')
+  locked = [path for path in paths if path not in not_locked]
+  if locked:
+    taskqueue.add(url='/content_refresh', params={'path': locked})
+
+
+def with_stale_directives(cache_settings):
+  """Adds stale-while-revalidate and stale-if-error to a Cache-Control value.
+
+  Values which forbid serving stale copies, or which already set the
+  directives, are returned unchanged.
+  """
+  directives = [directive.strip().split('=')[0].lower()
+                for directive in cache_settings.split(',')]
+  for directive in ('no-store', 'no-cache', 'must-revalidate',
+                    'proxy-revalidate'):
+    if directive in directives:
+      return cache_settings
+  if 'stale-while-revalidate' not in directives:
+    cache_settings += ', stale-while-revalidate=%d' % (
+        STALE_WHILE_REVALIDATE_SECONDS)
+  if 'stale-if-error' not in directives:
+    cache_settings += ', stale-if-error=%d' % STALE_IF_ERROR_SECONDS
+  return cache_settings
+
+
+def prefetch(paths, record_misses=False):
+  """Loads several pages using batched cache and datastore calls.
+
+  All cached page entries are fetched with one memcache.get_multi and the
+  chunks of any large pages with one more. Pages which are not cached are
+  read with a single datastore get and added to the cache.
+
+  Args:
+    paths: list of str The URLs under this domain to load.
+    record_misses: bool Set to True to count the cache misses and the time
+        spent in the datastore in the request stats for each path.
+
+  Returns:
+    A dict mapping each path which has an entry in the datastore to a tuple
+    of strings containing (content, mime_type, last_updated, cache_settings).
+  """
+  cached = {}
+  stale = []
+  now = time.time()
+  for path, value in memcache.get_multi(paths).iteritems():
+    # Values are (soft expiry time, entry). Anything else was cached by an
+    # earlier version and is treated as a miss.
+    if len(value) != 2:
+      continue
+    cached[path] = value[1]
+    if value[0] < now:
+      stale.append(path)
+
+  pages = {}
+  chunk_keys = []
+  for path, entry in cached.iteritems():
+    if len(entry) > 4:
+      chunk_keys.extend(entry[4])
+    else:
+      pages[path] = entry
+
+  if chunk_keys:
+    chunks = memcache.get_multi(chunk_keys)
+    for path, entry in cached.iteritems():
+      # A page is only usable if none of its chunks have been evicted.
+      if len(entry) > 4 and len([key for key in entry[4]
+                                   if key in chunks]) == len(entry[4]):
+        content = ''.join([chunks[key] for key in entry[4]])
+        pages[path] = (content.decode('utf-8'),) + tuple(entry[1:4])
+
+  stale = [path for path in stale if path in pages]
+  if stale:
+    schedule_refresh(stale)
+  missing = [path for path in paths if path not in pages]
+  if missing:
+    pages.update(load_and_cache(missing, record_misses))
+  return pages
+
+
+def load_and_cache(paths, record_misses=False):
+  """Reads pages from the datastore and replaces their cache entries.
+
+  Returns:
+    A dict mapping each path which has an entry in the datastore to its page
+    tuple.
+  """
+  start = time.time()
+  loaded = Page.get_by_key_name(paths)
+  if record_misses:
+    elapsed_ms = (time.time() - start) * 1000.0 / len(paths)
+    for path in paths:
+      record_stats(path, cache_misses=1, datastore_ms=elapsed_ms)
+  chunks = load_chunks([page for page in loaded if page])
+  pages = {}
+  entries = {}
+  for path, page in zip(paths, loaded):
+    if page:
+      content = page.content
+      if page.chunk_count:
+        content = ''.join(chunks[path]).decode('utf-8')
+      pages[path] = (content, page.mime_type, page.last_updated,
+                     page.cache_settings)
+      entries.update(cache_entries(path, pages[path]))
+  if entries:
+    memcache.set_multi(entries, time=CACHE_HARD_TTL_SECONDS)
+  return pages
+
+
+def load_chunks(pages):
+  """Reads the chunks of every chunked page with a single datastore get.
+
+  Returns:
+    A dict mapping the key name of each chunked page to a list of the data
+    in its chunks.
+  """
+  chunk_keys = []
+  for page in pages:
+    for i in xrange(page.chunk_count or 0):
+      chunk_keys.append(db.Key.from_path(
+          'Page', page.key().name(),
+          'PageChunk', chunk_key_name(page.chunk_version, i)))
+  chunks = {}
+  if chunk_keys:
+    for key, chunk in zip(chunk_keys, db.get(chunk_keys)):
+      chunks.setdefault(key.parent().name(), []).append(chunk.data)
+  return chunks
 
 
 def load_with_cache(request_path):
@@ -42,13 +543,53 @@ def load_with_cache(request_path):
     (content, mime_type, last_updated, cache_settings) or, None if the desired
     URL does not have an entry in the datastore.
   """
-  page = memcache.get(request_path)
-  if not page:
-    page = Page.get_by_key_name(request_path)
-    if page:
-      return (page.content, page.mime_type, page.last_updated, 
-              page.cache_settings)
-  return page
+  return prefetch([request_path]).get(request_path)
+
+
+def chunk_key_name(chunk_version, i):
+  """Returns the key name of the chunk of a page at position i."""
+  # Pages saved before chunk versions were added name chunks by position.
+  if chunk_version is None:
+    return str(i)
+  return '%s-%d' % (chunk_version, i)
+
+
+def chunk_written_time(key_name):
+  """Returns the time in microseconds that a chunk was written, or 0."""
+  if '-' not in key_name:
+    return 0
+  return int(key_name.split('-')[0])
+
+
+def page_from_parts(resource_path, page_parts):
+  """Builds the entities for a URL without reading the stored version.
+
+  Every property of a Page is replaced when it is saved, so the entity can be
+  constructed from its key name and written with a single put. Large content
+  is moved into PageChunk children of the page, named by a new chunk_version
+  made from the time and the hash of the content, so the chunks of the
+  stored version are left alone. They are deleted later by
+  delete_old_chunks.
+
+  Returns:
+    A tuple of the Page and a list of the PageChunks which hold its content.
+  """
+  page = Page(key_name=resource_path, content=page_parts[0],
+              mime_type=page_parts[1], last_updated=page_parts[2],
+              cache_settings=page_parts[3], chunk_count=0)
+  data = (page_parts[0] or u'').encode('utf-8')
+  if len(data) <= STORAGE_CHUNK_SIZE:
+    return page, []
+  page.chunk_version = '%d-%s' % (int(time.time() * 1000000),
+                                  hashlib.sha1(data).hexdigest())
+  chunks = []
+  for i in xrange(0, len(data), STORAGE_CHUNK_SIZE):
+    chunks.append(PageChunk(
+        parent=page, key_name=chunk_key_name(page.chunk_version, len(chunks)),
+        data=db.Blob(data[i:i + STORAGE_CHUNK_SIZE])))
+  page.content = None
+  page.chunk_count = len(chunks)
+  return page, chunks
 
 
 def store_and_cache(resource_path, page_parts):
@@ -59,30 +600,130 @@ def store_and_cache(resource_path, page_parts):
     page_parts: tuple of strings which contains 
         (content, mime_type, last_updated, cache_settings)
   """
-  memcache.set(resource_path, page_parts)
-  page = Page.get_by_key_name(resource_path)
-  if not page:
-    page = Page.get_or_insert(resource_path)
-  page.content = page_parts[0]
-  page.mime_type = page_parts[1]
-  page.last_updated = page_parts[2]
-  page.cache_settings = page_parts[3]
-  page.put()
+  store_many({resource_path: page_parts})
+
+
+def store_many(pages):
+  """Stores several pages with one datastore put and one cache update.
+
+  The cache is only updated once the datastore write has succeeded, so a
+  failed save never leaves content in the cache which was not stored. The
+  chunks of large pages are written first, in one more put, and a task is
+  queued to delete the chunks of the versions they replace.
+
+  Args:
+    pages: dict mapping the URL of each page to a tuple of strings which
+        contains (content, mime_type, last_updated, cache_settings)
+  """
+  entities = []
+  chunked_paths = []
+  chunks = []
+  for path, page_parts in pages.iteritems():
+    page, page_chunks = page_from_parts(path, page_parts)
+    # The words are stored in the same put as the page.
+    entities.extend([page, page_words(path, page_parts)])
+    if page_chunks:
+      chunked_paths.append(path)
+      chunks.extend(page_chunks)
+  if chunks:
+    db.put(chunks)
+  db.put(entities)
+  if chunks:
+    taskqueue.add(url='/content_chunk_cleanup',
+                  params={'path': chunked_paths,
+                          'before': int(time.time() * 1000000)},
+                  countdown=CHUNK_CLEANUP_DELAY_SECONDS)
+  update_index(added=pages.keys())
+  entries = {}
+  for path, page_parts in pages.iteritems():
+    entries.update(cache_entries(path, page_parts))
+  memcache.set_multi(entries, time=CACHE_HARD_TTL_SECONDS)
+
+
+# Number of pages removed by each deletion task, and the most db.delete
+# accepts in one call.
+DELETE_BATCH_SIZE = 200
+MAX_KEYS_PER_DELETE = 500
+
+
+def delete_pages(keys):
+  """Removes pages and their chunks, and drops them from the cache and indexes.
+
+  Deleting a page which does not exist does nothing.
+
+  Args:
+    keys: list of the keys of the Pages to delete.
+
+  Returns:
+    A list of the paths of the keys.
+  """
+  # Chunks left over from larger earlier versions are not counted by
+  # chunk_count, so every child is found with a keys only query.
+  deleted = list(keys)
+  # run() starts every query before any of the results are read.
+  queries = [PageChunk.all(keys_only=True).ancestor(key).run()
+             for key in keys]
+  for chunk_keys in queries:
+    deleted.extend(chunk_keys)
+  deleted.extend([db.Key.from_path('PageWords', key.name()) for key in keys])
+  for i in xrange(0, len(deleted), MAX_KEYS_PER_DELETE):
+    db.delete(deleted[i:i + MAX_KEYS_PER_DELETE])
+  paths = [key.name() for key in keys]
+  memcache.delete_multi(paths)
+  update_index(removed=paths)
+  return paths
+
+
+def delete_old_chunks(paths, before):
+  """Deletes the chunks of pages which are not part of their stored version.
+
+  Chunks written at or after before, in microseconds, are kept as they may
+  belong to a save which has not yet stored its page.
+  """
+  keys = [db.Key.from_path('Page', path) for path in paths]
+  # run() starts every query before any of the results are read.
+  queries = [PageChunk.all(keys_only=True).ancestor(key).run()
+             for key in keys]
+  old = []
+  for page, chunk_keys in zip(Page.get(keys), queries):
+    current = set()
+    if page:
+      current = set([chunk_key_name(page.chunk_version, i)
+                     for i in xrange(page.chunk_count or 0)])
+    for key in chunk_keys:
+      if (key.name() not in current and
+          chunk_written_time(key.name()) < before):
+        old.append(key)
+  for i in xrange(0, len(old), MAX_KEYS_PER_DELETE):
+    db.delete(old[i:i + MAX_KEYS_PER_DELETE])
+  return old
+
+
+def prefix_query(prefix):
+  """Returns a keys only query for the pages whose paths start with prefix."""
+  return Page.all(keys_only=True).filter(
+      '__key__ >=', db.Key.from_path('Page', prefix)).filter(
+      '__key__ <', db.Key.from_path('Page', prefix + u'\ufffd'))
 
 
 class MainPage(webapp.RequestHandler):
   def get(self):
-    page_parts = load_with_cache(self.request.path)
+    page_parts = prefetch([self.request.path], record_misses=True).get(
+        self.request.path)
     if page_parts:
       self.response.headers['Content-Type'] = page_parts[1] or 'text/html'
       if page_parts[2]:
         self.response.headers['Last-Modified'] = page_parts[2]
       if page_parts[3]:
-        self.response.headers['Cache-Control'] = page_parts[3]
-      self.response.out.write(page_parts[0])
+        self.response.headers['Cache-Control'] = with_stale_directives(
+            page_parts[3])
+      body = (page_parts[0] or u'').encode('utf-8')
+      self.response.out.write(body)
+      record_stats(self.request.path, hits=1, bytes_served=len(body))
     else:
       self.error(404)
       self.response.out.write('not found')
+      record_stats(self.request.path, hits=1)
       
     
 class ContentManager(webapp.RequestHandler):
@@ -121,7 +762,10 @@ class ContentManager(webapp.RequestHandler):
     
   def post(self):
     resource_path = self.request.get('path')
-    if resource_path:
+    if resource_path and not resource_path.startswith('/'):
+      self.error(400)
+      self.response.out.write('The path must start with /.')
+    elif resource_path:
       page_parts = (self.request.get('content'), self.request.get('type'),
                     self.request.get('updated'), self.request.get('cache'))
       store_and_cache(resource_path, page_parts)
@@ -133,10 +777,82 @@ class ContentManager(webapp.RequestHandler):
       self.response.out.write('bad path')
 
 
+class ContentDeleter(webapp.RequestHandler):
+  """Deletes the pages given as path parameters, or below a prefix.
+
+  Up to DELETE_BATCH_SIZE paths are deleted before responding. Longer lists
+  and prefixes, which may match any number of pages, are deleted by
+  background tasks.
+  """
+
+  def post(self):
+    prefix = self.request.get('prefix')
+    paths = self.request.get_all('path')
+    self.response.headers['Content-Type'] = 'text/plain'
+    if prefix:
+      if not prefix.startswith('/'):
+        self.error(400)
+        self.response.out.write('The prefix must start with /.')
+        return
+      taskqueue.add(url='/content_delete_task', params={'prefix': prefix})
+      self.response.out.write('queued deletion of %s' % prefix)
+    elif not paths:
+      self.error(400)
+      self.response.out.write('Give a path or a prefix to delete.')
+    elif len(paths) <= DELETE_BATCH_SIZE:
+      deleted = delete_pages([db.Key.from_path('Page', path)
+                              for path in paths])
+      self.response.out.write('deleted %d pages' % len(deleted))
+    else:
+      for i in xrange(0, len(paths), DELETE_BATCH_SIZE):
+        taskqueue.add(url='/content_delete_task',
+                      params={'path': paths[i:i + DELETE_BATCH_SIZE]})
+      self.response.out.write('queued deletion of %d pages' % len(paths))
+
+
+class ContentDeleteTask(webapp.RequestHandler):
+  """Deletes a batch of pages, run from the tasks queued by ContentDeleter.
+
+  Tasks for a prefix delete up to DELETE_BATCH_SIZE pages found with a keys
+  only query and queue a task to carry on from its cursor. A failed task is
+  retried from the same cursor, as deleting a page twice is harmless.
+  """
+
+  def post(self):
+    prefix = self.request.get('prefix')
+    if prefix:
+      query = prefix_query(prefix)
+      if self.request.get('cursor'):
+        query.with_cursor(self.request.get('cursor'))
+      keys = query.fetch(DELETE_BATCH_SIZE)
+      if len(keys) == DELETE_BATCH_SIZE:
+        taskqueue.add(url='/content_delete_task',
+                      params={'prefix': prefix, 'cursor': query.cursor()})
+    else:
+      keys = [db.Key.from_path('Page', path)
+              for path in self.request.get_all('path')]
+    deleted = delete_pages(keys)
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write('deleted %d pages' % len(deleted))
+
+
+class ContentChunkCleaner(webapp.RequestHandler):
+  """Deletes the chunks of replaced page versions, run from store_many."""
+
+  def post(self):
+    deleted = delete_old_chunks(self.request.get_all('path'),
+                                int(self.request.get('before')))
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write('deleted %d chunks' % len(deleted))
+
+
 class ContentLister(webapp.RequestHandler):
   FETCH_LIMIT = 30
 
   def get(self):
+    if self.request.get('dir'):
+      self.list_directory(self.request.get('dir'))
+      return
     next = self.request.get('next')
     if next:
       page_keys = db.GqlQuery(
@@ -158,12 +874,302 @@ class ContentLister(webapp.RequestHandler):
     if count > self.FETCH_LIMIT:
       self.response.out.write('<a href="/content_lister?next=%s">Next</a>' % (
           urllib.quote(page_keys[self.FETCH_LIMIT].name())))
-      
+    self.response.out.write('<br/><a href="/content_lister?dir=/">Browse</a>'
+                            ' <a href="/content_search">Search</a>')
+
+  def list_directory(self, directory):
+    """Lists the children of a directory from the directory index."""
+    if not directory.endswith('/'):
+      directory += '/'
+    entries = load_directory(directory)
+    self.response.out.write('%s: %d pages<br/>' % (
+        cgi.escape(directory), sum(entries.itervalues())))
+    parent = parent_directory(directory)[0]
+    if parent is not None:
+      self.response.out.write('<a href="/content_lister?dir=%s">Up</a><br/>'
+                              % urllib.quote(parent))
+    names = entries.keys()
+    names.sort()
+    for name in names:
+      path = directory + name
+      if name.endswith('/'):
+        self.response.out.write(
+            '<a href="/content_lister?dir=%s">%s</a> %d<br/>' % (
+                urllib.quote(path), cgi.escape(name), entries[name]))
+      else:
+        self.response.out.write(
+            'Edit <a href="/content_manager%s">%s</a><br/>' % (
+                urllib.quote(path), cgi.escape(name or '(index)')))
+
+
+class ContentSearch(webapp.RequestHandler):
+  def get(self):
+    """Lists the pages containing every word of the q parameter."""
+    query_string = self.request.get('q')
+    self.response.out.write(
+        '<form action="/content_search"><input name="q" size="50" value="%s">'
+        '<input type="submit" value="Search"></form>' % (
+            cgi.escape(query_string, True)))
+    if query_string:
+      for path in search_pages(query_string):
+        self.response.out.write(
+            'Edit <a href="/content_manager%s">%s</a><br/>' % (
+                urllib.quote(path.encode('utf-8')), cgi.escape(path)))
+
+
+class ContentSearchReindexer(webapp.RequestHandler):
+  """Rebuilds the PageWords of every page.
+
+  Each request indexes REINDEX_BATCH_SIZE pages and queues a task to carry
+  on from where it stopped, so the whole site is reindexed in the
+  background.
+  """
+  REINDEX_BATCH_SIZE = 100
+
+  def post(self):
+    query = Page.all()
+    if self.request.get('cursor'):
+      query.with_cursor(self.request.get('cursor'))
+    pages = query.fetch(self.REINDEX_BATCH_SIZE)
+    chunks = load_chunks(pages)
+    words = []
+    for page in pages:
+      path = page.key().name()
+      content = page.content
+      if path in chunks:
+        content = ''.join(chunks[path]).decode('utf-8')
+      words.append(page_words(path, (content, page.mime_type)))
+    db.put(words)
+    if len(pages) == self.REINDEX_BATCH_SIZE:
+      taskqueue.add(url='/content_search_reindex',
+                    params={'cursor': query.cursor()})
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write('indexed %d pages' % len(pages))
+
+
+class ContentIndexRebuilder(webapp.RequestHandler):
+  """Rebuilds the directory index from the key of every page.
+
+  Pages are indexed as they are saved, so this is only needed for pages
+  saved before the index existed. Run it from a task for large sites.
+  """
+
+  def post(self):
+    count = rebuild_index()
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write('indexed %d pages' % count)
+
     
-application = webapp.WSGIApplication([('/content_manager.*', ContentManager),
-                                      ('/content_lister.*', ContentLister), 
-                                      ('/.*', MainPage)],
-                                     debug=True)
+class ContentWarmer(webapp.RequestHandler):
+  """Preloads pages into memcache, for example after a deploy.
+
+  The pages to load are given as repeated path parameters, or as a top
+  parameter to load that many of the most requested paths, and default to
+  WARMUP_PATHS. Run this from a task or cron job before shifting traffic to a
+  new version.
+  """
+
+  def get(self):
+    paths = self.request.get_all('path')
+    if not paths and self.request.get('top'):
+      paths = hottest_paths(int(self.request.get('top')))
+    paths = paths or WARMUP_PATHS
+    loaded = 0
+    for i in xrange(0, len(paths), WARMUP_BATCH_SIZE):
+      loaded += len(prefetch(paths[i:i + WARMUP_BATCH_SIZE]))
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write('warmed %d of %d pages' % (loaded, len(paths)))
+
+  def post(self):
+    self.get()
+
+
+class InstanceWarmer(webapp.RequestHandler):
+  """Handles the /_ah/warmup request App Engine sends to new instances.
+
+  Importing the modules used by MainPage, making the first datastore and
+  memcache calls and loading the most requested pages happens here instead
+  of during the first user requests.
+  """
+
+  def get(self):
+    loaded = prefetch(WARMUP_PATHS + hottest_paths(INSTANCE_WARMUP_PATHS))
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write('warmed %d pages' % len(loaded))
+
+
+class ContentRefresher(webapp.RequestHandler):
+  """Reloads stale cache entries from the tasks queued by schedule_refresh."""
+
+  def post(self):
+    paths = self.request.get_all('path')
+    loaded = load_and_cache(paths)
+    # Pages which have been removed from the datastore leave the cache too.
+    memcache.delete_multi([path for path in paths if path not in loaded])
+    memcache.delete_multi(paths, key_prefix='refresh:')
+
+
+class ContentStats(webapp.RequestHandler):
+  SORT_COLUMNS = {'misses': CACHE_MISSES, 'datastore': DATASTORE_MS,
+                  'bytes': BYTES_SERVED}
+
+  def get(self):
+    flush_stats()
+    totals = load_stats()
+    column = self.SORT_COLUMNS.get(self.request.get('sort'), HITS)
+    paths = sorted(totals, key=lambda path: totals[path][column],
+                   reverse=True)
+    self.response.out.write('<html><body><table><tr><th>Path</th>'
+        '<th><a href="?sort=hits">Hits</a></th>'
+        '<th><a href="?sort=misses">Cache misses</a></th>'
+        '<th><a href="?sort=datastore">Datastore ms</a></th>'
+        '<th><a href="?sort=bytes">Bytes served</a></th></tr>')
+    for path in paths[:200]:
+      counters = totals[path]
+      self.response.out.write(
+          '<tr><td>%s</td><td>%d</td><td>%d</td><td>%.1f</td><td>%d</td>'
+          '</tr>' % (cgi.escape(path), counters[HITS], counters[CACHE_MISSES],
+                     counters[DATASTORE_MS], counters[BYTES_SERVED]))
+    self.response.out.write('</table></body></html>')
+
+
+class ContentProfile(webapp.RequestHandler):
+  """Returns the profiles recorded by this instance as collapsed stacks.
+
+  The output can be given to flamegraph.pl or speedscope. A route parameter
+  limits it to one route, such as / for pages, and a POST with reset=1
+  clears the profiles.
+  """
+
+  def get(self):
+    route = self.request.get('route')
+    lines = ['%s %d' % (';'.join(stack), round(seconds * 1e6))
+             for stack, seconds in profile_stacks.iteritems()
+             if not route or stack[0] == route]
+    lines.sort()
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write(''.join([line + '\n' for line in lines]))
+
+  def post(self):
+    if self.request.get('reset'):
+      profile_stacks.clear()
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write('reset profiles')
+
+
+# Every admin page starts with this prefix, so other requests, which are
+# nearly all of them, go straight to MainPage after one check instead of
+# trying each admin route's regex in turn. Each admin route is a path, or a
+# prefix when the flag is True, checked in order.
+ADMIN_PREFIX = '/content_'
+ADMIN_ROUTES = [('/content_manager', True, ContentManager),
+                ('/content_delete', False, ContentDeleter),
+                ('/content_delete_task', False, ContentDeleteTask),
+                ('/content_chunk_cleanup', False, ContentChunkCleaner),
+                ('/content_lister', True, ContentLister),
+                ('/content_index_rebuild', False, ContentIndexRebuilder),
+                ('/content_search', False, ContentSearch),
+                ('/content_search_reindex', False, ContentSearchReindexer),
+                ('/content_warmup', False, ContentWarmer),
+                ('/content_stats', False, ContentStats),
+                ('/content_refresh', False, ContentRefresher),
+                ('/content_profile', False, ContentProfile)]
+
+
+def handler_application(handler_class):
+  """Returns a WSGI application which sends every request to one handler."""
+  return webapp.WSGIApplication([('.*', handler_class)], debug=True)
+
+
+main_page_application = handler_application(MainPage)
+warmup_application = handler_application(InstanceWarmer)
+admin_applications = [(route, is_prefix, handler_application(handler_class))
+                      for route, is_prefix, handler_class in ADMIN_ROUTES]
+
+
+# One request in every PROFILE_SAMPLE_EVERY, or none when 0, is profiled,
+# as is every request from an admin which has the X-Profile header. The time
+# spent in each function, with the calls leading to it, is added up in
+# profile_stacks by route, and written out as collapsed stacks by
+# ContentProfile. Requests which are not profiled only cost a counter and a
+# header lookup.
+PROFILE_SAMPLE_EVERY = 1000
+PROFILE_TRIGGER_KEY = 'HTTP_X_PROFILE'
+# Time in new stacks beyond this many is recorded against the route alone.
+MAX_PROFILE_STACKS = 5000
+
+profile_stacks = {}
+request_count = 0
+
+
+class StackRecorder(object):
+  """The sys.setprofile function for one request, adding up time by stack."""
+
+  def __init__(self, route):
+    self.stack = [route]
+    self.times = {}
+    self.last = time.time()
+
+  def __call__(self, frame, event, arg):
+    now = time.time()
+    stack = tuple(self.stack)
+    self.times[stack] = self.times.get(stack, 0) + now - self.last
+    if event == 'call':
+      code = frame.f_code
+      self.stack.append('%s.%s:%d' % (frame.f_globals.get('__name__', '?'),
+                                      code.co_name, code.co_firstlineno))
+    elif event == 'c_call':
+      self.stack.append('%s.%s' % (
+          getattr(arg, '__module__', None) or 'builtin',
+          getattr(arg, '__name__', '?')))
+    # Calls made before profiling started return without being recorded, so
+    # the route is never removed.
+    elif len(self.stack) > 1:
+      self.stack.pop()
+    # Time spent in here is left out of the profile.
+    self.last = time.time()
+
+
+def add_profile(times):
+  for stack, seconds in times.iteritems():
+    if (stack not in profile_stacks and
+        len(profile_stacks) >= MAX_PROFILE_STACKS):
+      stack = stack[:1]
+    profile_stacks[stack] = profile_stacks.get(stack, 0) + seconds
+
+
+def should_profile(environ):
+  global request_count
+  request_count += 1
+  if PROFILE_SAMPLE_EVERY and request_count % PROFILE_SAMPLE_EVERY == 0:
+    return True
+  # App Engine sets USER_IS_ADMIN for signed in admins.
+  return (PROFILE_TRIGGER_KEY in environ and
+          environ.get('USER_IS_ADMIN') == '1')
+
+
+def route_for(path):
+  """Returns the name of the route for a path and the application for it."""
+  if path == '/_ah/warmup':
+    return path, warmup_application
+  if path.startswith(ADMIN_PREFIX):
+    for route, is_prefix, route_application in admin_applications:
+      if path == route or (is_prefix and path.startswith(route)):
+        return route, route_application
+  return '/', main_page_application
+
+
+def application(environ, start_response):
+  route, route_application = route_for(environ.get('PATH_INFO', ''))
+  if not should_profile(environ):
+    return route_application(environ, start_response)
+  recorder = StackRecorder(route)
+  sys.setprofile(recorder)
+  try:
+    return route_application(environ, start_response)
+  finally:
+    sys.setprofile(None)
+    add_profile(recorder.times)
 
 def main():
   run_wsgi_app(application)
@@ -0,0 +1,334 @@
+# This script exports every resource served by the content management
+# system in http_server into a directory of static files, with an app.yaml
+# which serves them as App Engine static files. The exported site can then
+# be deployed in place of the CMS, for example during a traffic spike or an
+# outage of the datastore.
+#
+# Run this script with the directory to write the site into and the address
+# of the CMS as arguments. Since the export endpoint requires an admin login,
+# pass the value of your signed in session cookie as the third argument when
+# exporting from a deployed app.
+#
+# Example:
+# python export_cms_site.py exported_site \
+#     https://<your-project-id>.appspot.com 'SACSID=...'
+#
+# The CMS lists its resources a page at a time, and the content of each page
+# of resources is fetched from the site by a pool of worker threads, so the
+# files are exactly what the CMS serves, including rendered includes. Each
+# file is written as soon as it has been fetched. The root page (/) and
+# other paths ending in / are written as index.html files. When two paths
+# would be written to the same file, such as / and /index.html, or one needs
+# a directory where the other is a file, such as /docs/ and /docs, only the
+# first one listed is exported.
+#
+# The content type, Expires lifetime and custom headers of each resource are
+# kept in the generated app.yaml. Resources which are served correctly by
+# the handlers for the whole site get no handler of their own, since App
+# Engine accepts at most MAX_HANDLERS handlers.
+
+import codecs
+import json
+import os
+import re
+import sys
+import urllib
+import urllib2
+from multiprocessing.pool import ThreadPool
+
+from publish_to_cms import guess_content_type
+
+
+EXPORT_PATH = '/content_export_json'
+
+# Number of resources fetched at the same time.
+WORKER_THREADS = 16
+
+MAX_HANDLERS = 100
+
+APP_YAML_PREAMBLE = '''runtime: python27
+api_version: 1
+threadsafe: true
+default_expiration: "%ds"
+
+handlers:
+'''
+
+RESOURCE_HANDLER_TEMPLATE = '''
+- url: %s
+  static_files: %s
+  upload: %s
+  mime_type: %s
+  expiration: "%ds"
+'''
+
+STATIC_FILE_TEMPLATE = '''
+- url: %s
+  static_files: %s
+  upload: %s
+'''
+
+STATIC_DIRECTORY_TEMPLATE = '''
+- url: %s
+  static_dir: %s
+'''
+
+# Serves the index.html file of each directory at the directory's path.
+DIRECTORY_INDEX_HANDLER = r'''
+- url: /(.+/)
+  static_files: '\1index.html'
+  upload: '.+/index\.html'
+'''
+
+# Serves every file by its name, in place of a handler for each top level
+# file and directory when there are too many of those.
+ANY_FILE_HANDLER = r'''
+- url: /((?!app\.yaml$).+)
+  static_files: '\1'
+  upload: '(?!app\.yaml$).+'
+'''
+
+REGEX_SPECIAL_CHARACTERS = re.compile(r'([.^$*+?{}\[\]\\|()])')
+
+
+def yaml_quote(value):
+    return "'%s'" % value.replace("'", "''")
+
+
+def regex_escape(value):
+    return REGEX_SPECIAL_CHARACTERS.sub(r'\\\1', value)
+
+
+def file_name_for(path):
+    """Returns the file a path is exported to, or None if it cannot be."""
+    if not path.startswith('/'):
+        return None
+    file_name = path[1:]
+    if not file_name or file_name.endswith('/'):
+        file_name += 'index.html'
+    segments = file_name.split('/')
+    if '' in segments or '.' in segments or '..' in segments:
+        return None
+    if file_name == 'app.yaml':
+        return None
+    return file_name
+
+
+class FileNames(object):
+    """The files claimed by exported paths, to find paths which clash."""
+
+    def __init__(self):
+        # Map each file, and each directory holding one, to the path which
+        # claimed it.
+        self.files = {}
+        self.directories = {}
+
+    def claim(self, path, file_name):
+        """Claims file_name for path, unless it clashes with another path.
+
+        Returns:
+          The path which already claimed the file, or a file or directory in
+          the way of it, or None if path may be exported to file_name.
+        """
+        if file_name in self.files:
+            return self.files[file_name]
+        if file_name in self.directories:
+            return self.directories[file_name]
+        segments = file_name.split('/')
+        parents = ['/'.join(segments[:i]) for i in xrange(1, len(segments))]
+        for parent in parents:
+            if parent in self.files:
+                return self.files[parent]
+        self.files[file_name] = path
+        for parent in parents:
+            self.directories.setdefault(parent, path)
+        return None
+
+
+def get_json(cms_url, cookie, cursor):
+    url = cms_url + EXPORT_PATH
+    if cursor:
+        url += '?' + urllib.urlencode({'cursor': cursor})
+    request = urllib2.Request(url)
+    if cookie:
+        request.add_header('Cookie', cookie)
+    return json.loads(urllib2.urlopen(request).read())
+
+
+def iter_resource_pages(cms_url, cookie):
+    """Yields the lists of resources returned by each page of the export."""
+    cursor = None
+    while True:
+        export_data = get_json(cms_url, cookie, cursor)
+        yield export_data['resources']
+        cursor = export_data['cursor']
+        if not cursor:
+            return
+
+
+def export_resource(site_dir, cms_url, resource, file_name):
+    """Fetches a resource from the site and writes it to file_name.
+
+    Returns:
+      The file name the resource was written to, or None if it was skipped.
+    """
+    try:
+        url = cms_url + urllib.quote(resource['path'].encode('utf-8'))
+        data = urllib2.urlopen(url).read()
+        full_name = os.path.join(site_dir, *file_name.split('/'))
+        if not os.path.isdir(os.path.dirname(full_name)):
+            os.makedirs(os.path.dirname(full_name))
+        site_file = open(full_name, 'wb')
+        site_file.write(data)
+        site_file.close()
+    except (urllib2.URLError, IOError, OSError) as e:
+        print('Skipped         %s (%s)' % (resource['path'], e))
+        return None
+    print('Exported        %s' % resource['path'])
+    return file_name
+
+
+def expires_seconds(resource):
+    # Resources without an Expires header are not cached.
+    return max(resource['expires'] or 0, 0)
+
+
+def needs_own_handler(resource, file_name, default_expiration):
+    return (resource['headers'] or
+            expires_seconds(resource) != default_expiration or
+            guess_content_type(file_name) != resource['ctype'])
+
+
+def resource_handler(resource, file_name):
+    handler = RESOURCE_HANDLER_TEMPLATE % (
+            yaml_quote(regex_escape(resource['path'])),
+            yaml_quote(file_name), yaml_quote(regex_escape(file_name)),
+            yaml_quote(resource['ctype']), expires_seconds(resource))
+    if resource['headers']:
+        handler += '  http_headers:\n'
+        for name, value in resource['headers']:
+            handler += '    %s: %s\n' % (name, yaml_quote(value))
+    return handler
+
+
+def site_handlers(file_names):
+    """Returns the handlers which serve every file by its name.
+
+    Each top level file and directory gets its own handler, unless that
+    would take more than MAX_HANDLERS handlers.
+    """
+    handlers = []
+    top_level = set([file_name.split('/')[0] for file_name in file_names])
+    if [file_name for file_name in file_names
+            if file_name.endswith('/index.html')]:
+        # This goes before the directory handlers, which would otherwise
+        # match directory paths.
+        handlers.append(DIRECTORY_INDEX_HANDLER)
+    if 'index.html' in top_level:
+        handlers.append(STATIC_FILE_TEMPLATE % (
+                "'/'", "'index.html'", r"'index\.html'"))
+    named_handlers = []
+    for name in sorted(top_level):
+        if name in file_names:
+            named_handlers.append(STATIC_FILE_TEMPLATE % (
+                    yaml_quote('/' + regex_escape(name)), yaml_quote(name),
+                    yaml_quote(regex_escape(name))))
+        else:
+            named_handlers.append(STATIC_DIRECTORY_TEMPLATE % (
+                    yaml_quote('/' + regex_escape(name)), yaml_quote(name)))
+    if len(handlers) + len(named_handlers) > MAX_HANDLERS:
+        handlers.append(ANY_FILE_HANDLER)
+    else:
+        handlers.extend(named_handlers)
+    return handlers
+
+
+def write_app_yaml(site_dir, exported):
+    """Writes the app.yaml serving the exported (resource, file name) list."""
+    lifetimes = {}
+    for resource, file_name in exported:
+        lifetime = expires_seconds(resource)
+        lifetimes[lifetime] = lifetimes.get(lifetime, 0) + 1
+    default_expiration = 0
+    if lifetimes:
+        default_expiration = max(lifetimes, key=lifetimes.get)
+
+    handlers = site_handlers(set([file_name for resource, file_name
+                                  in exported]))
+    own_handlers = [resource_handler(resource, file_name)
+                    for resource, file_name in sorted(
+                            exported, key=lambda entry: entry[1])
+                    if needs_own_handler(resource, file_name,
+                                         default_expiration)]
+    room = MAX_HANDLERS - len(handlers)
+    if len(own_handlers) > room:
+        print('Warning: the headers of %d resources were left out, as '
+              'App Engine allows at most %d handlers' % (
+                      len(own_handlers) - max(room, 0), MAX_HANDLERS))
+        own_handlers = own_handlers[:max(room, 0)]
+
+    # Paths and headers come from JSON as unicode, and may not be ASCII.
+    app_yaml = codecs.open(os.path.join(site_dir, 'app.yaml'), 'w', 'utf-8')
+    app_yaml.write(APP_YAML_PREAMBLE % default_expiration)
+    # Handlers are matched in order, so those for single resources go first.
+    for handler in own_handlers + handlers:
+        app_yaml.write(handler)
+    app_yaml.close()
+    print('Generated       %s' % os.path.join(site_dir, 'app.yaml'))
+
+
+def claim_file_names(resources, file_names):
+    """Returns the (resource, file name) tuples of the resources to export.
+
+    Resources which cannot be exported, or which clash with one already
+    claimed, are skipped with a message.
+    """
+    claimed = []
+    for resource in resources:
+        file_name = file_name_for(resource['path'])
+        if file_name is None:
+            print('Skipped         %s (not a file path)' % resource['path'])
+            continue
+        clash = file_names.claim(resource['path'], file_name)
+        if clash is not None:
+            print('Skipped         %s (clashes with %s)' % (
+                    resource['path'], clash))
+            continue
+        claimed.append((resource, file_name))
+    return claimed
+
+
+def export(site_dir, cms_url, cookie):
+    pool = ThreadPool(WORKER_THREADS)
+    file_names = FileNames()
+    exported = []
+    for resources in iter_resource_pages(cms_url, cookie):
+        claimed = claim_file_names(resources, file_names)
+        written = pool.map(
+                lambda entry: export_resource(site_dir, cms_url, *entry),
+                claimed)
+        for (resource, file_name), written_name in zip(claimed, written):
+            if written_name is not None:
+                exported.append((resource, file_name))
+    pool.close()
+    print('%d resources exported' % len(exported))
+    write_app_yaml(site_dir, exported)
+
+
+def main():
+    if len(sys.argv) < 3:
+        print('Provide the directory to export the website into and the '
+              'address of the CMS.')
+        print('For example, run %s exported_site http://localhost:8080' % (
+            sys.argv[0],))
+        return 1
+
+    cookie = None
+    if len(sys.argv) > 3:
+        cookie = sys.argv[3]
+    export(sys.argv[1], sys.argv[2].rstrip('/'), cookie)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
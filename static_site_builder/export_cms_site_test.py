@@ -0,0 +1,112 @@
+import codecs
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import export_cms_site
+
+
+def resource(path, ctype='text/html', expires=3600, headers=()):
+    return {'path': path, 'ctype': ctype, 'expires': expires,
+            'headers': [list(header) for header in headers], 'hash': 'x'}
+
+
+class FileNameTest(unittest.TestCase):
+
+    def test_file_name_for(self):
+        self.assertEqual(export_cms_site.file_name_for('/'), 'index.html')
+        self.assertEqual(export_cms_site.file_name_for('/docs/'),
+                         'docs/index.html')
+        self.assertEqual(export_cms_site.file_name_for('/css/site.css'),
+                         'css/site.css')
+        for path in ('docs', '/a//b', '/../secret', '/a/./b', '/app.yaml'):
+            self.assertEqual(export_cms_site.file_name_for(path), None)
+
+    def test_clashes(self):
+        file_names = export_cms_site.FileNames()
+        self.assertEqual(file_names.claim('/', 'index.html'), None)
+        self.assertEqual(file_names.claim('/index.html', 'index.html'), '/')
+        self.assertEqual(file_names.claim('/docs', 'docs'), None)
+        self.assertEqual(file_names.claim('/docs/', 'docs/index.html'),
+                         '/docs')
+        self.assertEqual(file_names.claim('/api/a', 'api/a'), None)
+        self.assertEqual(file_names.claim('/api/b', 'api/b'), None)
+        self.assertEqual(file_names.claim('/api', 'api'), '/api/a')
+
+    def test_claim_file_names_skips_clashes(self):
+        output = StringIO()
+        sys.stdout, stdout = output, sys.stdout
+        try:
+            claimed = export_cms_site.claim_file_names(
+                    [resource('/'), resource('/index.html'),
+                     resource('/about')],
+                    export_cms_site.FileNames())
+        finally:
+            sys.stdout = stdout
+        self.assertEqual([file_name for entry, file_name in claimed],
+                         ['index.html', 'about'])
+        self.assertIn('/index.html (clashes with /)', output.getvalue())
+
+    def test_escaping(self):
+        self.assertEqual(export_cms_site.regex_escape('/a.b(c)+[d]'),
+                         r'/a\.b\(c\)\+\[d\]')
+        self.assertEqual(export_cms_site.yaml_quote("it's"), "'it''s'")
+
+
+class AppYamlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.site_dir = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.site_dir)
+
+    def app_yaml_urls(self, exported):
+        export_cms_site.write_app_yaml(self.site_dir, exported)
+        app_yaml = codecs.open(os.path.join(self.site_dir, 'app.yaml'),
+                               encoding='utf-8').read()
+        return [line[len('- url: '):] for line in app_yaml.splitlines()
+                if line.startswith('- url: ')]
+
+    def test_handler_order(self):
+        urls = self.app_yaml_urls([
+                (resource('/'), 'index.html'),
+                (resource('/docs/'), 'docs/index.html'),
+                (resource('/css/site.css', 'text/css'), 'css/site.css'),
+                (resource('/robots.txt', 'text/plain', 60), 'robots.txt'),
+        ])
+        # The resource with its own lifetime goes first, then the directory
+        # index handler, then the handlers for each top level name.
+        self.assertEqual(urls, [r"'/robots\.txt'", '/(.+/)', "'/'",
+                                "'/css'", "'/docs'", r"'/index\.html'",
+                                r"'/robots\.txt'"])
+
+    def test_non_ascii_paths(self):
+        urls = self.app_yaml_urls([
+                (resource(u'/caf\xe9', headers=[(u'X-Caf\xe9', u'cr\xe8me')]),
+                 u'caf\xe9'),
+        ])
+        self.assertEqual(urls, [u"'/caf\xe9'"] * 2)
+
+    def test_handlers_are_capped(self):
+        exported = [(resource('/page-%d.html' % i, headers=[('X-A', 'b')]),
+                     'page-%d.html' % i)
+                    for i in xrange(export_cms_site.MAX_HANDLERS + 10)]
+        urls = self.app_yaml_urls(exported)
+        self.assertEqual(len(urls), export_cms_site.MAX_HANDLERS)
+        # One handler serves every file, leaving the rest for the headers
+        # of as many resources as fit.
+        self.assertEqual(urls[-1], r'/((?!app\.yaml$).+)')
+        self.assertEqual(urls[0], r"'/page-0\.html'")
+        self.assertIn('headers of 11 resources were left out',
+                      sys.stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
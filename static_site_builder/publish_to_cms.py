@@ -0,0 +1,167 @@
+# This script publishes a built static site into the content management
+# system in http_server so that the pages are served by its ResourceRenderer
+# instead of being deployed as App Engine static files.
+#
+# Run this script with the directory containing the website contents and the
+# address of the CMS as arguments. Since the publishing endpoint requires an
+# admin login, pass the value of your signed in session cookie as the third
+# argument when publishing to a deployed app.
+#
+# Example:
+# python publish_to_cms.py example_site https://<your-project-id>.appspot.com \
+#     'SACSID=...'
+#
+# Publishing is incremental. The script sends the SHA-1 of every file, in
+# batches, and the CMS replies with the paths whose stored content differs,
+# so only new and changed files are uploaded. The index.html file at the root
+# of the site is published as the root page (/). Files which are not UTF-8
+# text, such as images, are sent base64 encoded and stored as binary
+# resources.
+
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+import urllib2
+
+
+PUBLISH_PATH = '/content_publish_json'
+
+# Upload changed files in batches which stay well below the request size
+# limit.
+MAX_BATCH_FILES = 50
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+
+# Cache lifetimes for the Expires header, chosen by content type. Pages change
+# more often than the assets they refer to.
+DEFAULT_EXPIRES_SECONDS = 3600
+EXPIRES_SECONDS_BY_TYPE = {
+    'text/html': 600,
+    'text/plain': 3600,
+    'text/css': 86400,
+    'application/javascript': 86400,
+    'image/png': 604800,
+    'image/jpeg': 604800,
+    'image/gif': 604800,
+    'image/svg+xml': 604800,
+}
+
+
+def find_site_files(site_dir):
+    """Returns a list of (resource path, file name) for the site's files."""
+    site_files = []
+    for dir_name, dir_names, file_names in os.walk(site_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            full_name = os.path.join(dir_name, file_name)
+            relative_name = os.path.relpath(full_name, site_dir).replace(
+                    os.sep, '/')
+            if relative_name == 'app.yaml':
+                continue
+            elif relative_name == 'index.html':
+                site_files.append(('/', full_name))
+            else:
+                site_files.append(('/' + relative_name, full_name))
+    return site_files
+
+
+def guess_content_type(file_name):
+    content_type = mimetypes.guess_type(file_name)[0]
+    if content_type is None:
+        return 'application/octet-stream'
+    return content_type
+
+
+def build_resource_data(file_name, data):
+    """Creates the content manager JSON for a file with precomputed caching."""
+    content_type = guess_content_type(file_name)
+    resource_data = {
+        'ctype': content_type,
+        'incdate': 'true',
+        'expires': EXPIRES_SECONDS_BY_TYPE.get(
+                content_type, DEFAULT_EXPIRES_SECONDS),
+        'headers': [],
+    }
+    try:
+        resource_data['content'] = data.decode('utf-8')
+    except UnicodeDecodeError:
+        resource_data['content'] = base64.b64encode(data)
+        resource_data['encoding'] = 'base64'
+    return resource_data
+
+
+def post_json(cms_url, cookie, data):
+    request = urllib2.Request(cms_url + PUBLISH_PATH, json.dumps(data),
+                              {'Content-Type': 'application/json'})
+    if cookie:
+        request.add_header('Cookie', cookie)
+    return json.loads(urllib2.urlopen(request).read())
+
+
+def upload_batch(cms_url, cookie, batch):
+    post_json(cms_url, cookie, {'resources': batch})
+    for path in sorted(batch):
+        print('Published       %s' % path)
+
+
+def read_site_files(site_files):
+    """Reads the files and returns a dict of path to their bytes."""
+    contents = {}
+    for path, file_name in site_files:
+        site_file = open(file_name, 'rb')
+        contents[path] = site_file.read()
+        site_file.close()
+    return contents
+
+
+def publish(site_dir, cms_url, cookie):
+    site_files = find_site_files(site_dir)
+    file_names = dict(site_files)
+    contents = read_site_files(site_files)
+    hashes = {}
+    for path, data in contents.iteritems():
+        hashes[path] = hashlib.sha1(data).hexdigest()
+
+    # Hashes are compared in batches, so each request only looks up as
+    # many paths as an upload stores.
+    paths = sorted(hashes)
+    changed = []
+    for i in xrange(0, len(paths), MAX_BATCH_FILES):
+        batch_hashes = dict((path, hashes[path])
+                            for path in paths[i:i + MAX_BATCH_FILES])
+        changed.extend(post_json(cms_url, cookie,
+                                 {'hashes': batch_hashes})['changed'])
+    print('%d of %d files changed' % (len(changed), len(hashes)))
+
+    batch = {}
+    batch_bytes = 0
+    for path in changed:
+        batch[path] = build_resource_data(file_names[path], contents[path])
+        batch_bytes += len(contents[path])
+        if len(batch) >= MAX_BATCH_FILES or batch_bytes >= MAX_BATCH_BYTES:
+            upload_batch(cms_url, cookie, batch)
+            batch = {}
+            batch_bytes = 0
+    if batch:
+        upload_batch(cms_url, cookie, batch)
+
+
+def main():
+    if len(sys.argv) < 3:
+        print('Provide a directory which contains the website files and the '
+              'address of the CMS.')
+        print('For example, run %s example_site http://localhost:8080' % (
+            sys.argv[0],))
+        return 1
+
+    cookie = None
+    if len(sys.argv) > 3:
+        cookie = sys.argv[3]
+    publish(sys.argv[1], sys.argv[2].rstrip('/'), cookie)
+    return 0
+
+
+if __name__ == '__main__':
+    main()